@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from AsyncSocket import AsyncSocket
+from AudioIO import AudioIO, MIC_QUEUE_SIZE
+from Realtime import Realtime
+
+log = logging.getLogger(__name__)
+
+
+class AsyncRealtime(Realtime):
+    """
+    Realtime session driven by an asyncio event loop instead of worker threads.
+
+    Message handling and the callback surface are inherited from Realtime; only
+    transport and mic hand-off differ. Many sessions can share one loop.
+    """
+
+    def __init__(self, api_key, ws_url, mic_queue_size=MIC_QUEUE_SIZE, connect_kwargs=None, **kwargs):
+        self.connect_kwargs = connect_kwargs
+        self.loop = None
+        self.mic_queue = asyncio.Queue(maxsize=mic_queue_size)
+        self.mic_dropped = 0
+        self._tasks = []
+        super().__init__(api_key, ws_url, **kwargs)
+        self.metrics.counter('mic_dropped_total', 'Mic chunks dropped because the event loop fell behind',
+                             fn=lambda: self.mic_dropped)
+
+    def _make_socket(self, api_key, ws_url):
+        return AsyncSocket(api_key, ws_url, on_msg=self.handle_message, connect_kwargs=self.connect_kwargs,
+                           metrics=self.metrics, **self.socket_options)
+
+    def _make_audio_io(self):
+        return AudioIO(mic_sink=self._mic_from_thread, backend=self.audio_backend, echo_cancel=self.echo_cancel,
+                       wire_rate=self.wire_rate, metrics=self.metrics, **self.audio_options)
+
+    def _mic_from_thread(self, mic_chunk):
+        """ Runs on the PortAudio thread: hop onto the event loop. """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._put_mic, mic_chunk)
+
+    def _put_mic(self, mic_chunk):
+        # Stale audio is worth less than fresh audio, so drop the oldest chunk when full
+        if self.mic_queue.full():
+            self.mic_queue.get_nowait()
+            self.mic_dropped += 1
+        self.mic_queue.put_nowait(mic_chunk)
+
+    def _send_from_audio_thread(self, data):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.socket.send, data)
+
+    async def _pump_mic_audio(self):
+        """ Forward mic chunks to the socket, pausing while the send queue is full. """
+        while True:
+            mic_chunk = await self.mic_queue.get()
+            self.send_audio_to_socket(mic_chunk)
+            await self.socket.drain()
+
+    async def connect(self):
+        """ Open the WebSocket without starting the conversation, e.g. to pre-warm a session. """
+        if not self.socket.connected:
+            await self.socket.connect()
+
+    async def start(self):
+        """ Start WebSocket and audio processing on the running event loop. """
+        self.loop = asyncio.get_running_loop()
+        self.tools.loop = self.loop  # Tools run as tasks on this loop
+        await self.connect()
+        self._send_initial_request()
+
+        self._tasks.append(asyncio.create_task(self._pump_mic_audio()))
+        self.audio_io.start_streams()
+
+    async def wait_closed(self):
+        await self.socket.wait_closed()
+
+    async def stop(self):
+        """ Cancel all session tasks and release the connection and audio streams. """
+        log.info('Shutting down Realtime session.')
+        self.loop = None  # Stop accepting mic audio from the PortAudio thread
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.tools.shutdown()
+
+        await self.socket.kill()
+        self.audio_io.stop_streams()
+        self.transcripts.close()
+        self.conversation.close()
+        if self.recorder:
+            self.recorder.close()
+        log.info('Realtime session stopped.')
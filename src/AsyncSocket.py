@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import logging
+import time
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+import Codec
+from Backoff import Backoff
+from BoundedQueue import AsyncBoundedQueue
+from Metrics import Registry, DEPTH_BUCKETS, RESPONSE_BUCKETS
+from Socket import (AUDIO_DEADLINE_MS, MAX_RETRIES, SEND_BATCH_MAX, SEND_OVERFLOW, SEND_QUEUE_SIZE, STALE_AUDIO,
+                    STALE_AUDIO_S, _is_audio, _merge_audio)
+from Telemetry import Payload
+
+log = logging.getLogger(__name__)
+
+
+class AsyncSocket:
+    """ asyncio counterpart of Socket: one reader task and one writer task on the caller's event loop. """
+
+    def __init__(self, api_key, ws_url, on_msg=None, send_queue_size=SEND_QUEUE_SIZE, send_batch_max=SEND_BATCH_MAX,
+                 connect_kwargs=None, metrics=None, reconnect=True, max_retries=MAX_RETRIES, stale_audio=STALE_AUDIO,
+                 stale_audio_s=STALE_AUDIO_S, send_overflow=SEND_OVERFLOW, audio_deadline_ms=AUDIO_DEADLINE_MS):
+        self.api_key = api_key
+        self.ws_url = ws_url
+        self.connect_kwargs = connect_kwargs or {}  # Passed through to websockets' connect(), e.g. ssl/host
+        self.ws = None
+        self.connect_time = None  # Seconds spent in the opening handshake
+        self.on_msg = on_msg  # Callback for when a message is received
+        self.accepts = None  # Optional predicate on the event type; rejected frames aren't parsed (audio deltas are)
+        self.recorder = None  # Recording.Recorder that gets every message sent and frame received
+        # Outgoing (enqueued_at, message), with Socket's bound, overflow policies and audio deadline; under 'block',
+        # producers await drain() for room
+        self.send_queue = AsyncBoundedQueue(send_queue_size, send_overflow, droppable=_is_audio, coalesce=_merge_audio,
+                                            max_age=audio_deadline_ms / 1000 if audio_deadline_ms else None)
+        self.send_batch_max = send_batch_max
+        self._tasks = []
+
+        # Reconnect: as in Socket, the reader reopens the connection with backoff while the writer holds its messages
+        self.reconnect = reconnect
+        self.max_retries = max_retries
+        self.stale_audio = stale_audio
+        self.stale_audio_s = stale_audio_s
+        self.on_disconnect = None  # Called as on_disconnect(reason) when the connection drops
+        self.on_reconnect = None   # Called as on_reconnect(info) once a new connection is up and replayed
+        self.replay = None         # Returns the messages to send first on a new connection (session state)
+        self._connected = asyncio.Event()
+        self._unsent = collections.deque()
+        self._replayed = {}  # id -> message sent by the last replay; the writer skips these if they are still held
+        self.replay_skipped = 0
+        self._drop_audio_before = 0.0
+        self.reconnects = 0
+        self.audio_dropped = 0
+
+        # Enqueue-to-wire latency, in seconds
+        self.sent_count = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self.send_latency_last = 0.0
+
+        self.metrics = metrics or Registry()
+        self._send_delay = self.metrics.histogram('send_delay_seconds', 'Enqueue-to-wire delay of outgoing messages')
+        self._send_depth = self.metrics.histogram('send_queue_depth', 'Messages queued when the writer wakes up',
+                                                  DEPTH_BUCKETS)
+        self._dispatch_time = self.metrics.histogram('recv_dispatch_seconds', 'Decode and handling time per message')
+        self._received = self.metrics.counter('messages_received_total', 'Messages received')
+        self._bytes_received = self.metrics.counter('bytes_received_total', 'Bytes received')
+        self._bytes_sent = self.metrics.counter('bytes_sent_total', 'Bytes sent')
+        self.metrics.counter('messages_sent_total', 'Messages sent', fn=lambda: self.sent_count)
+        self.metrics.gauge('connect_seconds', 'Opening handshake time', fn=lambda: self.connect_time or 0.0)
+        self._downtime = self.metrics.histogram('reconnect_seconds', 'Connection lost to reconnected and replayed',
+                                                RESPONSE_BUCKETS)
+        self._disconnects = self.metrics.counter('disconnects_total', 'Connections lost')
+        self.metrics.counter('stale_audio_dropped_total', 'Queued mic chunks dropped as stale after a reconnect',
+                             fn=lambda: self.audio_dropped)
+        self.metrics.counter('replay_skipped_total', 'Held messages not sent because the replay already had them',
+                             fn=lambda: self.replay_skipped)
+        send_queue = self.send_queue
+        self.metrics.counter('send_dropped_total', 'Mic audio messages dropped by the send queue overflow policy',
+                             fn=lambda: send_queue.dropped)
+        self.metrics.counter('send_expired_total', 'Mic audio messages discarded for missing the audio deadline',
+                             fn=lambda: send_queue.expired)
+        self.metrics.counter('send_coalesced_total', 'Mic audio messages merged into the one queued before them',
+                             fn=lambda: send_queue.coalesced)
+
+    async def _open(self):
+        return await connect(
+            self.ws_url,
+            additional_headers={'Authorization': f'Bearer {self.api_key}', 'OpenAI-Beta': 'realtime=v1'},
+            max_size=None,
+            **self.connect_kwargs,
+        )
+
+    async def connect(self):
+        """ Connect to WebSocket and start the reader and writer tasks. """
+        started_at = time.monotonic()
+        self.ws = await self._open()
+        self.connect_time = time.monotonic() - started_at
+        self._connected.set()
+        log.info('Connected to WebSocket in %.1f ms.', self.connect_time * 1000)
+
+        self._tasks = [
+            asyncio.create_task(self._recv_loop()),
+            asyncio.create_task(self._send_loop()),
+        ]
+
+    async def _recv_loop(self):
+        """ Dispatch each incoming message; reconnect if the connection drops. """
+        while True:
+            try:
+                async for message in self.ws:
+                    if self.recorder:
+                        self.recorder.received(message)
+                    if self.on_msg:
+                        log.debug('Received message: %s', Payload(message))
+                        received_at = time.perf_counter()
+                        event = Codec.decode_audio_delta(message)  # Most of the traffic: no type peek or accepts()
+                        if event is not None:
+                            self.on_msg(event)
+                        elif not self.accepts or self.accepts(Codec.event_type(message)):
+                            self.on_msg(Codec.decode_event(message))  # Call the user-provided callback
+                        self._dispatch_time.observe(time.perf_counter() - received_at)
+                        self._received.inc()
+                        self._bytes_received.inc(len(message))
+                reason = 'closed by server'
+            except (ConnectionClosed, OSError) as e:
+                reason = str(e) or type(e).__name__
+            except Exception as e:
+                log.error('Error in socket receive loop: %s', e)
+                self._lost(str(e) or type(e).__name__)
+                return
+            log.error('WebSocket connection closed: %s', reason)
+            if not await self._reconnect(reason):
+                return
+
+    def _lost(self, reason):
+        self._connected.clear()
+        self._disconnects.inc()
+        if self.on_disconnect:
+            self.on_disconnect(reason)
+
+    async def _reconnect(self, reason):
+        """ Reopen with backoff, replay session state, then release the writer. """
+        lost_at = time.monotonic()
+        self._lost(reason)
+        if not self.reconnect:
+            return False
+
+        backoff = Backoff(max_retries=self.max_retries)
+        while True:
+            delay = backoff.next()
+            if delay is None:
+                log.error('Giving up after %d reconnect attempts.', backoff.attempts)
+                return False
+            await asyncio.sleep(delay)
+            try:
+                ws = await self._open()
+                replay = self.replay() if self.replay else []
+                for message in replay:
+                    await ws.send(Codec.to_wire(message), text=True)
+            except Exception as e:
+                log.warning('Reconnect attempt %d failed: %s', backoff.attempts, e)
+                continue
+            break
+
+        self.ws = ws
+        self._replayed = {id(message): message for message in replay}
+        if self.stale_audio == 'drop':
+            self._drop_audio_before = time.monotonic() - self.stale_audio_s
+        self.reconnects += 1
+        downtime = time.monotonic() - lost_at
+        self._downtime.observe(downtime)
+        self._connected.set()
+        info = {'attempts': backoff.attempts, 'downtime_s': downtime, 'replayed': len(replay)}
+        log.info('Reconnected after %.0f ms (%d attempts, %d replayed).', downtime * 1000, backoff.attempts,
+                 len(replay))
+        if self.on_reconnect:
+            self.on_reconnect(info)
+        return True
+
+    async def _send_loop(self):
+        """ Wait until something is queued, then drain the queue in batches; hold messages while reconnecting. """
+        try:
+            while True:
+                if self._unsent:
+                    batch = list(self._unsent)
+                    self._unsent.clear()
+                else:
+                    batch = [await self.send_queue.get()]
+                    self._send_depth.observe(self.send_queue.qsize() + 1)
+                    while len(batch) < self.send_batch_max and not self.send_queue.empty():
+                        batch.append(self.send_queue.get_nowait())
+
+                await self._connected.wait()
+                ws = self.ws
+                max_age = self.send_queue.max_age
+                for i, (enqueued_at, outgoing_message) in enumerate(batch):
+                    # Queued or held back while the connection was down, and already sent again by the replay
+                    if self._replayed.get(id(outgoing_message)) is outgoing_message:
+                        self.replay_skipped += 1
+                        continue
+                    if enqueued_at < self._drop_audio_before and Codec.is_audio_append(outgoing_message):
+                        self.audio_dropped += 1
+                        continue
+                    # Left the queue before a wait in send() or for the connection, and has since missed the deadline
+                    if max_age and time.monotonic() - enqueued_at > max_age and Codec.is_audio_append(outgoing_message):
+                        self.send_queue.expired += 1
+                        continue
+                    try:
+                        wire = Codec.to_wire(outgoing_message)
+                        await ws.send(wire, text=True)
+                    except ConnectionClosed as e:
+                        # Keep this message and the rest of the batch for the next connection; the reader reconnects
+                        self._unsent.extend(batch[i:])
+                        if ws is self.ws:
+                            self._connected.clear()
+                        log.error('WebSocket connection closed while sending: %s', e)
+                        break
+                    self._record_send_latency(time.monotonic() - enqueued_at)
+                    self._bytes_sent.inc(len(wire))
+                    log.debug('Sent message: %s', Payload(wire))
+        except Exception as e:
+            log.error('Error in socket send loop: %s', e)
+
+    def _record_send_latency(self, latency):
+        self.sent_count += 1
+        self.send_latency_total += latency
+        self.send_latency_last = latency
+        self._send_delay.observe(latency)
+        if latency > self.send_latency_max:
+            self.send_latency_max = latency
+
+    def latency_stats(self):
+        """ Enqueue-to-wire latency summary, in milliseconds. """
+        mean = self.send_latency_total / self.sent_count if self.sent_count else 0.0
+        return {
+            'sent': self.sent_count,
+            'mean_ms': mean * 1000,
+            'max_ms': self.send_latency_max * 1000,
+            'last_ms': self.send_latency_last * 1000,
+        }
+
+    def send(self, data):
+        """ Enqueue the message to be sent, on the event loop; mic audio is subject to the send queue's policy. """
+        if self.recorder:
+            self.recorder.sent(data)
+        self.send_queue.put((time.monotonic(), data))
+
+    async def drain(self):
+        """ Backpressure point for producers: wait until the send queue is below its bound. """
+        await self.send_queue.wait_for_room()
+
+    def queue_stats(self):
+        return self.send_queue.stats()
+
+    @property
+    def connected(self):
+        return self._connected.is_set() and bool(self._tasks) and not any(task.done() for task in self._tasks)
+
+    async def wait_closed(self):
+        """ Wait until the connection ends for good: closed from either side, with no reconnect. """
+        if self._tasks:
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    async def kill(self):
+        """ Cancel both tasks and close the WebSocket. """
+        log.info('Shutting down WebSocket.')
+        self.send_queue.close()  # Release producers waiting in drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self.ws:
+            try:
+                await self.ws.close()
+                log.info('WebSocket connection closed.')
+            except Exception as e:
+                log.error('Error closing WebSocket: %s', e)
+        log.info('Send latency: %s', self.latency_stats())
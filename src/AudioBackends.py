@@ -0,0 +1,263 @@
+"""
+Audio device backends for AudioIO.
+
+A backend opens callback-driven streams with PyAudio's callback signature,
+`callback(in_data, frame_count, time_info, status) -> (out_data, flag)`, so
+AudioIO's `_mic_callback` / `_spkr_callback` run unchanged on any of them.
+
+- PyAudioBackend: real sound devices (the default).
+- ClockedBackend: no hardware; pairs an AudioSource (mic) with an AudioSink
+  (speaker) and drives the callbacks from a thread at real time, or at `speed`
+  times real time (`speed=0` runs as fast as the callbacks allow).
+"""
+import threading
+import time
+import wave
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Same values as pyaudio.paInt16 / paFloat32 / paContinue / paComplete, so callers don't need pyaudio installed
+FORMAT_INT16 = 8
+FORMAT_FLOAT32 = 1
+CONTINUE = 0
+COMPLETE = 1
+SAMPLE_WIDTH = 2
+
+
+class PyAudioBackend:
+    def __init__(self):
+        if pyaudio is None:
+            raise ImportError('PyAudioBackend needs pyaudio; use ClockedBackend to run without sound devices')
+        self.p = pyaudio.PyAudio()
+
+    def open_input(self, callback, rate, chunk_size, format=FORMAT_INT16, channels=1):
+        return self.p.open(format=format, channels=channels, rate=rate, input=True,
+                           stream_callback=callback, frames_per_buffer=chunk_size)
+
+    def open_output(self, callback, rate, chunk_size, format=FORMAT_INT16, channels=1):
+        return self.p.open(format=format, channels=channels, rate=rate, output=True,
+                           stream_callback=callback, frames_per_buffer=chunk_size)
+
+    def terminate(self):
+        self.p.terminate()
+
+
+class ClockedBackend:
+    """
+    Sources and sinks are mono PCM16, so streams in any other format are
+    refused rather than fed the wrong samples. A source that knows its rate
+    (`FileSource` from a WAV header) must match the stream's.
+    """
+
+    def __init__(self, source=None, sink=None, speed=1.0, output_latency=0.0):
+        self.source = source or NullSource()
+        self.sink = sink or NullSink()
+        self.speed = speed
+        self.output_latency = output_latency  # Simulated callback-to-DAC delay reported in time_info, in stream seconds
+
+    def open_input(self, callback, rate, chunk_size, format=FORMAT_INT16, channels=1):
+        _check_stream(format, channels)
+        source_rate = getattr(self.source, 'rate', None)
+        if source_rate and source_rate != rate:
+            raise ValueError(f'Source is {source_rate} Hz but the stream is {rate} Hz')
+        return ClockedStream(callback, rate, chunk_size, self.speed, source=self.source)
+
+    def open_output(self, callback, rate, chunk_size, format=FORMAT_INT16, channels=1):
+        _check_stream(format, channels)
+        return ClockedStream(callback, rate, chunk_size, self.speed, sink=self.sink, output_latency=self.output_latency)
+
+    def terminate(self):
+        self.sink.close()
+
+
+def _check_stream(format, channels):
+    if format != FORMAT_INT16 or channels != 1:
+        raise ValueError('ClockedBackend streams mono PCM16; leave device_channels and format at their defaults')
+
+
+class ClockedStream:
+    """ Calls a PortAudio-style callback once per chunk on its own thread, using a virtual stream clock. """
+
+    def __init__(self, callback, rate, chunk_size, speed, source=None, sink=None, output_latency=0.0):
+        self.callback = callback
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.source = source
+        self.sink = sink
+        self.output_latency = output_latency
+        self.frames = 0  # Frames processed so far; stream time is frames / rate
+        self.late_callbacks = 0  # Callbacks that started after their deadline
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start_stream(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        period = self.chunk_size / self.rate / self.speed if self.speed else 0.0
+        next_at = time.monotonic()
+        while not self._stop_event.is_set():
+            stream_time = self.frames / self.rate
+            time_info = {
+                'input_buffer_adc_time': stream_time,
+                'current_time': stream_time,
+                'output_buffer_dac_time': stream_time + self.output_latency,
+            }
+
+            in_data = None
+            if self.source:
+                in_data = self.source.read(self.chunk_size)
+                if in_data is None:
+                    break  # Source exhausted
+            out_data, flag = self.callback(in_data, self.chunk_size, time_info, 0)
+            if self.sink and out_data is not None:
+                self.sink.write(out_data)
+            self.frames += self.chunk_size
+            if flag != CONTINUE:
+                break
+
+            if period:
+                next_at += period
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    self.late_callbacks += 1
+
+    def stop_stream(self):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def close(self):
+        self.stop_stream()
+
+
+class NullSource:
+    """ Endless silence. """
+
+    def read(self, frame_count):
+        return bytes(frame_count * SAMPLE_WIDTH)
+
+
+class NullSink:
+    """ Discards everything, counting bytes. """
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def close(self):
+        pass
+
+
+class PcmSource:
+    """ Mono PCM16 from bytes, served in chunks. `loop` repeats it; otherwise the stream ends (or pads with silence). """
+
+    def __init__(self, pcm, loop=False, pad=False):
+        self.pcm = memoryview(bytes(pcm))
+        self.loop = loop
+        self.pad = pad
+        self.pos = 0
+
+    def read(self, frame_count):
+        n = frame_count * SAMPLE_WIDTH
+        chunk = bytes(self.pcm[self.pos:self.pos + n])
+        self.pos += len(chunk)
+        if len(chunk) < n:
+            if self.loop and len(self.pcm):
+                self.pos = 0
+                return chunk + self.read(frame_count - len(chunk) // SAMPLE_WIDTH)
+            if not chunk and not self.pad:
+                return None
+            chunk += bytes(n - len(chunk))
+        return chunk
+
+
+class FileSource(PcmSource):
+    """ WAV (mono PCM16) or headerless raw PCM16 file; ClockedBackend checks a WAV's `rate` (None if raw). """
+
+    def __init__(self, path, loop=False, pad=False):
+        if path.lower().endswith('.wav'):
+            with wave.open(path, 'rb') as wav:
+                if wav.getsampwidth() != SAMPLE_WIDTH or wav.getnchannels() != 1:
+                    raise ValueError(f'{path}: expected mono 16-bit PCM')
+                self.rate = wav.getframerate()
+                pcm = wav.readframes(wav.getnframes())
+        else:
+            self.rate = None
+            with open(path, 'rb') as f:
+                pcm = f.read()
+        super().__init__(pcm, loop=loop, pad=pad)
+
+
+class FileSink:
+    """ Writes played audio to a WAV (by extension) or raw PCM16 file. """
+
+    def __init__(self, path, rate):
+        if path.lower().endswith('.wav'):
+            self.f = wave.open(path, 'wb')
+            self.f.setnchannels(1)
+            self.f.setsampwidth(SAMPLE_WIDTH)
+            self.f.setframerate(rate)
+            self._write = self.f.writeframes
+        else:
+            self.f = open(path, 'wb')
+            self._write = self.f.write
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        self.f.close()
+
+
+class NumpySource(PcmSource):
+    """ In-memory int16 (or float in [-1, 1]) numpy array. """
+
+    def __init__(self, samples, loop=False, pad=False):
+        if np is None:
+            raise ImportError('NumpySource needs numpy')
+        samples = np.asarray(samples)
+        if samples.dtype.kind == 'f':
+            samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        super().__init__(samples.astype('<i2', copy=False).tobytes(), loop=loop, pad=pad)
+
+
+class NumpySink:
+    """ Collects played audio; `samples` returns it as one int16 array. """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('NumpySink needs numpy')
+        self.chunks = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.bytes_written += len(data)
+
+    @property
+    def samples(self):
+        return np.frombuffer(b''.join(self.chunks), dtype='<i2')
+
+    def close(self):
+        pass
@@ -1,98 +1,395 @@
-import pyaudio
 import queue
 import time
 import logging
 import threading
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+from AudioBackends import PyAudioBackend, FORMAT_INT16, FORMAT_FLOAT32, CONTINUE
+from BoundedQueue import BoundedQueue
+from JitterBuffer import JitterBuffer
+from Metrics import Registry, DEPTH_BUCKETS, LATENCY_BUCKETS
+from PlaybackTimeline import PlaybackTimeline
+from RingBuffer import RingBuffer
+from Telemetry import Sampler, audio_log
+
+log = logging.getLogger(__name__)
 
 CHUNK_SIZE = 1024
 RATE = 24000
-FORMAT = pyaudio.paInt16
+FORMAT = FORMAT_INT16
 REENGAGE_DELAY_MS = 500
+PLAYBACK_BUFFER_SECONDS = 30
+MIC_BATCH_FRAMES = 4096  # Max frames coalesced into one input_audio_buffer.append
+MIC_BATCH_WAIT_MS = 0    # Extra time to wait for more mic chunks; 0 only merges what is already queued
+MIC_QUEUE_SIZE = 64      # ~2.7 s of 1024-frame chunks at 24 kHz
+MIC_OVERFLOW = 'drop_oldest'  # 'drop_oldest', 'drop_newest' or 'coalesce'; 'block' would stall the PortAudio thread
+MIC_DEADLINE_MS = 1000   # Mic chunks queued longer than this are discarded instead of sent (None: no deadline)
+
+ECHO_REFERENCE_CHUNKS = 16  # Played chunks kept as echo reference while the mic catches up; older ones are overwritten
+
+_SAMPLE_FORMATS = {FORMAT_INT16: ('int16', 2), FORMAT_FLOAT32: ('float32', 4)}
+
+_STOP = object()  # Sentinel that wakes process_mic_audio on shutdown
 
 
 class AudioIO:
-    def __init__(self, chunk_size=CHUNK_SIZE, rate=RATE, format=FORMAT, on_audio_callback=None):
+    def __init__(self, chunk_size=CHUNK_SIZE, rate=RATE, format=FORMAT, on_audio_callback=None,
+                 playback_buffer_seconds=PLAYBACK_BUFFER_SECONDS, mic_sink=None,
+                 mic_batch_frames=MIC_BATCH_FRAMES, mic_batch_wait_ms=MIC_BATCH_WAIT_MS, backend=None,
+                 echo_cancel=False, jitter_buffer=True, wire_rate=None, device_rate=None, device_channels=1,
+                 metrics=None, mic_queue_size=MIC_QUEUE_SIZE, mic_overflow=MIC_OVERFLOW,
+                 mic_deadline_ms=MIC_DEADLINE_MS):
         self.chunk_size = chunk_size
-        self.rate = rate
-        self.format = format
-        self.audio_buffer = bytearray()
-        self.mic_queue = queue.Queue()
+        self.rate = rate  # Internal processing rate (mono PCM16): playback buffer, echo cancellation
+        self.wire_rate = wire_rate or rate  # Sample rate of audio exchanged with on_audio_callback / receive_audio
+        self.format = format  # Device sample format
+        self.device_rate = device_rate or rate
+        self.device_channels = device_channels
+        capacity = int(rate * playback_buffer_seconds) * 2
+        if jitter_buffer:
+            self.audio_buffer = JitterBuffer(capacity, rate)
+        else:
+            self.audio_buffer = JitterBuffer(capacity, rate, min_ms=0, initial_ms=0, max_ms=0)  # Never holds audio back
+
+        # Which item is audible when: ring positions tagged by item, and each callback's DAC time
+        self.timeline = PlaybackTimeline(rate)
+
+        # Barge-in: a requested flush happens at the start of the next speaker callback
+        self._flush_requested_at = None
+        self._on_flushed = None
+        self.flushes = 0
+        self.flush_latency_last = 0.0
+        self.flush_latency_max = 0.0
+        self._spkr_out = bytearray(chunk_size * 2)  # Reused for every speaker callback
+        self._spkr_view = memoryview(self._spkr_out)  # Writes through a view copy in place, a bytearray slice doesn't
+        self._spkr_out_ro = self._spkr_view.toreadonly()
+        self._silence = memoryview(bytes(chunk_size * 2))
+        if mic_overflow == 'block':
+            raise ValueError("mic_overflow='block' would stall the PortAudio callback")
+        self.mic_batch_bytes = mic_batch_frames * 2
+        self.mic_queue = BoundedQueue(mic_queue_size, mic_overflow, droppable=lambda chunk: chunk is not _STOP,
+                                      coalesce=self._merge_mic_chunks,
+                                      max_age=mic_deadline_ms / 1000 if mic_deadline_ms else None)
+        self.mic_batch_wait = mic_batch_wait_ms / 1000
         self.mic_on_at = 0
         self.mic_active = None
+        self._mic_sample = Sampler()  # Per-batch log sampling
         self._stop_event = threading.Event()
-        self.p = pyaudio.PyAudio()
+        self.backend = backend or PyAudioBackend()  # See AudioBackends for headless alternatives
+        self.mic_stream = None
+        self.spkr_stream = None
         self.on_audio_callback = on_audio_callback  # Callback for audio data
+        self.mic_sink = mic_sink  # If set, receives mic chunks on the PortAudio thread instead of mic_queue
+        self.recorder = None  # Recording.Recorder for the mic audio as captured and the speaker audio as played
+
+        # With echo cancellation the mic stays open during playback instead of being muted for REENGAGE_DELAY_MS
+        self.echo_canceller = None
+        # Played chunks for the canceller: the speaker callback copies each into the next of a fixed set of buffers
+        # and the mic callback takes them in order, so neither allocates
+        self._echo_slots = [bytearray(chunk_size * 2) for _ in range(ECHO_REFERENCE_CHUNKS)]
+        self._echo_written = 0  # Chunks ever written, speaker thread only
+        self._echo_read = 0     # Chunks ever taken, mic thread only
+        if echo_cancel:
+            from EchoCanceller import EchoCanceller  # Needs numpy
+            self.echo_canceller = EchoCanceller(chunk_size, rate)
+
+        self._mic_resampler = None
+        self._spkr_resampler = None
+        if self.wire_rate != rate:
+            from Resampler import Resampler  # Needs numpy
+            self._mic_resampler = Resampler(rate, self.wire_rate)
+            self._spkr_resampler = Resampler(self.wire_rate, rate)
+
+        # Devices that can't do mono PCM16 at `rate` get a conversion stage around the stream callbacks
+        self._mic_converter = None
+        self._spkr_converter = None
+        if self.device_rate != rate or device_channels != 1 or format != FORMAT_INT16:
+            from Resampler import StreamConverter  # Needs numpy
+            sample_format, sample_bytes = _SAMPLE_FORMATS[format]
+            self.device_chunk = round(chunk_size * self.device_rate / rate)
+            self._device_frame_bytes = sample_bytes * device_channels
+            self._mic_converter = StreamConverter(self.device_rate, rate, in_channels=device_channels,
+                                                  in_format=sample_format, max_chunk=self.device_chunk * 2)
+            self._spkr_converter = StreamConverter(rate, self.device_rate, out_channels=device_channels,
+                                                   out_format=sample_format, max_chunk=chunk_size * 2)
+            # Converted audio waits in rings until there is a whole chunk (mic) or device buffer (speaker) of it;
+            # each holds less than one of those plus one conversion's output
+            self._mic_fifo = RingBuffer(chunk_size * 2 * 4)
+            self._mic_chunk = bytearray(chunk_size * 2)
+            self._spkr_converted_max = (self.device_chunk + 2) * self._device_frame_bytes
+            self._spkr_fifo = RingBuffer(self.device_chunk * self._device_frame_bytes + self._spkr_converted_max)
+            self._device_out = bytearray()  # Sized to the device buffer on the first speaker callback
+            self._device_out_ro = memoryview(self._device_out).toreadonly()
+
+        self.metrics = metrics or Registry()
+        self._playback_fill = self.metrics.histogram('playback_buffer_seconds',
+                                                     'Audio buffered for playback, per speaker callback')
+        self._mic_depth = self.metrics.histogram('mic_queue_depth', 'Mic chunks queued per processed batch',
+                                                 DEPTH_BUCKETS)
+        self._flush_time = self.metrics.histogram('playback_flush_seconds', 'Flush request to silence (barge-in)')
+        self._output_latency = self.metrics.histogram('playback_output_latency_seconds',
+                                                      'Speaker callback to its audio reaching the DAC', LATENCY_BUCKETS)
+        self._mic_suppressed = self.metrics.counter('mic_suppressed_seconds_total',
+                                                    'Mic audio discarded while muted for playback')
+        buffer = self.audio_buffer
+        self.metrics.counter('playback_underruns_total', 'Speaker callbacks that ran dry mid-response',
+                             fn=lambda: buffer.underruns)
+        self.metrics.counter('playback_overflow_bytes_total', 'Response audio dropped because the buffer was full',
+                             fn=lambda: buffer.overflow_bytes)
+        self.metrics.gauge('playback_target_seconds', 'Jitter buffer prebuffer target',
+                           fn=lambda: buffer.target_ms / 1000)
+        self.metrics.gauge('playback_jitter_seconds', 'Smoothed arrival jitter of response audio',
+                           fn=lambda: buffer.jitter_ms / 1000)
+        self.metrics.gauge('playback_high_water_bytes', 'Most audio ever buffered for playback',
+                           fn=lambda: buffer.high_water)
+        mic_queue = self.mic_queue
+        self.metrics.counter('mic_queue_dropped_total', 'Mic chunks dropped by the mic queue overflow policy',
+                             fn=lambda: mic_queue.dropped)
+        self.metrics.counter('mic_queue_expired_total', 'Mic chunks discarded for missing the mic deadline',
+                             fn=lambda: mic_queue.expired)
+
+    def _merge_mic_chunks(self, queued, chunk):
+        """ Coalesce policy: append to the newest queued chunk, up to one send batch. """
+        if len(queued) + len(chunk) > self.mic_batch_bytes:
+            return None
+        return queued + chunk
 
     def _mic_callback(self, in_data, frame_count, time_info, status):
         """ Microphone callback that queues audio chunks. """
+        if self.recorder:
+            self.recorder.mic(in_data)
+        if self.echo_canceller:
+            in_data = self.echo_canceller.process(in_data, self._take_echo_reference())
+        if self._mic_resampler:
+            in_data = self._mic_resampler.process(in_data)
+
         if time.time() > self.mic_on_at:
             if not self.mic_active:
-                logging.info('🎙️🟢 Mic active')
+                audio_log.info('🎙️🟢 Mic active')
                 self.mic_active = True
-            self.mic_queue.put(in_data)
+            if self.mic_sink:
+                self.mic_sink(in_data)
+            else:
+                self.mic_queue.put(in_data)
         else:
             if self.mic_active:
-                logging.info('🎙️🔴 Mic suppressed')
+                audio_log.info('🎙️🔴 Mic suppressed')
                 self.mic_active = False
-        return (None, pyaudio.paContinue)
+            self._mic_suppressed.inc(frame_count / self.rate)
+        return (None, CONTINUE)
+
+    def _take_echo_reference(self):
+        """ Mic thread: the oldest played chunk not yet taken, or None; keeps up if the speaker has lapped it. """
+        written = self._echo_written
+        if written - self._echo_read >= ECHO_REFERENCE_CHUNKS:
+            self._echo_read = written - ECHO_REFERENCE_CHUNKS + 1  # The slot after the one being written next
+        if self._echo_read == written:
+            return None
+        reference = self._echo_slots[self._echo_read % ECHO_REFERENCE_CHUNKS]
+        self._echo_read += 1
+        return reference
 
     def _spkr_callback(self, in_data, frame_count, time_info, status):
-        """ Speaker callback that plays audio. """
+        """ Speaker callback that plays audio straight out of the ring buffer. """
+        if not time_info:
+            return (self._play(frame_count), CONTINUE)
+        return (self._play(frame_count, time_info.get('output_buffer_dac_time') or 0.0,
+                           time_info.get('current_time') or 0.0), CONTINUE)
+
+    def _play(self, frame_count, dac_time=0.0, current_time=0.0):
+        """
+        Fill the reused speaker buffer with `frame_count` frames; returns a read-only view of it.
+
+        `dac_time` / `current_time` are the stream times from PortAudio's `time_info`, passed
+        as floats so the device path can offset them per chunk without building a dict.
+        """
         bytes_needed = frame_count * 2
-        current_buffer_size = len(self.audio_buffer)
+        if len(self._spkr_out) != bytes_needed:
+            self._spkr_out = bytearray(bytes_needed)
+            self._spkr_view = memoryview(self._spkr_out)
+            self._spkr_out_ro = self._spkr_view.toreadonly()
+            self._silence = memoryview(bytes(bytes_needed))
+
+        if self._flush_requested_at is not None:
+            self._flush_playback_now()
 
-        if current_buffer_size >= bytes_needed:
-            audio_chunk = bytes(self.audio_buffer[:bytes_needed])
-            self.audio_buffer = self.audio_buffer[bytes_needed:]
-            self.mic_on_at = time.time() + REENGAGE_DELAY_MS / 1000
+        self._playback_fill.observe(len(self.audio_buffer) / 2 / self.rate)
+        pos = self.audio_buffer.read_pos
+        n = self.audio_buffer.read_into(self._spkr_out)
+        self._output_latency.observe(self.timeline.on_callback(pos, n, dac_time, current_time))
+        if n == bytes_needed:
+            if not self.echo_canceller:
+                self.mic_on_at = time.time() + REENGAGE_DELAY_MS / 1000
         else:
-            audio_chunk = bytes(self.audio_buffer) + b'\x00' * (bytes_needed - current_buffer_size)
-            self.audio_buffer.clear()
+            self._spkr_view[n:] = self._silence[n:]
+
+        if self.echo_canceller:
+            self._echo_slots[self._echo_written % ECHO_REFERENCE_CHUNKS][:] = self._spkr_out
+            self._echo_written += 1
+        if self.recorder:
+            self.recorder.speaker(self._spkr_out_ro)  # Copied into the recorder's own ring, not allocated
+
+        # PortAudio copies the buffer out before the next callback, so a read-only view is safe to hand over
+        return self._spkr_out_ro
 
-        return (audio_chunk, pyaudio.paContinue)
+    def _device_mic_callback(self, in_data, frame_count, time_info, status):
+        """ Convert device audio to mono PCM16 at `rate`, then feed `_mic_callback` whole chunks. """
+        fifo = self._mic_fifo
+        fifo.write(self._mic_converter.convert(in_data))
+        chunk_bytes = self.chunk_size * 2
+        while len(fifo) >= chunk_bytes:
+            fifo.read_into(self._mic_chunk)
+            # The one copy per chunk: the mic queue keeps it after this callback returns
+            self._mic_callback(bytes(self._mic_chunk), self.chunk_size, time_info, status)
+        return (None, CONTINUE)
+
+    def _device_spkr_callback(self, in_data, frame_count, time_info, status):
+        """ Pull whole chunks from `_play` and convert them to exactly `frame_count` device frames. """
+        needed = frame_count * self._device_frame_bytes
+        if len(self._device_out) != needed:
+            self._device_out = bytearray(needed)
+            self._device_out_ro = memoryview(self._device_out).toreadonly()
+            if self._spkr_fifo.capacity < needed + self._spkr_converted_max:
+                self._spkr_fifo = RingBuffer(needed + self._spkr_converted_max)
+
+        dac_time = current_time = 0.0
+        if time_info:
+            dac_time = time_info.get('output_buffer_dac_time') or 0.0
+            current_time = time_info.get('current_time') or 0.0
+        fifo = self._spkr_fifo
+        while len(fifo) < needed:
+            chunk_dac_time = dac_time
+            if dac_time:  # A new chunk plays after what is already converted
+                chunk_dac_time = dac_time + len(fifo) / self._device_frame_bytes / self.device_rate
+            fifo.write(self._spkr_converter.convert(self._play(self.chunk_size, chunk_dac_time, current_time)))
+        fifo.read_into(self._device_out)
+        return (self._device_out_ro, CONTINUE)
+
+    def _flush_playback_now(self):
+        """ Runs on the speaker thread: drop everything buffered and report how far playback got. """
+        played_pos = self.audio_buffer.read_pos
+        self.audio_buffer.clear()
+
+        latency = time.monotonic() - self._flush_requested_at
+        self._flush_time.observe(latency)
+        self.flushes += 1
+        self.flush_latency_last = latency
+        if latency > self.flush_latency_max:
+            self.flush_latency_max = latency
+
+        on_flushed = self._on_flushed
+        self._on_flushed = None
+        self._flush_requested_at = None
+        if on_flushed:
+            on_flushed(played_pos)
+
+    def flush_playback(self, on_flushed=None):
+        """
+        Silence playback within one callback period.
+
+        `on_flushed(played_pos)` is then called on the speaker thread, where
+        `played_pos` is the ring buffer read position (total bytes handed to the device).
+        """
+        self._on_flushed = on_flushed
+        self._flush_requested_at = time.monotonic()
+
+    def is_playing(self):
+        return len(self.audio_buffer) > 0
 
     def start_streams(self):
         """ Start microphone and speaker streams. """
-        self.mic_stream = self.p.open(
-            format=self.format,
-            channels=1,
-            rate=self.rate,
-            input=True,
-            stream_callback=self._mic_callback,
-            frames_per_buffer=self.chunk_size
-        )
-        self.spkr_stream = self.p.open(
-            format=self.format,
-            channels=1,
-            rate=self.rate,
-            output=True,
-            stream_callback=self._spkr_callback,
-            frames_per_buffer=self.chunk_size
-        )
+        if self._mic_converter:
+            self.mic_stream = self.backend.open_input(self._device_mic_callback, self.device_rate, self.device_chunk,
+                                                      format=self.format, channels=self.device_channels)
+            self.spkr_stream = self.backend.open_output(self._device_spkr_callback, self.device_rate, self.device_chunk,
+                                                        format=self.format, channels=self.device_channels)
+        else:
+            self.mic_stream = self.backend.open_input(self._mic_callback, self.rate, self.chunk_size, format=self.format)
+            self.spkr_stream = self.backend.open_output(self._spkr_callback, self.rate, self.chunk_size, format=self.format)
+        if hasattr(self.spkr_stream, 'get_output_latency'):
+            self.timeline.default_latency = self.spkr_stream.get_output_latency()
         self.mic_stream.start_stream()
         self.spkr_stream.start_stream()
 
     def stop_streams(self):
         """ Stop and close audio streams. """
-        self.mic_stream.stop_stream()
-        self.mic_stream.close()
-        self.spkr_stream.stop_stream()
-        self.spkr_stream.close()
-        self.p.terminate()
+        for stream in (self.mic_stream, self.spkr_stream):
+            if stream:
+                stream.stop_stream()
+                stream.close()
+        self.mic_stream = None
+        self.spkr_stream = None
+        self.backend.terminate()
 
     def process_mic_audio(self):
         """ Process microphone audio and call back when new audio is ready. """
         while not self._stop_event.is_set():
-            if not self.mic_queue.empty():
-                mic_chunk = self.mic_queue.get()
-                logging.info(f'🎤 Processing {len(mic_chunk)} bytes of audio data.')
-                if self.on_audio_callback:
-                    self.on_audio_callback(mic_chunk)  # Pass the audio chunk to the callback
-            else:
-                time.sleep(0.05)  # Avoid tight loop when no audio is available
+            mic_chunk = self.mic_queue.get()  # Sleeps until the mic produces audio or we are stopped
+            if mic_chunk is _STOP:
+                break
+
+            self._mic_depth.observe(self.mic_queue.qsize() + 1)
+            batch, stopping = self._collect_mic_batch(mic_chunk)
+            if self._mic_sample():
+                audio_log.info('🎤 Processing %d bytes of audio data.', len(batch), extra={'bytes': len(batch)})
+            if self.on_audio_callback:
+                self.on_audio_callback(batch)  # Pass the audio chunk to the callback
+            if stopping:
+                break
+
+    def _collect_mic_batch(self, first_chunk):
+        """ Coalesce queued mic chunks after `first_chunk`, up to the frame budget and wait time. """
+        chunks = [first_chunk]
+        size = len(first_chunk)
+        stopping = False
+        deadline = time.monotonic() + self.mic_batch_wait
+
+        while size < self.mic_batch_bytes:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    mic_chunk = self.mic_queue.get(timeout=remaining)
+                else:
+                    mic_chunk = self.mic_queue.get_nowait()
+            except queue.Empty:
+                break
+            if mic_chunk is _STOP:
+                stopping = True
+                break
+            chunks.append(mic_chunk)
+            size += len(mic_chunk)
+
+        batch = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        return batch, stopping
+
+    def stop_processing(self):
+        """ Make process_mic_audio return without waiting for more audio. """
+        self._stop_event.set()
+        self.mic_queue.put(_STOP)
+        self.mic_queue.close()
+
+    def receive_audio(self, audio_chunk, item_id=None, content_index=0):
+        """Appends audio data to the buffer for playback, tagged with the item it belongs to if given."""
+        if self._spkr_resampler:
+            audio_chunk = self._spkr_resampler.process(audio_chunk)
+        if item_id is not None:
+            self.timeline.tag(self.audio_buffer.write_pos, item_id, content_index)
+        self.audio_buffer.write(audio_chunk)
+
+    def end_of_audio(self):
+        """ The current response has no more audio: play out the remainder without waiting to prebuffer. """
+        self.audio_buffer.mark_end()
+
+    @property
+    def underruns(self):
+        return self.audio_buffer.underruns
+
+    def playback_stats(self):
+        return self.audio_buffer.stats()
+
+    @property
+    def playback_capacity(self):
+        return self.audio_buffer.capacity
 
-    def receive_audio(self, audio_chunk):
-        """Appends audio data to the buffer for playback."""
-        self.audio_buffer.extend(audio_chunk)
\ No newline at end of file
+    @property
+    def playback_high_water(self):
+        return self.audio_buffer.high_water
@@ -0,0 +1,30 @@
+import random
+
+BASE_S = 0.25  # First retry waits up to this long...
+CAP_S = 8.0    # ...doubling per attempt up to this ceiling
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: attempt n waits uniform(0, min(cap, base * 2**n)).
+
+    Jitter keeps many sessions that dropped together (a server restart, a
+    network blip) from reconnecting in lockstep. `next()` returns None once
+    `max_retries` attempts have been used up (None means retry forever).
+    """
+
+    def __init__(self, base=BASE_S, cap=CAP_S, max_retries=None):
+        self.base = base
+        self.cap = cap
+        self.max_retries = max_retries
+        self.attempts = 0
+
+    def next(self):
+        if self.max_retries is not None and self.attempts >= self.max_retries:
+            return None
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempts))
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+POLICIES = ('drop_oldest', 'drop_newest', 'block', 'coalesce')
+
+
+class BoundedQueue:
+    """
+    Thread-safe FIFO with a size bound, an overflow policy and a deadline.
+
+    Drop-in for the queue.Queue calls used here (put / get / get_nowait /
+    qsize, raising queue.Empty), for a real-time stream where old data is
+    worth less than new:
+
+    - `droppable(item)` says which items the policy may discard (e.g. audio,
+      not control messages, which are always queued even past the bound).
+    - When full, 'drop_oldest' discards the oldest droppable item,
+      'drop_newest' the incoming one, 'block' waits for room, and 'coalesce'
+      merges the incoming item into the newest one with `coalesce(a, b)`
+      (falling back to drop_oldest when it returns None).
+    - Droppable items older than `max_age` seconds are discarded rather than
+      returned by get(), so a consumer recovering from a stall skips stale data.
+    """
+
+    def __init__(self, maxsize, policy='drop_oldest', max_age=None, droppable=None, coalesce=None):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_age = max_age
+        self.droppable = droppable or (lambda item: True)
+        self.coalesce = coalesce
+        self._items = collections.deque()  # (enqueued_at, item)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.closed = False
+
+        self.dropped = 0     # Discarded by the overflow policy
+        self.expired = 0     # Discarded for exceeding max_age
+        self.coalesced = 0
+        self.blocked_s = 0.0  # Total time producers spent waiting under 'block'
+        self.high_water = 0
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return len(self._items) >= self.maxsize
+
+    def put(self, item, timeout=None):
+        """ Enqueue, applying the overflow policy if full. Returns False if the item was dropped. """
+        with self._lock:
+            now = time.monotonic()
+            if len(self._items) >= self.maxsize and self.droppable(item):
+                self._expire(now)
+                if len(self._items) >= self.maxsize and not self._make_room(item, now, timeout):
+                    return False
+            self._items.append((now, item))
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            self._not_empty.notify()
+            return True
+
+    def _make_room(self, item, now, timeout):
+        """ Called with the lock held and the queue full; False means `item` must not be appended. """
+        if self.policy == 'drop_newest':
+            self.dropped += 1
+            return False
+
+        if self.policy == 'block':
+            deadline = None if timeout is None else now + timeout
+            while len(self._items) >= self.maxsize and not self.closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.dropped += 1
+                    return False
+                self._not_full.wait(remaining)
+            self.blocked_s += time.monotonic() - now
+            return True
+
+        if self.policy == 'coalesce' and self.coalesce and self._items:
+            tail_at, tail = self._items[-1]
+            if self.droppable(tail):
+                merged = self.coalesce(tail, item)
+                if merged is not None:
+                    self._items[-1] = (tail_at, merged)  # Keeps the older timestamp, so the deadline still applies
+                    self.coalesced += 1
+                    return False
+
+        # drop_oldest, or coalesce that could not merge
+        for i, (_, queued) in enumerate(self._items):
+            if self.droppable(queued):
+                del self._items[i]
+                self.dropped += 1
+                return True
+        return True  # Nothing droppable queued: go over the bound rather than lose a control item
+
+    def _expire(self, now):
+        if self.max_age is None:
+            return
+        items = self._items
+        expired = 0
+        while items and now - items[0][0] > self.max_age and self.droppable(items[0][1]):
+            items.popleft()
+            expired += 1
+        if expired:
+            self.expired += expired
+            self._not_full.notify_all()
+
+    def close(self):
+        """ Release producers blocked under 'block'; later puts no longer wait. """
+        with self._lock:
+            self.closed = True
+            self._not_full.notify_all()
+
+    def get(self, block=True, timeout=None):
+        with self._lock:
+            self._expire(time.monotonic())
+            if not self._items:
+                if not block:
+                    raise queue.Empty
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._items:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+                    self._expire(time.monotonic())
+            _, item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def stats(self):
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'high_water': self.high_water,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'coalesced': self.coalesced,
+            'blocked_s': self.blocked_s,
+        }
+
+
+class AsyncBoundedQueue(BoundedQueue):
+    """
+    BoundedQueue for one asyncio event loop: the consumer awaits get(), producers may await wait_for_room().
+
+    put() never waits, so it can run in a loop callback. Under 'block' it queues past the bound
+    and leaves the waiting to producers that await wait_for_room() before their next put.
+    """
+
+    def __init__(self, maxsize, policy='drop_oldest', max_age=None, droppable=None, coalesce=None):
+        super().__init__(maxsize, policy, max_age, droppable, coalesce)
+        self._put = asyncio.Event()
+        self._room = asyncio.Event()
+
+    def put(self, item, timeout=None):
+        queued = super().put(item, timeout)
+        self._put.set()
+        return queued
+
+    def _make_room(self, item, now, timeout):
+        if self.policy == 'block':
+            return True  # Waiting here would stall the loop; wait_for_room() is the backpressure point
+        return super()._make_room(item, now, timeout)
+
+    async def get(self):
+        """ The next item, once there is one; expired items are discarded as in BoundedQueue.get(). """
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                self._put.clear()
+                await self._put.wait()
+
+    def get_nowait(self):
+        try:
+            return BoundedQueue.get(self, block=False)
+        finally:
+            self._room.set()
+
+    async def wait_for_room(self):
+        """ Return once the queue is below its bound (or closed). """
+        if len(self._items) < self.maxsize or self.closed:
+            return
+        started_at = time.monotonic()
+        while len(self._items) >= self.maxsize and not self.closed:
+            self._room.clear()
+            await self._room.wait()
+        self.blocked_s += time.monotonic() - started_at
+
+    def close(self):
+        super().close()
+        self._room.set()
@@ -0,0 +1,177 @@
+""" Wire encoding for Realtime events, with fast paths for the audio events that dominate traffic. """
+import binascii
+import json
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)  # bytes
+
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import ujson
+
+        def dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False)
+
+        loads = ujson.loads
+        JSON_BACKEND = 'ujson'
+    except ImportError:
+        def dumps(obj):
+            return json.dumps(obj, separators=(',', ':'))
+
+        loads = json.loads
+        JSON_BACKEND = 'json'
+
+AUDIO_APPEND_PREFIX = b'{"type":"input_audio_buffer.append","audio":"'
+AUDIO_APPEND_SUFFIX = b'"}'
+MERGED_AUDIO_MAX = 1 << 20  # Audio bytes one coalesced append may carry (~22 s of 24 kHz PCM16, a ~1.4 MB frame)
+
+AUDIO_DELTA_TYPE = 'response.audio.delta'
+_AUDIO_DELTA_TAG = '"type":"response.audio.delta"'
+_DELTA_KEY = '"delta":"'
+_TYPE_KEY = '"type":"'
+_TYPE_FIRST = '{' + _TYPE_KEY
+_HEAD = 96  # The type field is sent first, so it always sits in the first few dozen characters
+
+
+def encode_audio_append(pcm):
+    """
+    Build the `input_audio_buffer.append` frame for a PCM chunk straight from a byte template.
+
+    Equivalent to json.dumps({'type': 'input_audio_buffer.append', 'audio': b64encode(pcm).decode()})
+    without the intermediate str, dict or JSON escaping pass; base64 never needs escaping.
+    """
+    return b''.join((AUDIO_APPEND_PREFIX, binascii.b2a_base64(pcm, newline=False), AUDIO_APPEND_SUFFIX))
+
+
+class MergedAudio:
+    """ Audio of several append frames merged while queued, kept decoded and encoded once, by to_wire(). """
+
+    __slots__ = ('audio',)
+
+    def __init__(self, audio):
+        self.audio = bytearray(audio)
+
+
+def is_audio_append(message):
+    """ True for frames built by encode_audio_append (or the equivalent dict), and for MergedAudio. """
+    if isinstance(message, bytes):
+        return message.startswith(AUDIO_APPEND_PREFIX)
+    if isinstance(message, MergedAudio):
+        return True
+    return isinstance(message, dict) and message.get('type') == 'input_audio_buffer.append'
+
+
+def _append_audio(frame):
+    return binascii.a2b_base64(frame[len(AUDIO_APPEND_PREFIX):-len(AUDIO_APPEND_SUFFIX)])
+
+
+def merge_audio_appends(first, second, max_bytes=None):
+    """
+    The audio of `first` (a frame or MergedAudio) then `second` (a frame) as a MergedAudio; None past `max_bytes`.
+
+    A MergedAudio is extended in place, so merging a run of n chunks decodes each once instead of re-encoding
+    the growing frame n times.
+    """
+    max_bytes = MERGED_AUDIO_MAX if max_bytes is None else max_bytes
+    if isinstance(first, MergedAudio):
+        audio = _append_audio(second)
+        if len(first.audio) + len(audio) > max_bytes:
+            return None
+        first.audio += audio
+        return first
+    audio = _append_audio(first)
+    more = _append_audio(second)
+    if len(audio) + len(more) > max_bytes:
+        return None
+    merged = MergedAudio(audio)
+    merged.audio += more
+    return merged
+
+
+def to_wire(message):
+    """ Serialise an outgoing event; frames that are already encoded pass straight through. """
+    if isinstance(message, (bytes, str)):
+        return message
+    if isinstance(message, MergedAudio):
+        return encode_audio_append(message.audio)
+    return dumps(message)
+
+
+def decode_event(raw):
+    """
+    Parse a server event.
+
+    `response.audio.delta` frames take a fast path: the base64 payload is cut out of the raw text
+    and decoded directly into the `audio` key (as bytes, replacing `delta`), and only the small
+    remainder of the frame goes through the JSON parser. Everything else is parsed normally.
+    """
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode('utf-8')
+    message = decode_audio_delta(raw)
+    return loads(raw) if message is None else message
+
+
+def decode_audio_delta(raw):
+    """ The decoded event if `raw` is a `response.audio.delta` frame, else None, at the cost of a prefix check. """
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode('utf-8')
+    split = split_audio_delta(raw)
+    if not split:
+        return None
+    rest, delta = split
+    message = loads(rest)
+    message['audio'] = binascii.a2b_base64(delta)
+    return message
+
+
+def split_audio_delta(raw):
+    """ (frame without its `delta` field, base64 delta) for a `response.audio.delta` frame (str), else None. """
+    if _AUDIO_DELTA_TAG not in raw[:_HEAD]:
+        return None
+    key = raw.find(_DELTA_KEY)
+    if key == -1:
+        return None
+    start = key + len(_DELTA_KEY)
+    end = raw.find('"', start)
+    if end == -1:
+        return None
+    # Splice the field (and one neighbouring comma) out of the frame
+    head, tail = raw[:key], raw[end + 1:]
+    if head.endswith(','):
+        head = head[:-1]
+    else:
+        tail = tail[1:] if tail.startswith(',') else tail
+    return head + tail, raw[start:end]
+
+
+def join_audio_delta(rest, pcm):
+    """ Inverse of split_audio_delta, from the decoded PCM: a wire frame again, with `delta` last. """
+    return f'{rest[:-1]},{_DELTA_KEY}{binascii.b2a_base64(pcm, newline=False).decode("ascii")}"}}'
+
+
+def event_type(raw):
+    """ The type of a raw server frame without parsing it, or None if it isn't near the start. """
+    if not isinstance(raw, str):
+        raw = bytes(raw[:_HEAD]).decode('utf-8', 'ignore')
+    if raw.startswith(_TYPE_FIRST):  # How the server writes them
+        start = len(_TYPE_FIRST)
+    else:
+        start = raw.find(_TYPE_KEY, 0, _HEAD)
+        if start == -1:
+            return None
+        start += len(_TYPE_KEY)
+    end = raw.find('"', start, _HEAD)
+    return raw[start:end] if end != -1 else None
+
+
+def audio_of(message):
+    """ PCM bytes of a `response.audio.delta` event, whichever path decoded it. """
+    audio = message.get('audio')
+    if audio is None:
+        audio = binascii.a2b_base64(message['delta'])
+    return audio
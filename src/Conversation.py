@@ -0,0 +1,280 @@
+"""
+Client-side model of the server's conversation, with size accounting and eviction.
+
+Items are tracked by id from `conversation.item.created` and
+`response.output_item.done`, as compact metadata: role, type, a text
+summary, and estimated tokens and bytes. With `spill` set, each item's
+audio (in wire format) is also kept, in a memory-mapped spill file rather
+than in RAM. When a token or byte budget is exceeded, the oldest (or least
+recently used) items are deleted from the server with
+`conversation.item.delete`, so long calls don't keep growing the context
+each turn is billed and processed against.
+
+Token counts are estimates: ~4 characters per text token, and audio at the
+rates below.
+"""
+import collections
+import math
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from Metrics import Registry
+
+CHARS_PER_TOKEN = 4
+INPUT_AUDIO_TOKENS_PER_S = 10   # User audio
+OUTPUT_AUDIO_TOKENS_PER_S = 20  # Model audio
+KEEP_LAST = 4  # Most recent items never evicted, so the current exchange stays intact
+EVICTION_POLICIES = ('oldest', 'lru')
+SPILL_INITIAL_BYTES = 1 << 20
+
+
+class SpillFile:
+    """ Append-only audio store in a memory-mapped file that grows by doubling. Space isn't reclaimed. """
+
+    def __init__(self, path=None, initial_bytes=SPILL_INITIAL_BYTES):
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(prefix='realtime-spill-')
+            os.close(fd)
+        self.path = path
+        self.f = open(path, 'w+b')
+        self.f.truncate(initial_bytes)
+        self.map = mmap.mmap(self.f.fileno(), initial_bytes)
+        self.size = 0
+
+    def append(self, data):
+        """ Store `data`; returns its offset. """
+        offset = self.size
+        end = offset + len(data)
+        if end > len(self.map):
+            self.map.resize(max(len(self.map) * 2, end))
+        self.map[offset:end] = data
+        self.size = end
+        return offset
+
+    def read(self, offset, length):
+        return self.map[offset:offset + length]
+
+    def close(self):
+        self.map.close()
+        self.f.close()
+        if self.temporary:
+            os.remove(self.path)
+
+
+class ConversationItem:
+    __slots__ = ('id', 'type', 'role', 'status', 'text', 'audio_bytes', 'audio', 'tokens', 'bytes', 'created_at',
+                 'used_at', 'deleting')
+
+    def __init__(self, item_id, item_type, role):
+        self.id = item_id
+        self.type = item_type
+        self.role = role
+        self.status = None
+        self.text = ''  # Text, transcript, function arguments or output
+        self.audio_bytes = 0
+        self.audio = []  # [offset, length] spans in the spill file
+        self.tokens = 0
+        self.bytes = 0
+        self.created_at = self.used_at = time.monotonic()
+        self.deleting = False  # conversation.item.delete sent
+
+    def __repr__(self):
+        return f'ConversationItem({self.id!r} {self.role} {self.type} {self.tokens} tokens {self.text[:40]!r})'
+
+
+def _item_text(item):
+    if item.get('type') == 'function_call':
+        return f"{item.get('name', '')}({item.get('arguments', '')})"
+    if item.get('type') == 'function_call_output':
+        return item.get('output', '')
+    return ' '.join(part.get('text') or part.get('transcript') or '' for part in item.get('content', [])).strip()
+
+
+class Conversation:
+    def __init__(self, send=None, metrics=None, max_tokens=None, max_bytes=None, policy='oldest', keep_last=KEEP_LAST,
+                 spill=None, audio_bytes_per_s=48000):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f'policy must be one of {EVICTION_POLICIES}')
+        self.send = send  # Thread-safe send for conversation.item.delete
+        self.max_tokens = max_tokens  # Budgets; None means no limit (accounting only)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.keep_last = keep_last
+        self.audio_bytes_per_s = audio_bytes_per_s  # Of the wire audio format
+        self.spill = None
+        if spill:
+            self.spill = SpillFile(None if spill is True else spill)  # spill=True: a temporary file
+
+        self.items = collections.OrderedDict()  # id -> ConversationItem, in conversation order
+        self.tokens = 0
+        self.bytes = 0
+        self.evicted = 0
+        self._lock = threading.Lock()  # Mic audio arrives on the audio thread, events on the reader
+        self._pending_audio_bytes = 0  # Input audio appended since the last commit
+        self._pending_audio = []
+        self._committed = None  # (item_id, audio bytes, spans): committed input audio waiting for its item
+
+        self.metrics = metrics or Registry()
+        self.metrics.gauge('conversation_items', 'Items in the conversation', fn=lambda: len(self.items))
+        self.metrics.gauge('conversation_tokens', 'Estimated tokens in the conversation', fn=lambda: self.tokens)
+        self.metrics.gauge('conversation_bytes', 'Text and audio bytes in the conversation', fn=lambda: self.bytes)
+        self.metrics.counter('conversation_evicted_total', 'Items deleted to stay within budget',
+                             fn=lambda: self.evicted)
+
+    def get(self, item_id):
+        item = self.items.get(item_id)
+        if item:
+            item.used_at = time.monotonic()
+        return item
+
+    def audio(self, item_id):
+        """ The item's audio as sent or received (wire format), if spilled; else None. """
+        item = self.items.get(item_id)
+        if item is None or not self.spill:
+            return None
+        item.used_at = time.monotonic()
+        with self._lock:
+            return b''.join(self.spill.read(offset, length) for offset, length in item.audio)
+
+    # Audio, from Realtime
+
+    def on_input_audio(self, audio):
+        """ Mic audio sent to the input buffer; it joins the item created when the buffer is committed. """
+        with self._lock:
+            self._pending_audio_bytes += len(audio)
+            if self.spill:
+                self._add_span(self._pending_audio, audio)
+
+    def on_audio_delta(self, message):
+        item = self.items.get(message.get('item_id'))
+        if item is None:
+            return
+        audio = message.get('audio')
+        size = len(audio) if audio is not None else len(message.get('delta', '')) * 3 // 4
+        with self._lock:
+            item.audio_bytes += size
+            if self.spill and audio is not None:
+                self._add_span(item.audio, audio)
+
+    def _add_span(self, spans, audio):
+        offset = self.spill.append(audio)
+        if spans and spans[-1][0] + spans[-1][1] == offset:
+            spans[-1][1] += len(audio)  # Contiguous with the last span
+        else:
+            spans.append([offset, len(audio)])
+
+    # Server events, on the socket's reader
+
+    def on_committed(self, message):
+        with self._lock:
+            self._committed = (message.get('item_id'), self._pending_audio_bytes, self._pending_audio)
+            self._pending_audio_bytes, self._pending_audio = 0, []
+        item = self.items.get(message.get('item_id'))
+        if item:
+            self._attach_input_audio(item)
+
+    def _attach_input_audio(self, item):
+        if self._committed and self._committed[0] == item.id:
+            _, item.audio_bytes, item.audio = self._committed
+            self._committed = None
+            self._account(item)
+
+    def on_cleared(self, message):
+        with self._lock:
+            self._pending_audio_bytes, self._pending_audio = 0, []
+
+    def on_item_created(self, message):
+        item = message.get('item', {})
+        if item.get('id') in self.items:
+            return
+        tracked = ConversationItem(item.get('id'), item.get('type'), item.get('role'))
+        tracked.status = item.get('status')
+        tracked.text = _item_text(item)
+        self.items[tracked.id] = tracked
+        self._attach_input_audio(tracked)
+        self._account(tracked)
+
+    def on_item_done(self, message):
+        item = message.get('item', {})
+        tracked = self.items.get(item.get('id'))
+        if tracked is None:
+            self.on_item_created(message)
+            return
+        tracked.status = item.get('status')
+        tracked.text = _item_text(item) or tracked.text
+        tracked.used_at = time.monotonic()
+        self._account(tracked)
+        self._evict()
+
+    def on_input_transcript(self, message):
+        tracked = self.items.get(message.get('item_id'))
+        if tracked:
+            tracked.text = message.get('transcript', '')
+            self._account(tracked)
+
+    def on_truncated(self, message):
+        tracked = self.items.get(message.get('item_id'))
+        if tracked:
+            kept = int(message.get('audio_end_ms', 0) * self.audio_bytes_per_s / 1000)
+            tracked.audio_bytes = min(tracked.audio_bytes, kept)
+            tracked.used_at = time.monotonic()
+            self._account(tracked)
+
+    def on_item_deleted(self, message):
+        tracked = self.items.pop(message.get('item_id'), None)
+        if tracked and not tracked.deleting:  # Deleted by someone else; our own deletes were discounted already
+            self.tokens -= tracked.tokens
+            self.bytes -= tracked.bytes
+
+    def on_response_done(self, message):
+        self._evict()
+
+    def reset(self):
+        """ A new connection starts a new server-side conversation. """
+        self.items.clear()
+        self.tokens = self.bytes = 0
+        self._committed = None
+        with self._lock:
+            self._pending_audio_bytes, self._pending_audio = 0, []
+
+    # Accounting and eviction
+
+    def _account(self, item):
+        audio_s = item.audio_bytes / self.audio_bytes_per_s
+        rate = INPUT_AUDIO_TOKENS_PER_S if item.role == 'user' else OUTPUT_AUDIO_TOKENS_PER_S
+        tokens = math.ceil(len(item.text) / CHARS_PER_TOKEN) + math.ceil(audio_s * rate)
+        size = len(item.text.encode('utf-8')) + item.audio_bytes
+        if not item.deleting:
+            self.tokens += tokens - item.tokens
+            self.bytes += size - item.bytes
+        item.tokens = tokens
+        item.bytes = size
+
+    def over_budget(self):
+        return ((self.max_tokens is not None and self.tokens > self.max_tokens)
+                or (self.max_bytes is not None and self.bytes > self.max_bytes))
+
+    def _evict(self):
+        """ Delete items from the server, oldest (or least recently used) first, until within budget. """
+        if not self.over_budget() or not self.send:
+            return
+        candidates = [item for item in list(self.items.values())[:-self.keep_last or None] if not item.deleting]
+        if self.policy == 'lru':
+            candidates.sort(key=lambda item: item.used_at)
+        for item in candidates:
+            if not self.over_budget():
+                break
+            item.deleting = True  # Stops counting now, so the next check doesn't pick it again
+            self.tokens -= item.tokens
+            self.bytes -= item.bytes
+            self.evicted += 1
+            self.send({'type': 'conversation.item.delete', 'item_id': item.id})
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+            self.spill = None
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+FILTER_MS = 170  # Echo tail covered by the adaptive filter
+STEP_SIZE = 0.5  # NLMS step size, 0 < mu < 2
+POWER_SMOOTHING = 0.9
+EPSILON = 1e-6
+
+
+class EchoCanceller:
+    """
+    Partitioned-block frequency-domain NLMS echo canceller (overlap-save).
+
+    `process(mic, reference)` takes one block of mic PCM16 and the speaker PCM16
+    that was played over the same period, and returns the mic block with the
+    estimated echo of the reference subtracted. The filter is split into
+    partitions of one block each, so per-block cost is a few FFTs of 2*block
+    plus O(partitions * block) vector ops, independent of echo-tail length in FFT size.
+    """
+
+    def __init__(self, block_size, rate, filter_ms=FILTER_MS, step_size=STEP_SIZE):
+        self.block_size = block_size
+        self.rate = rate
+        self.step_size = step_size
+        self.partitions = max(1, int(np.ceil(rate * filter_ms / 1000 / block_size)))
+
+        bins = block_size + 1  # rfft of 2 * block_size
+        self.weights = np.zeros((self.partitions, bins), dtype=np.complex128)
+        self.far_spectra = np.zeros((self.partitions, bins), dtype=np.complex128)  # Newest partition first
+        self.far_power = np.full(bins, EPSILON)
+        self._far_frame = np.zeros(2 * block_size)  # [previous block | current block]
+        self._err_frame = np.zeros(2 * block_size)  # [zeros | error]
+
+        # Instrumentation
+        self.blocks = 0
+        self.bypassed = 0
+        self.cpu_total = 0.0
+        self.cpu_max = 0.0
+
+    def process(self, mic, reference):
+        """ Cancel echo in one block; blocks of the wrong size pass through unchanged. """
+        started_at = time.perf_counter()
+        n = self.block_size
+        if len(mic) != n * 2 or (reference is not None and len(reference) != n * 2):
+            self.bypassed += 1
+            return mic
+
+        d = np.frombuffer(mic, dtype='<i2').astype(np.float64)
+        self._far_frame[:n] = self._far_frame[n:]
+        if reference is None:
+            self._far_frame[n:] = 0.0
+        else:
+            self._far_frame[n:] = np.frombuffer(reference, dtype='<i2')
+
+        far = np.fft.rfft(self._far_frame)
+        self.far_spectra[1:] = self.far_spectra[:-1]
+        self.far_spectra[0] = far
+        self.far_power *= POWER_SMOOTHING
+        self.far_power += (1 - POWER_SMOOTHING) * (far.real ** 2 + far.imag ** 2)
+
+        echo = np.fft.irfft((self.far_spectra * self.weights).sum(axis=0))[n:]
+        err = d - echo
+
+        # Constrained (overlap-save) NLMS update: gradient limited to the first half of each partition
+        self._err_frame[n:] = err
+        err_spectrum = np.fft.rfft(self._err_frame)
+        gradient = np.fft.irfft(np.conj(self.far_spectra) * (err_spectrum / (self.far_power * self.partitions)), axis=1)
+        gradient[:, n:] = 0.0
+        self.weights += self.step_size * np.fft.rfft(gradient, axis=1)
+
+        out = np.clip(err, -32768, 32767).astype('<i2').tobytes()
+
+        elapsed = time.perf_counter() - started_at
+        self.blocks += 1
+        self.cpu_total += elapsed
+        if elapsed > self.cpu_max:
+            self.cpu_max = elapsed
+        return out
+
+    def stats(self):
+        """ CPU per block against the real-time budget of one block. """
+        budget = self.block_size / self.rate
+        mean = self.cpu_total / self.blocks if self.blocks else 0.0
+        return {
+            'blocks': self.blocks,
+            'bypassed': self.bypassed,
+            'partitions': self.partitions,
+            'mean_us': mean * 1e6,
+            'max_us': self.cpu_max * 1e6,
+            'budget_us': budget * 1e6,
+            'load': mean / budget,
+        }
@@ -0,0 +1,149 @@
+"""
+Typed server events and the dispatch table that routes them.
+
+Every server event type of the Realtime API has a compact `__slots__` class
+here (`ResponseTextDelta`, `RateLimitsUpdated`, ...), looked up by type in
+`EVENT_CLASSES`. Decoded messages stay plain dicts on the hot path: a typed
+event is only built when someone subscribed to that type with `typed=True`,
+and `Dispatcher.handles()` lets the socket skip parsing frames nobody wants.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+ANY = '*'  # Subscribe to every event type
+
+_RESPONSE_PART = ('response_id', 'item_id', 'output_index', 'content_index')
+
+
+class Event:
+    """ Base for typed events: `type`, `event_id`, plus the fields of the event type. """
+
+    __slots__ = ('type', 'event_id')
+    fields = ()
+
+    @classmethod
+    def from_message(cls, message):
+        event = cls.__new__(cls)
+        event.type = message.get('type')
+        event.event_id = message.get('event_id')
+        for field in cls.fields:
+            setattr(event, field, message.get(field))
+        return event
+
+    def __repr__(self):
+        values = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields)
+        return f'{type(self).__name__}({values})'
+
+
+class UnknownEvent(Event):
+    """ An event type this module doesn't know yet; the decoded message is kept whole. """
+
+    __slots__ = ('message',)
+
+    @classmethod
+    def from_message(cls, message):
+        event = super().from_message(message)
+        event.message = message
+        return event
+
+
+EVENT_CLASSES = {}  # Event type -> Event subclass
+
+
+def _event(name, event_type, fields):
+    cls = type(name, (Event,), {'__slots__': fields, 'fields': fields, 'event_type': event_type,
+                                '__module__': __name__})
+    EVENT_CLASSES[event_type] = cls
+    globals()[name] = cls
+    return cls
+
+
+_event('Error', 'error', ('error',))
+_event('SessionCreated', 'session.created', ('session',))
+_event('SessionUpdated', 'session.updated', ('session',))
+_event('ConversationCreated', 'conversation.created', ('conversation',))
+_event('ConversationItemCreated', 'conversation.item.created', ('previous_item_id', 'item'))
+_event('InputTranscriptionCompleted', 'conversation.item.input_audio_transcription.completed',
+       ('item_id', 'content_index', 'transcript'))
+_event('InputTranscriptionFailed', 'conversation.item.input_audio_transcription.failed',
+       ('item_id', 'content_index', 'error'))
+_event('ConversationItemTruncated', 'conversation.item.truncated', ('item_id', 'content_index', 'audio_end_ms'))
+_event('ConversationItemDeleted', 'conversation.item.deleted', ('item_id',))
+_event('InputAudioBufferCommitted', 'input_audio_buffer.committed', ('previous_item_id', 'item_id'))
+_event('InputAudioBufferCleared', 'input_audio_buffer.cleared', ())
+_event('SpeechStarted', 'input_audio_buffer.speech_started', ('audio_start_ms', 'item_id'))
+_event('SpeechStopped', 'input_audio_buffer.speech_stopped', ('audio_end_ms', 'item_id'))
+_event('ResponseCreated', 'response.created', ('response',))
+_event('ResponseDone', 'response.done', ('response',))
+_event('OutputItemAdded', 'response.output_item.added', ('response_id', 'output_index', 'item'))
+_event('OutputItemDone', 'response.output_item.done', ('response_id', 'output_index', 'item'))
+_event('ContentPartAdded', 'response.content_part.added', _RESPONSE_PART + ('part',))
+_event('ContentPartDone', 'response.content_part.done', _RESPONSE_PART + ('part',))
+_event('ResponseTextDelta', 'response.text.delta', _RESPONSE_PART + ('delta',))
+_event('ResponseTextDone', 'response.text.done', _RESPONSE_PART + ('text',))
+_event('AudioTranscriptDelta', 'response.audio_transcript.delta', _RESPONSE_PART + ('delta',))
+_event('AudioTranscriptDone', 'response.audio_transcript.done', _RESPONSE_PART + ('transcript',))
+_event('ResponseAudioDelta', 'response.audio.delta', _RESPONSE_PART + ('audio', 'delta'))  # audio: decoded PCM
+_event('ResponseAudioDone', 'response.audio.done', _RESPONSE_PART)
+_event('FunctionCallArgumentsDelta', 'response.function_call_arguments.delta',
+       ('response_id', 'item_id', 'output_index', 'call_id', 'delta'))
+_event('FunctionCallArgumentsDone', 'response.function_call_arguments.done',
+       ('response_id', 'item_id', 'output_index', 'call_id', 'arguments'))
+_event('RateLimitsUpdated', 'rate_limits.updated', ('rate_limits',))
+
+
+def typed(message):
+    """ The typed event for a decoded message dict. """
+    return EVENT_CLASSES.get(message.get('type'), UnknownEvent).from_message(message)
+
+
+class Dispatcher:
+    """
+    Event type -> handlers, looked up once per message.
+
+    Handlers registered with `typed=False` get the decoded dict (what the
+    session's own handlers use); `typed=True` handlers get an Event, built at
+    most once per message. An exception in one handler is logged and doesn't
+    stop the others or the socket's reader.
+    """
+
+    def __init__(self):
+        self._table = {}  # event type -> (handler, typed) tuples; rebuilt on change, read lock-free by dispatch()
+
+    def on(self, event_type, handler, typed=True):
+        """ Subscribe `handler` to an event type, or to every type with ANY ('*'). """
+        self._table[event_type] = self._table.get(event_type, ()) + ((handler, typed),)
+        return handler
+
+    def off(self, event_type, handler):
+        entries = tuple(entry for entry in self._table.get(event_type, ()) if entry[0] != handler)
+        if entries:
+            self._table[event_type] = entries
+        else:
+            self._table.pop(event_type, None)
+
+    def handles(self, event_type):
+        """ False if nothing would receive this event type, so the frame needn't be parsed at all. """
+        return event_type is None or event_type in self._table or ANY in self._table
+
+    def dispatch(self, message):
+        event_type = message.get('type')
+        entries = self._table.get(event_type)
+        if ANY in self._table:
+            entries = (entries or ()) + self._table[ANY]
+        if not entries:
+            return False
+
+        event = None
+        for handler, wants_typed in entries:
+            try:
+                if wants_typed:
+                    if event is None:
+                        event = typed(message)
+                    handler(event)
+                else:
+                    handler(message)
+            except Exception:
+                log.exception('Error in handler for %s', event_type)
+        return True
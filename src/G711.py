@@ -0,0 +1,76 @@
+"""
+G.711 mu-law / A-law codecs (8 kHz telephony formats accepted by the Realtime API).
+
+Encoding is a single lookup into a 65536-entry table indexed by the int16
+sample, decoding a lookup into a 256-entry table; both tables are built once,
+vectorised, from the reference (Sun g711.c) algorithms.
+"""
+import numpy as np
+
+RATE = 8000
+FORMATS = ('g711_ulaw', 'g711_alaw')
+
+_SEG_UEND = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+_SEG_AEND = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 8159
+
+
+def _linear_to_ulaw(x):
+    pcm = x.astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), _ULAW_CLIP) + (_ULAW_BIAS >> 2)
+    seg = np.searchsorted(_SEG_UEND, pcm)
+    uval = (seg << 4) | ((pcm >> np.minimum(seg + 1, 31)) & 0xF)
+    return (np.where(seg >= 8, 0x7F ^ mask, uval ^ mask) & 0xFF).astype(np.uint8)
+
+
+def _ulaw_to_linear(u):
+    u = ~u.astype(np.int32) & 0xFF
+    t = (((u & 0x0F) << 3) + _ULAW_BIAS) << ((u & 0x70) >> 4)
+    return np.where(u & 0x80, _ULAW_BIAS - t, t - _ULAW_BIAS).astype(np.int16)
+
+
+def _linear_to_alaw(x):
+    pcm = x.astype(np.int32) >> 3
+    negative = pcm < 0
+    mask = np.where(negative, 0x55, 0xD5)
+    pcm = np.where(negative, -pcm - 1, pcm)
+    seg = np.searchsorted(_SEG_AEND, pcm)
+    low = np.where(seg < 2, pcm >> 1, pcm >> np.minimum(seg, 31)) & 0xF
+    aval = (seg << 4) | low
+    return (np.where(seg >= 8, 0x7F ^ mask, aval ^ mask) & 0xFF).astype(np.uint8)
+
+
+def _alaw_to_linear(a):
+    a = a.astype(np.int32) ^ 0x55
+    t = (a & 0x0F) << 4
+    seg = (a & 0x70) >> 4
+    t = np.where(seg == 0, t + 8, (t + 0x108) << np.maximum(seg - 1, 0))
+    return np.where(a & 0x80, t, -t).astype(np.int16)
+
+
+_ALL_SAMPLES = np.arange(65536, dtype=np.uint32).astype(np.uint16).view(np.int16)  # Indexed by uint16 bit pattern
+_ALL_CODES = np.arange(256, dtype=np.uint8)
+
+ULAW_ENCODE = _linear_to_ulaw(_ALL_SAMPLES)
+ULAW_DECODE = _ulaw_to_linear(_ALL_CODES)
+ALAW_ENCODE = _linear_to_alaw(_ALL_SAMPLES)
+ALAW_DECODE = _alaw_to_linear(_ALL_CODES)
+
+_TABLES = {
+    'g711_ulaw': (ULAW_ENCODE, ULAW_DECODE),
+    'g711_alaw': (ALAW_ENCODE, ALAW_DECODE),
+}
+
+
+def encode(pcm, format):
+    """ PCM16 bytes -> G.711 bytes (one byte per sample). """
+    table = _TABLES[format][0]
+    return table[np.frombuffer(pcm, dtype='<u2')].tobytes()
+
+
+def decode(data, format):
+    """ G.711 bytes -> PCM16 bytes. """
+    table = _TABLES[format][1]
+    return table[np.frombuffer(data, dtype=np.uint8)].astype('<i2', copy=False).tobytes()
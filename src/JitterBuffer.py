@@ -0,0 +1,144 @@
+import time
+
+from RingBuffer import RingBuffer
+
+MIN_MS = 20        # Smallest prebuffer target
+INITIAL_MS = 60    # Prebuffer target before any jitter has been measured
+MAX_MS = 400       # Largest prebuffer target
+JITTER_FACTOR = 3  # Target covers this many mean deviations of arrival jitter
+GROW_MS = 40       # Target increase after an underrun
+SHRINK_MS = 10     # Target decrease after a stable stretch...
+SHRINK_AFTER = 200  # ...of this many callbacks without an underrun (~8.5 s at 1024 frames / 24 kHz)
+STREAM_GAP_S = 1.0  # Arrivals further apart than this start a new stream rather than count as jitter
+FADE_MS = 5        # Length of the fade used to conceal gaps
+
+
+class JitterBuffer(RingBuffer):
+    """
+    Adaptive playout buffer for response audio.
+
+    The producer side (`write`) tracks inter-arrival jitter of deltas the way
+    RFC 3550 does, comparing arrival spacing against the audio duration just
+    received. The consumer side (`read_into`) holds playback until `target_ms`
+    is buffered, then plays. If it runs dry mid-stream, the tail is faded out
+    rather than hard-cut, the target grows and playback rebuffers; the first
+    chunk after a gap is faded in. The target shrinks again after a stable
+    stretch. `mark_end()` lets the final partial chunk of a response play
+    without waiting for the prebuffer, and without counting as an underrun.
+    """
+
+    def __init__(self, capacity, rate, min_ms=MIN_MS, initial_ms=INITIAL_MS, max_ms=MAX_MS):
+        super().__init__(capacity)
+        self.rate = rate
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.target_ms = min(max(initial_ms, min_ms), max_ms)
+        self.fade_samples = int(rate * FADE_MS / 1000)
+        self._fade_gain = [i / self.fade_samples for i in range(self.fade_samples)]
+
+        # Producer state
+        self.jitter_ms = 0.0
+        self._last_arrival = None
+        self._last_duration = 0.0
+        self._stream_started_at = None
+        self.end_of_stream = False
+
+        # Consumer state
+        self.playing = False
+        self._fade_in = False
+        self._stable = 0
+
+        self.underruns = 0
+        self.concealed = 0
+        self.streams = 0
+        self.added_latency_total = 0.0  # Seconds spent prebuffering before playback started
+        self.added_latency_max = 0.0
+
+    def _bytes(self, ms):
+        return int(self.rate * ms / 1000) * 2
+
+    def write(self, data):
+        now = time.monotonic()
+        if self._last_arrival is None or now - self._last_arrival > STREAM_GAP_S:
+            self._stream_started_at = now
+        else:
+            deviation = abs((now - self._last_arrival) - self._last_duration) * 1000
+            self.jitter_ms += (deviation - self.jitter_ms) / 16
+            floor = min(self.max_ms, max(self.min_ms, JITTER_FACTOR * self.jitter_ms))
+            if self.target_ms < floor:
+                self.target_ms = floor
+        self._last_arrival = now
+        self._last_duration = len(data) / 2 / self.rate
+        self.end_of_stream = False
+        return super().write(data)
+
+    def mark_end(self):
+        """ Producer side: no more audio is coming for now, so play out whatever is left. """
+        self.end_of_stream = True
+        self._last_arrival = None
+
+    def read_into(self, out):
+        if not self.playing:
+            available = len(self)
+            if available == 0 or (available < self._bytes(self.target_ms) and not self.end_of_stream):
+                return 0  # Still prebuffering
+            self.playing = True
+            if self._stream_started_at is not None:
+                waited = time.monotonic() - self._stream_started_at
+                self._stream_started_at = None
+                self.streams += 1
+                self.added_latency_total += waited
+                if waited > self.added_latency_max:
+                    self.added_latency_max = waited
+
+        n = super().read_into(out)
+        if self._fade_in and n:
+            self._apply_fade(out, 0, n, fade_in=True)
+            self._fade_in = False
+
+        if n < len(out):
+            self.playing = False
+            if not self.end_of_stream:
+                # Ran dry mid-stream: conceal the cut, then rebuffer with a larger target
+                self.underruns += 1
+                self.concealed += 1
+                self._apply_fade(out, 0, n, fade_in=False)
+                self._fade_in = True
+                self._stable = 0
+                self.target_ms = min(self.max_ms, self.target_ms + GROW_MS)
+        else:
+            self._stable += 1
+            if self._stable >= SHRINK_AFTER:
+                self._stable = 0
+                floor = max(self.min_ms, JITTER_FACTOR * self.jitter_ms)
+                self.target_ms = max(floor, self.target_ms - SHRINK_MS)
+        return n
+
+    def _apply_fade(self, out, start, end, fade_in):
+        """ Linear fade over up to FADE_MS at the start (fade in) or end (fade out) of out[start:end]. """
+        samples = memoryview(out).cast('h')
+        first, last = start // 2, end // 2
+        count = min(self.fade_samples, last - first)
+        gain = self._fade_gain
+        if fade_in:
+            for i in range(count):
+                samples[first + i] = int(samples[first + i] * gain[i])
+        else:
+            for i in range(count):
+                samples[last - 1 - i] = int(samples[last - 1 - i] * gain[i])
+
+    def clear(self):
+        super().clear()
+        self.playing = False
+        self._fade_in = False
+
+    def stats(self):
+        return {
+            'target_ms': self.target_ms,
+            'jitter_ms': self.jitter_ms,
+            'underruns': self.underruns,
+            'concealed': self.concealed,
+            'buffered_ms': len(self) / 2 / self.rate * 1000,
+            'added_latency_ms_mean': self.added_latency_total / self.streams * 1000 if self.streams else 0.0,
+            'added_latency_ms_max': self.added_latency_max * 1000,
+        }
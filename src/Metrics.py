@@ -0,0 +1,232 @@
+"""
+Counters, gauges and histograms for the realtime pipeline, with Prometheus text export.
+
+Each session owns a Registry, shared by its Realtime, Socket and AudioIO.
+Recording is a few attribute updates and one bisect, cheap enough to run on
+the audio callbacks. Each metric is written from one thread (the one that
+owns that stage), so there is no locking; readers may see a snapshot that is
+one update behind. Values that already live elsewhere (ring buffer positions,
+jitter buffer counters) are registered as callbacks and only read at export.
+
+OpenTelemetry is optional: `otel_tracer()` returns a tracer when the
+opentelemetry-api package is installed, which Realtime uses for one span per
+response.
+"""
+import bisect
+import http.server
+import threading
+
+# Bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+RESPONSE_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 1024)
+
+PREFIX = 'realtime_'
+
+
+class Counter:
+    """ A running total, incremented here or read from `fn` at export time. """
+    kind = 'counter'
+
+    __slots__ = ('name', 'help', 'value', 'fn')
+
+    def __init__(self, name, help='', fn=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.fn = fn
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+    def samples(self):
+        yield '', None, self.get()
+
+
+class Gauge:
+    """ A value that is set, or read from `fn` at export time. """
+    kind = 'gauge'
+
+    __slots__ = ('name', 'help', 'value', 'fn')
+
+    def __init__(self, name, help='', fn=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+    def samples(self):
+        yield '', None, self.get()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    __slots__ = ('name', 'help', 'bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Estimate from the buckets, interpolating linearly within the one that holds the q-th observation. """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.max
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+        }
+
+    def samples(self):
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            yield '_bucket', ('le', _number(bound)), cumulative
+        yield '_bucket', ('le', '+Inf'), self.count
+        yield '_sum', None, self.sum
+        yield '_count', None, self.count
+
+
+class Registry:
+    """ Named metrics for one session. `labels` (e.g. {'session': '3'}) are attached to every exported sample. """
+
+    def __init__(self, labels=None, prefix=PREFIX):
+        self.labels = dict(labels or {})
+        self.prefix = prefix
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(self.prefix + name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help='', fn=None):
+        counter = self._get(Counter, name, help)
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name, help='', fn=None):
+        gauge = self._get(Gauge, name, help)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        """ Plain-dict view: counter/gauge values, histogram summaries. """
+        out = {}
+        for name, metric in self.metrics.items():
+            out[name] = metric.summary() if isinstance(metric, Histogram) else metric.get()
+        return out
+
+    def prometheus_text(self):
+        return prometheus_text([self])
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def prometheus_text(registries):
+    """ Prometheus text exposition (0.0.4) for one or more registries, e.g. every session in a SessionPool. """
+    families = {}
+    for registry in registries:
+        for metric in registry.metrics.values():
+            families.setdefault(metric.name, []).append((registry, metric))
+
+    lines = []
+    for name, members in families.items():
+        first = members[0][1]
+        if first.help:
+            lines.append(f'# HELP {name} {first.help}')
+        lines.append(f'# TYPE {name} {first.kind}')
+        for registry, metric in members:
+            base = list(registry.labels.items())
+            for suffix, extra, value in metric.samples():
+                labels = base + [extra] if extra else base
+                lines.append(f'{name}{suffix}{_label_text(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(registries, port=9464, host='127.0.0.1'):
+    """
+    Serve `/metrics` from a daemon thread. `registries` is a list, or a callable
+    returning one (so sessions can come and go). Returns the server; call shutdown() to stop.
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(registries() if callable(registries) else registries).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def otel_tracer(name='realtime'):
+    """ An OpenTelemetry tracer (needs opentelemetry-api; spans go nowhere until an SDK is configured). """
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        raise ImportError('Tracing needs opentelemetry-api (pip install opentelemetry-api opentelemetry-sdk)')
+    return trace.get_tracer(name)
@@ -0,0 +1,364 @@
+"""
+Local stand-in for the Realtime API, for benchmarks and offline testing.
+
+Speaks the subset of the protocol Realtime.py uses: `session.update`,
+`conversation.item.create`, `input_audio_buffer.append`, `response.create`
+and the `response.audio.delta` / `response.audio.done` stream that answers
+it. With `tool_call` set, the first response.create in a session that
+declared that tool is answered with a streamed function call instead (its
+output is kept in `tool_outputs`). `conversation.item.delete` is
+acknowledged and its item id kept in `deleted`. `drop_connections()` (or
+`--drop-every-s`) cuts every client off without a closing handshake, to
+exercise reconnects. Run standalone with `python MockServer.py --port 8765`,
+or embed with `MockServer().start()`, which serves from a background thread
+and returns the ws:// URL.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import logging
+import random
+import threading
+import time
+
+from websockets.asyncio.server import serve
+
+import Recording
+import Telemetry
+
+log = logging.getLogger(__name__)
+
+RATE = 24000
+G711_RATE = 8000
+DELTA_MS = 100       # Audio per response.audio.delta
+RESPONSE_MS = 2000   # Audio per response
+FIRST_DELTA_MS = 50  # Simulated model think time before the first delta
+JITTER_MS = 0        # Max random extra delay per delta
+ARGUMENTS_CHUNK = 8  # Characters of function call arguments per delta
+
+
+class MockServer:
+    def __init__(self, host='127.0.0.1', port=0, delta_ms=DELTA_MS, response_ms=RESPONSE_MS,
+                 first_delta_ms=FIRST_DELTA_MS, jitter_ms=JITTER_MS, on_append=None, drop_every_s=None,
+                 tool_call=None, handshake_ms=0):
+        self.host = host
+        self.port = port
+        self.delta_ms = delta_ms
+        self.response_ms = response_ms
+        self.first_delta_ms = first_delta_ms
+        self.jitter_ms = jitter_ms
+        self.on_append = on_append  # Called as on_append(pcm_bytes, arrived_at) for each input_audio_buffer.append
+        self.drop_every_s = drop_every_s  # Abort all connections this often (None: never)
+        self.tool_call = tool_call  # {'name': ..., 'arguments': {...}} for the model to call, or None
+        self.handshake_ms = handshake_ms  # Opening handshakes are held this long, like a distant server
+
+        self.connections = 0
+        self.appends = 0
+        self.append_bytes = 0
+        self.responses = 0
+        self.received = collections.Counter()  # Client events by type, across all connections
+        self.dropped = 0
+        self.tool_outputs = []  # function_call_output items received, in order
+        self.deleted = []  # Item ids from conversation.item.delete, in order
+        self.handshakes_in_flight = 0
+        self.max_handshakes_in_flight = 0
+
+        self._live = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._main = None
+        self._ready = threading.Event()
+        self._counter = 0
+
+    def _event_id(self):
+        self._counter += 1
+        return f'event_{self._counter}'
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/v1/realtime'
+
+    async def _send(self, ws, event):
+        event['event_id'] = self._event_id()
+        await ws.send(json.dumps(event, separators=(',', ':')))
+
+    async def _stream_response(self, ws, response_id, item_id, audio_format):
+        """ Stream one audio response paced at real time, with optional jitter. """
+        await self._send(ws, {'type': 'response.created', 'response': {'id': response_id, 'status': 'in_progress'}})
+        deltas = max(1, self.response_ms // self.delta_ms)
+        # Non-silent payload so playback isn't mistaken for an idle buffer
+        if audio_format == 'pcm16':
+            samples = bytes([1, 0]) * int(RATE * self.delta_ms / 1000)
+        else:
+            samples = b'\x7e' * int(G711_RATE * self.delta_ms / 1000)
+        payload = base64.b64encode(samples).decode('ascii')
+        transcript = f'Mock response {response_id}.'
+        words = transcript.split(' ')  # One per audio delta, as the real transcript runs alongside the audio
+        item = {'id': item_id, 'type': 'message', 'role': 'assistant', 'status': 'in_progress', 'content': []}
+        await self._send(ws, {'type': 'conversation.item.created', 'item': item})
+
+        started_at = time.monotonic() + self.first_delta_ms / 1000
+        for i in range(deltas):
+            due = started_at + i * self.delta_ms / 1000
+            if self.jitter_ms:
+                due += random.uniform(0, self.jitter_ms) / 1000
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._send(ws, {
+                'type': 'response.audio.delta', 'response_id': response_id, 'item_id': item_id,
+                'output_index': 0, 'content_index': 0, 'delta': payload,
+            })
+            if i < len(words):
+                await self._send(ws, {
+                    'type': 'response.audio_transcript.delta', 'response_id': response_id, 'item_id': item_id,
+                    'output_index': 0, 'content_index': 0, 'delta': words[i] if i == 0 else ' ' + words[i],
+                })
+
+        await self._send(ws, {'type': 'response.audio_transcript.done', 'response_id': response_id,
+                              'item_id': item_id, 'output_index': 0, 'content_index': 0,
+                              'transcript': ' '.join(words[:deltas])})
+        await self._send(ws, {'type': 'response.audio.done', 'response_id': response_id, 'item_id': item_id,
+                              'output_index': 0, 'content_index': 0})
+        item = dict(item, status='completed', content=[{'type': 'audio', 'transcript': transcript}])
+        await self._send(ws, {'type': 'response.output_item.done', 'response_id': response_id, 'output_index': 0,
+                              'item': item})
+        await self._send(ws, {'type': 'response.done', 'response': {
+            'id': response_id, 'status': 'completed', 'output': [item],
+        }})
+
+    def _count_append(self, event, arrived_at):
+        pcm = base64.b64decode(event['audio'])  # Raw G.711 bytes if the session switched format
+        self.appends += 1
+        self.append_bytes += len(pcm)
+        if self.on_append:
+            self.on_append(pcm, arrived_at)
+
+    async def _stream_tool_call(self, ws, response_id, item_id):
+        """ Answer with one function call, its arguments streamed in small deltas. """
+        call_id = f'call_{response_id}'
+        name = self.tool_call['name']
+        arguments = json.dumps(self.tool_call.get('arguments', {}))
+        item = {'id': item_id, 'type': 'function_call', 'status': 'in_progress', 'call_id': call_id, 'name': name,
+                'arguments': ''}
+        await self._send(ws, {'type': 'response.created', 'response': {'id': response_id, 'status': 'in_progress'}})
+        await asyncio.sleep(self.first_delta_ms / 1000)
+        await self._send(ws, {'type': 'response.output_item.added', 'response_id': response_id, 'output_index': 0,
+                              'item': item})
+        for i in range(0, len(arguments), ARGUMENTS_CHUNK):
+            await self._send(ws, {'type': 'response.function_call_arguments.delta', 'response_id': response_id,
+                                  'item_id': item_id, 'output_index': 0, 'call_id': call_id,
+                                  'delta': arguments[i:i + ARGUMENTS_CHUNK]})
+        await self._send(ws, {'type': 'response.function_call_arguments.done', 'response_id': response_id,
+                              'item_id': item_id, 'output_index': 0, 'call_id': call_id, 'arguments': arguments})
+        item = dict(item, status='completed', arguments=arguments)
+        await self._send(ws, {'type': 'response.output_item.done', 'response_id': response_id, 'output_index': 0,
+                              'item': item})
+        await self._send(ws, {'type': 'response.done', 'response': {'id': response_id, 'status': 'completed',
+                                                                    'output': [item]}})
+
+    async def _handle(self, ws):
+        self.connections += 1
+        self._live.add(ws)
+        responses = {}  # Streaming task -> response id
+        audio_format = 'pcm16'
+        tools = set()
+        tool_called = False
+        transcribe = False  # Session asked for input_audio_transcription
+        commits = 0
+        try:
+            async for raw in ws:
+                arrived_at = time.monotonic()
+                event = json.loads(raw)
+                event_type = event.get('type')
+                self.received[event_type] += 1
+
+                if event_type == 'input_audio_buffer.append':
+                    self._count_append(event, arrived_at)
+
+                elif event_type == 'response.create':
+                    self.responses += 1
+                    response_id, item_id = f'resp_{self.responses}', f'item_{self.responses}'
+                    if self.tool_call and self.tool_call['name'] in tools and not tool_called:
+                        tool_called = True
+                        task = asyncio.create_task(self._stream_tool_call(ws, response_id, item_id))
+                    else:
+                        task = asyncio.create_task(self._stream_response(ws, response_id, item_id, audio_format))
+                    responses[task] = response_id
+                    task.add_done_callback(lambda task: responses.pop(task, None))
+
+                elif event_type == 'response.cancel':
+                    if not responses:
+                        await self._send(ws, {'type': 'error', 'error': {
+                            'type': 'invalid_request_error', 'code': 'response_cancel_not_active',
+                            'message': 'Cancellation failed: no active response found'}})
+                    for task, response_id in list(responses.items()):
+                        task.cancel()
+                        await self._send(ws, {'type': 'response.done', 'response': {
+                            'id': response_id, 'status': 'cancelled', 'output': []}})
+
+                elif event_type == 'conversation.item.truncate':
+                    await self._send(ws, {'type': 'conversation.item.truncated', 'item_id': event.get('item_id'),
+                                          'content_index': event.get('content_index', 0),
+                                          'audio_end_ms': event.get('audio_end_ms', 0)})
+
+                elif event_type == 'conversation.item.create':
+                    item = dict(event.get('item', {}))
+                    item.setdefault('id', f'item_client_{self.received[event_type]}')
+                    if item.get('type') == 'function_call_output':
+                        self.tool_outputs.append(item)
+                    await self._send(ws, {'type': 'conversation.item.created', 'item': item})
+
+                elif event_type == 'conversation.item.delete':
+                    self.deleted.append(event.get('item_id'))
+                    await self._send(ws, {'type': 'conversation.item.deleted', 'item_id': event.get('item_id')})
+
+                elif event_type == 'input_audio_buffer.commit':
+                    commits += 1
+                    item_id = f'item_input_{commits}'
+                    await self._send(ws, {'type': 'input_audio_buffer.committed', 'item_id': item_id})
+                    await self._send(ws, {'type': 'conversation.item.created', 'item': {
+                        'id': item_id, 'type': 'message', 'role': 'user', 'status': 'completed',
+                        'content': [{'type': 'input_audio', 'transcript': None}]}})
+                    if transcribe:
+                        await self._send(ws, {'type': 'conversation.item.input_audio_transcription.completed',
+                                              'item_id': item_id, 'content_index': 0,
+                                              'transcript': f'Mock transcription {commits}.'})
+
+                elif event_type == 'session.update':
+                    transcribe = transcribe or bool(event.get('session', {}).get('input_audio_transcription'))
+                    audio_format = event.get('session', {}).get('output_audio_format', audio_format)
+                    tools.update(tool.get('name') for tool in event.get('session', {}).get('tools', []))
+                    await self._send(ws, {'type': 'session.updated', 'session': event.get('session', {})})
+        except Exception as e:
+            log.info('Mock connection ended: %s', e)
+        finally:
+            self._live.discard(ws)
+            for task in list(responses):
+                task.cancel()
+
+    def _drop_all(self):
+        for ws in list(self._live):
+            ws.transport.abort()  # Like a network failure: no close frame
+            self.dropped += 1
+
+    def drop_connections(self):
+        """ Abort every open connection. Safe to call from any thread. """
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._drop_all)
+
+    async def _drop_periodically(self, every_s):
+        while True:
+            await asyncio.sleep(every_s)
+            self._drop_all()
+
+    async def _process_request(self, connection, request):
+        """ Hold each opening handshake for `handshake_ms`, counting how many are in progress at once. """
+        self.handshakes_in_flight += 1
+        self.max_handshakes_in_flight = max(self.max_handshakes_in_flight, self.handshakes_in_flight)
+        try:
+            await asyncio.sleep(self.handshake_ms / 1000)
+        finally:
+            self.handshakes_in_flight -= 1
+
+    async def serve(self):
+        """ Serve on the current event loop until cancelled. """
+        async with serve(self._handle, self.host, self.port, max_size=None,
+                         process_request=self._process_request if self.handshake_ms else None) as server:
+            self._server = server
+            self.port = server.sockets[0].getsockname()[1]
+            self._loop = self._loop or asyncio.get_running_loop()
+            self._ready.set()
+            if self.drop_every_s:
+                await self._drop_periodically(self.drop_every_s)
+            await asyncio.Future()
+
+    def start(self):
+        """ Serve from a background thread; returns the URL to connect to. """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._serve_task(),), daemon=True)
+        self._thread.start()
+        if not self._ready.wait(5):
+            raise RuntimeError(f'Mock server failed to start on {self.host}:{self.port}')
+        return self.url
+
+    async def _serve_task(self):
+        self._main = asyncio.current_task()
+        try:
+            await self.serve()
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._main.cancel)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+
+class ReplayServer(MockServer):
+    """
+    Serves a session recording (Recording.py): each client that connects gets
+    the recorded server events at their recorded times, divided by `speed`.
+    Client events are counted, and appends passed to `on_append`, but not answered.
+    """
+
+    def __init__(self, path, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed
+        self.frames = [(t, Recording.wire_frame(kind, data)) for kind, t, data in Recording.read_records(path)
+                       if kind in (Recording.RECEIVED, Recording.RECEIVED_AUDIO)]
+        self.replayed = 0  # Frames sent, over all connections
+
+    async def _play(self, ws):
+        started_at = time.monotonic()  # Stands in for the start of the recording, just before it connected
+        for t, frame in self.frames:
+            delay = started_at + t / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send(frame)
+            self.replayed += 1
+
+    async def _handle(self, ws):
+        self.connections += 1
+        self._live.add(ws)
+        player = asyncio.create_task(self._play(ws))
+        try:
+            async for raw in ws:
+                arrived_at = time.monotonic()
+                event = json.loads(raw)
+                self.received[event.get('type')] += 1
+                if event.get('type') == 'input_audio_buffer.append':
+                    self._count_append(event, arrived_at)
+        except Exception as e:
+            log.info('Replay connection ended: %s', e)
+        finally:
+            self._live.discard(ws)
+            player.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the Realtime API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delta-ms', type=int, default=DELTA_MS)
+    parser.add_argument('--response-ms', type=int, default=RESPONSE_MS)
+    parser.add_argument('--first-delta-ms', type=int, default=FIRST_DELTA_MS)
+    parser.add_argument('--jitter-ms', type=int, default=JITTER_MS)
+    parser.add_argument('--drop-every-s', type=float, default=None, help='Abort all connections this often')
+    args = parser.parse_args()
+
+    Telemetry.configure()
+    server = MockServer(args.host, args.port, args.delta_ms, args.response_ms, args.first_delta_ms, args.jitter_ms,
+                        drop_every_s=args.drop_every_s)
+    log.info('Serving on %s', server.url)
+    asyncio.run(server.serve())
+
+
+if __name__ == '__main__':
+    main()
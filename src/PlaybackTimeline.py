@@ -0,0 +1,93 @@
+"""
+Which response audio is coming out of the speaker right now.
+
+The playback ring buffer only counts bytes: `write_pos` as deltas arrive,
+`read_pos` as the speaker callback hands them to the device. The timeline
+tags ring positions with the item and content part whose audio starts
+there, and records for each speaker callback when its first sample reaches
+the DAC, from PortAudio's `time_info`. Together they answer "what is
+audible now, and how far into its item" with two binary searches, and
+measure the device's output latency instead of assuming it.
+
+Written from two threads (tags on the socket's reader, callbacks on the
+speaker thread) and read from any: each history is a list of tuples that
+is only appended to, or replaced whole when trimmed, so readers need no lock.
+"""
+import bisect
+import math
+import time
+
+SEGMENTS = 256  # Tagged segments kept; one per item and content part
+CALLBACKS = 64  # Speaker callbacks kept, ~2.7 s of 1024-frame chunks at 24 kHz
+
+
+class PlaybackTimeline:
+    def __init__(self, rate, sample_width=2, default_latency=0.0):
+        self.rate = rate
+        self.sample_width = sample_width
+        self.bytes_per_s = rate * sample_width
+        self.default_latency = default_latency  # Used when time_info is all zeros: the stream's reported latency
+        self.output_latency = None  # Seconds from the latest callback to its first sample reaching the DAC
+        self._segments = []   # (ring position, content_index, item_id), ascending position
+        self._callbacks = []  # (DAC time on the monotonic clock, ring position, bytes of audio), ascending time
+
+    def tag(self, pos, item_id, content_index=0):
+        """ Audio written from ring position `pos` on belongs to (item_id, content_index). """
+        segments = self._segments
+        if segments and segments[-1][2] == item_id and segments[-1][1] == content_index:
+            return
+        segments.append((pos, content_index, item_id))
+        if len(segments) > 2 * SEGMENTS:
+            self._segments = segments[-SEGMENTS:]
+
+    def on_callback(self, pos, n, dac_time=0.0, current_time=0.0):
+        """
+        Speaker thread: `n` bytes of audio from ring position `pos` were just handed to the device.
+
+        `dac_time` and `current_time` are time_info's `output_buffer_dac_time` and
+        `current_time`, on the stream's clock (both 0.0 when the stream doesn't report them).
+        Returns the output latency, `dac_time - current_time`.
+        """
+        latency = self.default_latency
+        if dac_time or current_time:
+            latency = max(dac_time - current_time, 0.0)
+        self.output_latency = latency
+
+        callbacks = self._callbacks
+        callbacks.append((time.monotonic() + latency, pos, n))
+        if len(callbacks) > 2 * CALLBACKS:
+            self._callbacks = callbacks[-CALLBACKS:]
+        return latency
+
+    def position(self, at=None):
+        """ Ring position of the sample audible at monotonic time `at` (default now), or None if it is silence. """
+        at = time.monotonic() if at is None else at
+        callbacks = self._callbacks
+        i = bisect.bisect_right(callbacks, (at, math.inf)) - 1
+        if i < 0:
+            return None  # Nothing has reached the DAC yet
+        dac_at, pos, n = callbacks[i]
+        played = int((at - dac_at) * self.rate) * self.sample_width
+        if played >= n:
+            return None  # Past this callback's audio: an underrun, or nothing left to play
+        return pos + played
+
+    def locate(self, pos):
+        """ (item_id, content_index, ms into that content) for ring position `pos`, or None if it wasn't tagged. """
+        segments = self._segments
+        i = bisect.bisect_right(segments, (pos, math.inf)) - 1
+        if i < 0:
+            return None
+        start, content_index, item_id = segments[i]
+        return item_id, content_index, (pos - start) * 1000 // self.bytes_per_s
+
+    def audible(self, at=None):
+        """ (item_id, content_index, ms) of what is coming out of the speaker at `at` (default now), or None. """
+        pos = self.position(at)
+        return None if pos is None else self.locate(pos)
+
+    def items_from(self, pos):
+        """ Ids of the items tagged at or after the one playing at ring position `pos`. """
+        segments = self._segments
+        i = max(bisect.bisect_right(segments, (pos, math.inf)) - 1, 0)
+        return {item_id for _, _, item_id in segments[i:]}
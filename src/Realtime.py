@@ -1,31 +1,196 @@
-import base64
+import collections
 import logging
 import threading
+import time
 
 from Socket import Socket
 from AudioIO import AudioIO
+import Codec
+from Conversation import Conversation
+from Events import Dispatcher
+from Tools import ToolRegistry
+from Transcripts import Transcripts
+from Metrics import Registry, RESPONSE_BUCKETS
+from Telemetry import Sampler, audio_log
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+log = logging.getLogger(__name__)
+
+AUDIO_FORMATS = ('pcm16', 'g711_ulaw', 'g711_alaw')
+OPEN_RESPONSES = 16  # Responses tracked for latency/tracing; older ones are dropped if their response.done never comes
+REPLAY_ITEMS = 64    # Conversation items kept to rebuild the context on a new connection
+CANCELLED_ITEMS = 32  # Interrupted items whose late deltas are dropped, until response.done; oldest go first
 
 class Realtime:
-    def __init__(self, api_key, ws_url):
-        self.socket = Socket(api_key, ws_url, on_msg=self.handle_message)
-        self.audio_io = AudioIO(on_audio_callback=self.send_audio_to_socket)
+    def __init__(self, api_key, ws_url, audio_backend=None, echo_cancel=False, vad=False, vad_commit=False,
+                 barge_in=False, audio_format='pcm16', audio_options=None, metrics=None, tracer=None,
+                 socket_options=None, tool_options=None, record=None, conversation_options=None):
+        self.audio_backend = audio_backend  # None means real sound devices via PyAudio
+        self.audio_options = audio_options or {}  # Extra AudioIO settings, e.g. {'device_rate': 48000}
+        self.socket_options = socket_options or {}  # Extra Socket settings, e.g. {'reconnect': False, 'stale_audio': 'keep'}
+        self.echo_cancel = echo_cancel  # Keep the mic open while the AI speaks (needs numpy)
+
+        # Wire format: 24 kHz PCM16, or 8 kHz G.711 (needs numpy) with AudioIO resampling to/from the device rate
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f'audio_format must be one of {AUDIO_FORMATS}')
+        self.audio_format = audio_format
+        self.g711 = None
+        self.wire_rate = None
+        if audio_format != 'pcm16':
+            import G711
+            self.g711 = G711
+            self.wire_rate = G711.RATE
+
+        # Shared by the socket and audio I/O; see Metrics.prometheus_text / serve_prometheus for export
+        self.metrics = metrics or Registry()
+        self.tracer = tracer  # OpenTelemetry tracer (Metrics.otel_tracer()) for one span per response, or None
+        self._first_delta = self.metrics.histogram('first_delta_seconds', 'response.create to first audio delta',
+                                                   RESPONSE_BUCKETS)
+        self._response_time = self.metrics.histogram('response_seconds', 'response.create to response.done',
+                                                     RESPONSE_BUCKETS)
+        self.metrics.counter('interruptions_total', 'Responses cut off by barge-in', fn=lambda: self.interruptions)
+        self._requested = collections.deque()  # Send times of response.create not yet acknowledged
+        self._responses = {}  # response_id -> [requested_at, first_delta_at, span, cancelled], until response.done
+
+        # Session state replayed after a reconnect: merged session.update settings and recent conversation items
+        self.session_config = {}
+        self._items = collections.deque(maxlen=REPLAY_ITEMS)  # conversation.item.create messages, sent as they are
+        self.on_disconnect = None  # Called as on_disconnect(reason) when the connection drops
+        self.on_reconnect = None   # Called as on_reconnect(info) once it is back and the session state is replayed
+
+        # Server events are routed by type; see on() for subscribing. Frames nobody handles are never parsed.
+        self.events = Dispatcher()
+        self.rate_limits = []  # From the latest rate_limits.updated
+        for event_type, handler in (
+            ('response.audio.done', self._on_audio_done),
+            ('input_audio_buffer.speech_started', self._on_speech_started),
+            ('response.created', self._on_response_created),
+            ('response.done', self._on_response_done),
+            ('conversation.item.deleted', self._on_item_deleted),
+            ('rate_limits.updated', self._on_rate_limits),
+            ('error', self._on_error),
+        ):
+            self.events.on(event_type, handler, typed=False)
+
+        # What was said and written, both ways, as it streams in; see Transcripts for callbacks and iterators
+        self.transcripts = Transcripts()
+        for event_type, handler in (
+            ('response.text.delta', self.transcripts.on_text_delta),
+            ('response.text.done', self.transcripts.on_text_done),
+            ('response.audio_transcript.delta', self.transcripts.on_speech_delta),
+            ('response.audio_transcript.done', self.transcripts.on_speech_done),
+            ('conversation.item.input_audio_transcription.completed', self.transcripts.on_input_done),
+            ('conversation.item.input_audio_transcription.failed', self.transcripts.on_input_failed),
+            ('response.done', self.transcripts.on_response_done),
+        ):
+            self.events.on(event_type, handler, typed=False)
+
+        # Model of the server-side conversation; with a budget, old items are deleted as it fills up
+        wire_bytes_per_s = self.wire_rate if self.g711 else 24000 * 2  # G.711: one byte per sample
+        self.conversation = Conversation(send=self._send_from_audio_thread, metrics=self.metrics,
+                                         audio_bytes_per_s=wire_bytes_per_s, **(conversation_options or {}))
+        for event_type, handler in (
+            ('conversation.item.created', self.conversation.on_item_created),
+            ('response.output_item.done', self.conversation.on_item_done),
+            ('input_audio_buffer.committed', self.conversation.on_committed),
+            ('input_audio_buffer.cleared', self.conversation.on_cleared),
+            ('conversation.item.input_audio_transcription.completed', self.conversation.on_input_transcript),
+            ('conversation.item.truncated', self.conversation.on_truncated),
+            ('conversation.item.deleted', self.conversation.on_item_deleted),
+            ('response.done', self.conversation.on_response_done),
+        ):
+            self.events.on(event_type, handler, typed=False)
+
+        # Audio deltas go straight to these from handle_message, ahead of the dispatch table
+        self._audio_delta_handlers = (self._on_audio_delta, self.conversation.on_audio_delta)
+
+        # Function calling: tools run on a worker pool, never on the socket's reader
+        self.tools = ToolRegistry(send=self._send_from_audio_thread, respond=self._respond_to_tools,
+                                  metrics=self.metrics, **(tool_options or {}))
+        for event_type, handler in (
+            ('response.output_item.added', self.tools.on_output_item_added),
+            ('response.function_call_arguments.delta', self.tools.on_arguments_delta),
+            ('response.function_call_arguments.done', self.tools.on_arguments_done),
+            ('response.done', self.tools.on_response_done),
+        ):
+            self.events.on(event_type, handler, typed=False)
+
+        self.socket = self._make_socket(api_key, ws_url)
+        self.socket.accepts = self.events.handles
+        self.socket.on_disconnect = self._on_disconnect
+        self.socket.on_reconnect = self._on_reconnect
+        self.socket.replay = self._replay_messages
+        self.audio_io = self._make_audio_io()
+
+        # Session recording (Recording.py): wire traffic and mic/speaker audio, for offline replay
+        self.recorder = None
+        if record:
+            from Recording import Recorder
+            self.recorder = Recorder(record)
+            self.recorder.meta({'rate': self.audio_io.rate, 'wire_rate': self.audio_io.wire_rate,
+                                'audio_format': self.audio_format, 'chunk_size': self.audio_io.chunk_size})
+            self.socket.recorder = self.recorder
+            self.audio_io.recorder = self.recorder
+
+        # Client-side VAD: only upload speech (needs numpy); optionally commit the buffer when speech ends
+        self.vad = None
+        self.vad_commit = vad_commit
+        if vad:
+            from Vad import VoiceActivityDetector
+            self.vad = VoiceActivityDetector(self.audio_io.wire_rate)
+
+        # Barge-in: user speech during playback interrupts the AI (the mic must be open, i.e. echo_cancel=True)
+        self.barge_in = barge_in
+        self.on_interrupt = None  # Called as on_interrupt(info) once playback has been silenced
+        self.interruptions = 0
+        self._interrupted_at = None
+        self._cancelled_items = {}  # item_id -> None, oldest first
+        self._send_sample = Sampler()  # Per-chunk log sampling
+        self._delta_sample = Sampler()
         self.audio_thread = None  # Store thread references
         self.recv_thread = None
 
+    def _make_socket(self, api_key, ws_url):
+        return Socket(api_key, ws_url, on_msg=self.handle_message, metrics=self.metrics, **self.socket_options)
+
+    def _make_audio_io(self):
+        return AudioIO(on_audio_callback=self.send_audio_to_socket, backend=self.audio_backend,
+                       echo_cancel=self.echo_cancel, wire_rate=self.wire_rate, metrics=self.metrics,
+                       **self.audio_options)
+
+    def _send_initial_request(self):
+        """ Send initial request to start the conversation. """
+        session = {}
+        if self.audio_format != 'pcm16':
+            session.update(input_audio_format=self.audio_format, output_audio_format=self.audio_format)
+        if self.tools:
+            session.update(tools=self.tools.definitions(), tool_choice='auto')
+        if session:
+            self.update_session(session)
+        self.create_response({
+            'modalities': ['audio', 'text'],
+            'instructions': 'Please assist the user.'
+        })
+
+    def update_session(self, session):
+        """ Send session.update; the merged settings are replayed on every new connection. """
+        self.session_config.update(session)
+        self.socket.send({'type': 'session.update', 'session': session})
+
+    def add_item(self, item):
+        """ Add a conversation item, e.g. a user text message; it is replayed on every new connection. """
+        message = {'type': 'conversation.item.create', 'item': item}
+        self._items.append(message)  # The same object, so the socket can tell a queued copy was already replayed
+        self.socket.send(message)
+
+    def create_response(self, response=None):
+        """ Ask the model to respond; first-delta and response latency are measured from here. """
+        self._requested.append(time.monotonic())
+        self.socket.send({'type': 'response.create', 'response': response or {}})
+
     def start(self):
         """ Start WebSocket and audio processing. """
         self.socket.connect()
-
-        # Send initial request to start the conversation
-        self.socket.send({
-            'type': 'response.create',
-            'response': {
-                'modalities': ['audio', 'text'],
-                'instructions': 'Please assist the user.'
-            }
-        })
+        self._send_initial_request()
 
         # Start processing microphone audio
         self.audio_thread = threading.Thread(target=self.audio_io.process_mic_audio)
@@ -36,29 +201,231 @@ class Realtime:
 
     def send_audio_to_socket(self, mic_chunk):
         """ Callback function to send audio data to the socket. """
-        logging.info(f'🎤 Sending {len(mic_chunk)} bytes of audio data to socket.')
-        encoded_chunk = base64.b64encode(mic_chunk).decode('utf-8')
-        self.socket.send({'type': 'input_audio_buffer.append', 'audio': encoded_chunk})
+        if self.vad:
+            mic_chunk = self.vad.process(mic_chunk)
+        if mic_chunk:
+            if self._send_sample():
+                audio_log.info('🎤 Sending %d bytes of audio data to socket.', len(mic_chunk), extra={'bytes': len(mic_chunk)})
+            if self.g711:
+                mic_chunk = self.g711.encode(mic_chunk, self.audio_format)
+            self.conversation.on_input_audio(mic_chunk)
+            self.socket.send(Codec.encode_audio_append(mic_chunk))
+        if self.vad and self.vad.started and self.barge_in:
+            self.interrupt()
+        if self.vad and self.vad.ended and self.vad_commit:
+            self.socket.send({'type': 'input_audio_buffer.commit'})
+
+    def on(self, event_type, handler, typed=True):
+        """
+        Call `handler` for every server event of `event_type` ('*' for all), on the socket's reader.
+
+        It gets a typed event from Events (e.g. ResponseTextDelta), or the decoded dict with typed=False.
+        Event types nobody subscribed to are skipped before JSON parsing.
+        """
+        return self.events.on(event_type, handler, typed)
+
+    def off(self, event_type, handler):
+        self.events.off(event_type, handler)
 
     def handle_message(self, message):
-        """ Handle incoming WebSocket messages. """
-        event_type = message.get('type')
-        logging.info(f'Received message type: {event_type}')
+        """ Handle incoming WebSocket messages; audio deltas, most of them, skip the dispatch table. """
+        if message.get('type') == Codec.AUDIO_DELTA_TYPE:
+            for handler in self._audio_delta_handlers:
+                try:
+                    handler(message)
+                except Exception:
+                    log.exception('Error in handler for %s', Codec.AUDIO_DELTA_TYPE)
+            if self.events.handles(Codec.AUDIO_DELTA_TYPE):
+                self.events.dispatch(message)  # Subscribers from on()
+            return
+        log.debug('Received message type: %s', message.get('type'))
+        self.events.dispatch(message)
+
+    def _on_audio_delta(self, message):
+        response = self._responses.get(message.get('response_id'))
+        if response:
+            if response[3]:
+                return  # Still in flight when we interrupted
+            if response[1] is None:
+                self._on_first_delta(response)
+        item_id = message.get('item_id')
+        if item_id in self._cancelled_items:
+            return
+        audio_content = Codec.audio_of(message)
+        if self.g711:
+            audio_content = self.g711.decode(audio_content, self.audio_format)
+        self.audio_io.receive_audio(audio_content, item_id, message.get('content_index', 0))
+        if self._delta_sample():
+            audio_log.info('Received %d bytes of audio data.', len(audio_content),
+                           extra={'bytes': len(audio_content)})
+
+    def _on_audio_done(self, message):
+        self.audio_io.end_of_audio()
+        audio_log.info('AI finished speaking.')
+
+    def _on_speech_started(self, message):
+        if self.barge_in:
+            self.interrupt()
+
+    def _on_rate_limits(self, message):
+        self.rate_limits = message.get('rate_limits', [])
+
+    def _on_error(self, message):
+        error = message.get('error', {})
+        log.error('Server error: %s (%s, %s)', error.get('message'), error.get('type'), error.get('code'))
+
+    def _on_response_created(self, message):
+        response = message.get('response', {})
+        # Responses arrive in request order; server-initiated ones (server VAD) are timed from creation
+        now = time.monotonic()
+        requested_at = self._requested.popleft() if self._requested else now
+        span = None
+        if self.tracer:
+            started_ns = time.time_ns() - int((now - requested_at) * 1e9)
+            span = self.tracer.start_span('realtime.response', start_time=started_ns,
+                                          attributes={'realtime.response_id': response.get('id', '')})
+        if len(self._responses) >= OPEN_RESPONSES:
+            stale = self._responses.pop(next(iter(self._responses)))
+            if stale[2]:
+                stale[2].end()
+        self._responses[response.get('id')] = [requested_at, None, span, False]
+
+    def _on_first_delta(self, response):
+        response[1] = time.monotonic()
+        self._first_delta.observe(response[1] - response[0])
+        if response[2]:
+            response[2].add_event('first_audio_delta')
+
+    def _on_response_done(self, message):
+        response = message.get('response', {})
+        self._remember_output(response)
+        for item in response.get('output', []):
+            self._cancelled_items.pop(item.get('id'), None)  # No more deltas can come for it
+        tracked = self._responses.pop(response.get('id'), None)
+        if tracked is None:
+            return
+        requested_at, _, span, _ = tracked
+        self._response_time.observe(time.monotonic() - requested_at)
+        if span:
+            span.set_attribute('realtime.status', response.get('status', ''))
+            span.end()
+
+    def _on_item_deleted(self, message):
+        self._cancelled_items.pop(message.get('item_id'), None)
+
+    def _remember_output(self, response):
+        """ Keep what the assistant said, as text, so a new connection can be given the conversation so far. """
+        for item in response.get('output', []):
+            if item.get('type') != 'message':
+                continue
+            content = [{'type': 'text', 'text': part.get('text') or part.get('transcript')}
+                       for part in item.get('content', []) if part.get('text') or part.get('transcript')]
+            if content:
+                self._items.append({'type': 'conversation.item.create', 'item': {
+                    'type': 'message', 'role': item.get('role', 'assistant'), 'content': content}})
 
-        if event_type == 'response.audio.delta':
-            audio_content = base64.b64decode(message['delta'])
-            self.audio_io.receive_audio(audio_content)
-            logging.info(f'Received {len(audio_content)} bytes of audio data.')
+    def _respond_to_tools(self):
+        """ Runs on a tool worker once every call of a response has its output: let the model carry on. """
+        self._requested.append(time.monotonic())
+        self._send_from_audio_thread({'type': 'response.create', 'response': {}})
 
-        elif event_type == 'response.audio.done':
-            logging.info('AI finished speaking.')
+    def _replay_messages(self):
+        """ Runs on the socket's reader after a reconnect: session settings, then the conversation so far. """
+        messages = []
+        if self.session_config:
+            messages.append({'type': 'session.update', 'session': dict(self.session_config)})
+        messages.extend(list(self._items))
+        return messages
+
+    def _on_disconnect(self, reason):
+        # Nothing more will arrive for responses in flight: play out what is buffered and stop tracking them
+        self.audio_io.end_of_audio()
+        self._requested.clear()
+        for _, _, span, _ in self._responses.values():
+            if span:
+                span.set_attribute('realtime.status', 'disconnected')
+                span.end()
+        self._responses.clear()
+        self._cancelled_items.clear()
+        self.tools.reset()
+        self.conversation.reset()
+        if self.on_disconnect:
+            self.on_disconnect(reason)
+
+    def _on_reconnect(self, info):
+        if self.on_reconnect:
+            self.on_reconnect(info)
+
+    def interrupt(self):
+        """
+        Stop the AI mid-sentence: cancel the response if it is still generating, silence playback and truncate
+        the item to what was heard.
+
+        Applies from response.created on, before any audio has arrived, as well as while buffered audio plays
+        out; returns False if there is neither.
+        """
+        playing = self.audio_io.is_playing()
+        responses = [response for response in list(self._responses.values()) if not response[3]]
+        if not playing and not responses:
+            return False
+
+        log.info('✋ User interrupted.')
+        self.interruptions += 1
+        self._interrupted_at = time.monotonic()
+        if responses:  # Generation usually finishes before playback does: then there is nothing to cancel
+            for response in responses:
+                response[3] = True  # Drop its deltas still in flight
+            self.socket.send({'type': 'response.cancel'})
+        if not playing:
+            output_latency = self.audio_io.timeline.output_latency or 0
+            self._interrupted({'flush_ms': 0.0, 'output_latency_ms': output_latency * 1000})
+            return True
+
+        cancelled = self._cancelled_items
+        for item_id in self.audio_io.timeline.items_from(self.audio_io.audio_buffer.read_pos):
+            cancelled[item_id] = None
+        while len(cancelled) > CANCELLED_ITEMS:
+            cancelled.pop(next(iter(cancelled)), None)
+        self.audio_io.flush_playback(on_flushed=self._on_playback_flushed)
+        return True
+
+    def _on_playback_flushed(self, played_pos):
+        """
+        Runs on the speaker thread once playback is silent.
+
+        Everything up to `played_pos` was handed to the device and still plays out, so the item is truncated
+        there; if none of it had played yet, there is nothing to truncate.
+        """
+        timeline = self.audio_io.timeline
+        playing = timeline.locate(played_pos)
+        info = {'flush_ms': (time.monotonic() - self._interrupted_at) * 1000,
+                'output_latency_ms': (timeline.output_latency or 0) * 1000}
+        if playing and playing[2]:
+            item_id, content_index, audio_end_ms = playing
+            self._send_from_audio_thread({
+                'type': 'conversation.item.truncate',
+                'item_id': item_id,
+                'content_index': content_index,
+                'audio_end_ms': audio_end_ms,
+            })
+            info.update(item_id=item_id, audio_end_ms=audio_end_ms)
+        self._interrupted(info)
+
+    def _interrupted(self, info):
+        audio_log.info('🔇 Playback silenced %.1f ms after interruption.', info['flush_ms'])
+        if self.on_interrupt:
+            self.on_interrupt(info)
+
+    def _send_from_audio_thread(self, data):
+        self.socket.send(data)  # Socket.send is thread-safe
 
     def stop(self):
         """ Stop all processes cleanly. """
-        logging.info('Shutting down Realtime session.')
+        log.info('Shutting down Realtime session.')
 
         # Signal threads to stop
-        self.audio_io._stop_event.set()
+        self.audio_io.stop_processing()
+        self.tools.shutdown()
         self.socket.kill()
 
         # Stop audio streams
@@ -67,4 +434,10 @@ class Realtime:
         # Join threads to ensure they exit cleanly
         if self.audio_thread:
             self.audio_thread.join()
-            logging.info('Audio processing thread terminated.')
\ No newline at end of file
+            log.info('Audio processing thread terminated.')
+
+        self.transcripts.close()
+        self.conversation.close()
+        if self.recorder:
+            self.recorder.close()
+            log.info('Recorded %d records to %s.', self.recorder.records, self.recorder.path)
\ No newline at end of file
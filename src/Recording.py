@@ -0,0 +1,234 @@
+"""
+Session recording to disk, and replay of a recording into Realtime.
+
+A recording is an append-only stream of records, each a 13-byte header
+(kind, seconds since the recording started, payload length) and a payload:
+
+- SENT / RECEIVED: a wire frame, as given to Socket.send / read off the socket.
+- SENT_AUDIO: the PCM of an input_audio_buffer.append, not its base64 JSON.
+- RECEIVED_AUDIO: a response.audio.delta frame split into the frame without
+  `delta` and the decoded PCM (4-byte length of the first, then both).
+- MIC / SPEAKER: PCM16 as AudioIO's mic callback got it and its speaker
+  callback played it.
+- META: JSON describing the session (rates, audio format).
+
+Recording costs the hot paths one deque append; a background thread encodes
+and writes. Speaker audio, which AudioIO hands over as a view of a buffer it
+reuses, is first copied into a preallocated ring, so the audio thread never
+allocates for it. A file cut short by a crash reads up to its last whole record.
+
+Replay: `MockServer.ReplayServer` sends a recording's server events to a
+live client at their recorded times (optionally sped up) and
+`RecordedSource` plays its mic audio into a ClockedBackend, so `replay()`
+runs the whole client stack against real traffic. Server events keep their
+recorded timing rather than reacting to what the client sends.
+"""
+import argparse
+import binascii
+import collections
+import json
+import struct
+import threading
+import time
+
+import Codec
+from AudioBackends import ClockedBackend, NullSink, PcmSource
+from RingBuffer import RingBuffer
+
+MAGIC = b'RTREC1\n'
+FLUSH_MS = 100  # How often the writer thread flushes to disk
+SPEAKER_RING_BYTES = 1 << 20  # Speaker audio waiting for the writer thread, ~20 s of 24 kHz PCM16
+
+META, SENT, SENT_AUDIO, RECEIVED, RECEIVED_AUDIO, MIC, SPEAKER = range(7)
+KINDS = ('meta', 'sent', 'sent_audio', 'received', 'received_audio', 'mic', 'speaker')
+
+_HEADER = struct.Struct('<BdI')  # kind, t (s), payload length
+_LENGTH = struct.Struct('<I')
+
+
+class Recorder:
+    """ Appends a session's traffic and audio to `path`; thread-safe, never blocks the caller on disk I/O. """
+
+    def __init__(self, path, flush_ms=FLUSH_MS, speaker_ring_bytes=SPEAKER_RING_BYTES):
+        self.path = path
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.started_at = time.monotonic()
+        self.records = 0
+        self.bytes_written = len(MAGIC)
+        self._pending = collections.deque()  # (kind, monotonic time, data), appended from any thread
+        self._speaker_ring = RingBuffer(speaker_ring_bytes)  # SPEAKER records' audio; their data is its byte count
+        self._flush_s = flush_ms / 1000
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def meta(self, info):
+        self._pending.append((META, time.monotonic(), info))
+
+    def sent(self, message):
+        self._pending.append((SENT, time.monotonic(), message))
+
+    def received(self, frame):
+        self._pending.append((RECEIVED, time.monotonic(), frame))
+
+    def mic(self, pcm):
+        self._pending.append((MIC, time.monotonic(), pcm))
+
+    def speaker(self, pcm):
+        """ Speaker thread only: `pcm` may be a view of a reused buffer; audio that doesn't fit the ring is cut. """
+        self._pending.append((SPEAKER, time.monotonic(), self._speaker_ring.write(pcm)))
+
+    @property
+    def speaker_dropped_bytes(self):
+        return self._speaker_ring.overflow_bytes
+
+    def _encode(self, kind, data):
+        """ Runs on the writer thread: the record kind and payload bytes for what was captured. """
+        if kind == META:
+            return kind, json.dumps(data).encode('utf-8')
+        if kind == SENT:
+            if Codec.is_audio_append(data):
+                return SENT_AUDIO, _append_pcm(data)
+            wire = Codec.to_wire(data)
+            return kind, wire.encode('utf-8') if isinstance(wire, str) else wire
+        if kind == RECEIVED:
+            frame = data.decode('utf-8') if isinstance(data, (bytes, bytearray)) else data
+            split = Codec.split_audio_delta(frame)
+            if split:
+                rest = split[0].encode('utf-8')
+                return RECEIVED_AUDIO, _LENGTH.pack(len(rest)) + rest + binascii.a2b_base64(split[1])
+            return kind, frame.encode('utf-8')
+        if kind == SPEAKER:
+            pcm = bytearray(data)
+            self._speaker_ring.read_into(pcm)
+            return kind, pcm
+        return kind, bytes(data)
+
+    def _drain(self):
+        pending = self._pending
+        while pending:
+            kind, at, data = pending.popleft()
+            kind, payload = self._encode(kind, data)
+            self.f.write(_HEADER.pack(kind, at - self.started_at, len(payload)))
+            self.f.write(payload)
+            self.records += 1
+            self.bytes_written += _HEADER.size + len(payload)
+        self.f.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self._flush_s):
+            self._drain()
+
+    def close(self):
+        """ Write what is still pending and close the file. """
+        self._stop_event.set()
+        self._thread.join()
+        self._drain()
+        self.f.close()
+
+
+def _append_pcm(message):
+    if isinstance(message, bytes):
+        return binascii.a2b_base64(message[len(Codec.AUDIO_APPEND_PREFIX):-len(Codec.AUDIO_APPEND_SUFFIX)])
+    return binascii.a2b_base64(message['audio'])
+
+
+def read_records(path):
+    """
+    Yield (kind, t, data) for each record in a recording.
+
+    `data` is bytes, except META (a dict) and RECEIVED_AUDIO, which is
+    (frame without delta, PCM); see `wire_frame` to rebuild frames.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path}: not a session recording')
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            kind, t, length = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Cut short mid-record
+            if kind == META:
+                yield kind, t, json.loads(payload)
+            elif kind == RECEIVED_AUDIO:
+                (rest_length,) = _LENGTH.unpack_from(payload)
+                rest = payload[_LENGTH.size:_LENGTH.size + rest_length].decode('utf-8')
+                yield kind, t, (rest, payload[_LENGTH.size + rest_length:])
+            else:
+                yield kind, t, payload
+
+
+def wire_frame(kind, data):
+    """ The wire frame of a SENT / SENT_AUDIO / RECEIVED / RECEIVED_AUDIO record's data, as a str. """
+    if kind == RECEIVED_AUDIO:
+        return Codec.join_audio_delta(*data)
+    if kind == SENT_AUDIO:
+        return Codec.encode_audio_append(data).decode('ascii')
+    return data.decode('utf-8')
+
+
+def summary(path):
+    """ Record counts, payload bytes and duration of a recording. """
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    meta = {}
+    duration = 0.0
+    for kind, t, data in read_records(path):
+        counts[KINDS[kind]] += 1
+        if kind == META:
+            meta.update(data)
+        else:
+            sizes[KINDS[kind]] += sum(map(len, data)) if kind == RECEIVED_AUDIO else len(data)
+        duration = t
+    return {'duration_s': duration, 'meta': meta, 'records': dict(counts), 'bytes': dict(sizes)}
+
+
+class RecordedSource(PcmSource):
+    """ The mic audio of a recording, for ClockedBackend; the stream ends with it. """
+
+    def __init__(self, path, pad=False):
+        super().__init__(b''.join(data for kind, _, data in read_records(path) if kind == MIC), pad=pad)
+
+
+def replay(path, speed=1.0, realtime_cls=None, sink=None, **realtime_kwargs):
+    """
+    Run a Realtime session against a recording; returns (session, server) once it has stopped.
+
+    Server events arrive at their recorded times and the recorded mic audio
+    plays into the session, both `speed` times faster than recorded.
+    """
+    from MockServer import ReplayServer  # Needs websockets
+    if realtime_cls is None:
+        from Realtime import Realtime as realtime_cls
+
+    duration = summary(path)['duration_s']
+    server = ReplayServer(path, speed)
+    url = server.start()
+    try:
+        backend = ClockedBackend(RecordedSource(path, pad=True), sink or NullSink(), speed=speed)
+        session = realtime_cls('replay', url, audio_backend=backend, **realtime_kwargs)
+        session.start()
+        time.sleep(duration / speed + 0.5)
+        session.stop()
+    finally:
+        server.stop()
+    return session, server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise a session recording')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    info = summary(args.path)
+    print(f"{args.path}: {info['duration_s']:.1f} s {info['meta']}")
+    for kind in KINDS:
+        if kind in info['records']:
+            print(f"{kind:>15} {info['records'][kind]:>7} records {info['bytes'].get(kind, 0):>11} bytes")
+
+
+if __name__ == '__main__':
+    main()
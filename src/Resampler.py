@@ -0,0 +1,174 @@
+import math
+
+import numpy as np
+
+TAPS_PER_RATIO = 16  # Filter length, in samples of the lower rate on each side of the transition
+CUTOFF = 0.9         # Passband edge as a fraction of the lower Nyquist frequency
+MAX_CHUNK = 4096     # Input frames per call that the preallocated buffers are sized for (grown on demand)
+
+DTYPES = {'int16': '<i2', 'float32': '<f4'}
+FLOAT_SCALE = 32768.0  # int16 full scale; float samples are int16 / FLOAT_SCALE both ways, clipped to int16 going in
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler for mono audio, by the rational factor out_rate / in_rate.
+
+    State (input history and output phase) carries across calls, so a stream
+    can be fed in arbitrary chunk sizes without discontinuities. All working
+    buffers are allocated up front for chunks of up to `max_chunk` frames, so
+    steady-state calls only allocate the returned bytes.
+    """
+
+    def __init__(self, in_rate, out_rate, max_chunk=MAX_CHUNK):
+        g = math.gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = out_rate // g
+        self.down = in_rate // g
+
+        # Windowed-sinc low-pass at the upsampled rate, split into `up` phases of `taps` each
+        ratio = max(self.up, self.down)
+        num_taps = 2 * TAPS_PER_RATIO * ratio + 1
+        self.taps = -(-num_taps // self.up)
+        n = np.arange(self.taps * self.up) - (num_taps - 1) / 2
+        cutoff = CUTOFF * 0.5 / ratio
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(len(n), 8.0) * self.up
+        h[num_taps:] = 0.0
+        # phases[p, j] multiplies input sample (n - j) for output phase p
+        self.phases = h.reshape(self.taps, self.up).T.copy()
+
+        self._t = 0  # Position of the next output, in upsampled samples, relative to the current block
+        self._extended = np.zeros(self.taps - 1)  # [history | current block]
+        self._allocate(max_chunk)
+
+    def _allocate(self, max_chunk):
+        history = self._extended[:self.taps - 1].copy()
+        self.max_chunk = max_chunk
+        max_out = max_chunk * self.up // self.down + 2
+        self._extended = np.zeros(self.taps - 1 + max_chunk)
+        self._extended[:self.taps - 1] = history
+        self._t_base = np.arange(max_out, dtype=np.int64) * self.down
+        self._t_buf = np.empty(max_out, dtype=np.int64)
+        self._index = np.empty(max_out, dtype=np.int64)
+        self._phase = np.empty(max_out, dtype=np.int64)
+        self._gather = np.empty((max_out, self.taps), dtype=np.int64)
+        # Tap offsets for every row, so building the gather indices needs no broadcast (numpy buffers those)
+        self._offsets = np.tile(np.arange(self.taps), (max_out, 1))
+        self._windows = np.empty((max_out, self.taps))
+        self._coefs = np.empty((max_out, self.taps))
+        self._y = np.empty(max_out)
+        self._out = np.empty(max_out, dtype='<i2')
+
+    def process_array(self, x):
+        """ Resample a 1-D array of samples (int16 scale); returns an int16 view valid until the next call. """
+        n = len(x)
+        if n > self.max_chunk:
+            self._allocate(n)
+        h = self.taps - 1
+        ext = self._extended
+        ext[h:h + n] = x
+
+        span = n * self.up
+        count = max(0, -(-(span - self._t) // self.down))
+        t = self._t_buf[:count]
+        np.add(self._t_base[:count], self._t, out=t)
+        index = self._index[:count]
+        np.floor_divide(t, self.up, out=index)
+        index += h
+        phase = self._phase[:count]
+        np.remainder(t, self.up, out=phase)
+
+        gather = self._gather[:count]
+        np.copyto(gather, index[:, None])
+        np.subtract(gather, self._offsets[:count], out=gather)
+        windows = self._windows[:count]
+        np.take(ext, gather, out=windows, mode='clip')
+        coefs = self._coefs[:count]
+        np.take(self.phases, phase, axis=0, out=coefs, mode='clip')
+        np.multiply(windows, coefs, out=windows)
+        y = self._y[:count]
+        np.sum(windows, axis=1, out=y)
+        np.rint(y, out=y)
+        np.clip(y, -32768, 32767, out=y)
+        out = self._out[:count]
+        out[:] = y
+
+        self._t += count * self.down - span
+        ext[:h] = ext[n:n + h]
+        return out
+
+    def process(self, pcm):
+        """ Resample one chunk of PCM16 bytes; returns PCM16 bytes. """
+        if self.up == self.down:
+            return pcm
+        return self.process_array(np.frombuffer(pcm, dtype='<i2')).tobytes()
+
+
+class StreamConverter:
+    """
+    Converts a device stream to or from the session stream: sample format
+    (int16 / float32), channel count (down-mix by averaging, up-mix by
+    duplication) and rate, with buffers preallocated like Resampler's.
+    """
+
+    def __init__(self, in_rate, out_rate, in_channels=1, out_channels=1, in_format='int16', out_format='int16',
+                 max_chunk=MAX_CHUNK):
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.in_dtype = DTYPES[in_format]
+        self.out_dtype = DTYPES[out_format]
+        self.resampler = Resampler(in_rate, out_rate, max_chunk) if in_rate != out_rate else None
+        self._allocate(max_chunk, in_rate, out_rate)
+
+    def _allocate(self, max_chunk, in_rate, out_rate):
+        self.max_chunk = max_chunk
+        max_out = max_chunk * out_rate // in_rate + 2
+        # Casts happen between contiguous buffers and channels are copied one at a time: numpy allocates a scratch
+        # buffer for broadcasts and strided casts, which would otherwise happen on every call
+        self._wide = np.empty(max_chunk * self.in_channels)
+        self._mono = np.empty(max_chunk)
+        self._scaled = np.empty(max_out)
+        self._narrow = np.empty(max_out, dtype=self.out_dtype)
+        self._out = np.empty((max_out, self.out_channels), dtype=self.out_dtype)
+
+    def convert(self, data):
+        """ Convert a chunk of device or session bytes; returns a preallocated array valid until the next call. """
+        x = np.frombuffer(data, dtype=self.in_dtype)
+        frames = len(x) // self.in_channels
+        if frames > self.max_chunk:
+            in_rate = self.resampler.in_rate if self.resampler else 1
+            out_rate = self.resampler.out_rate if self.resampler else 1
+            self._allocate(frames, in_rate, out_rate)
+
+        mono = self._mono[:frames]
+        if self.in_channels == 1:
+            mono[:] = x
+        else:
+            wide = self._wide[:frames * self.in_channels]
+            wide[:] = x[:frames * self.in_channels]
+            channels = wide.reshape(frames, self.in_channels)
+            np.copyto(mono, channels[:, 0])
+            for c in range(1, self.in_channels):
+                np.add(mono, channels[:, c], out=mono)
+            mono *= 1 / self.in_channels
+        if self.in_dtype == '<f4':
+            mono *= FLOAT_SCALE
+
+        y = self.resampler.process_array(mono) if self.resampler else mono
+        if self.out_dtype == '<f4':
+            scaled = self._scaled[:len(y)]
+            np.copyto(scaled, y)
+            scaled *= 1 / FLOAT_SCALE
+            y = scaled
+        elif not self.resampler:
+            np.clip(np.rint(y, out=y), -32768, 32767, out=y)
+        narrow = self._narrow[:len(y)]
+        np.copyto(narrow, y, casting='unsafe')
+        out = self._out[:len(y)]
+        for c in range(self.out_channels):
+            out[:, c] = narrow
+        return out
+
+    def process(self, data):
+        return self.convert(data).tobytes()
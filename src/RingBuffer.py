@@ -0,0 +1,66 @@
+class RingBuffer:
+    """
+    Fixed-capacity single-producer / single-consumer byte ring.
+
+    The producer (socket thread) only ever advances `write_pos`, the consumer
+    (PortAudio callback) only ever advances `read_pos`. Both are monotonically
+    increasing ints, and rebinding an int attribute is atomic under the GIL,
+    so no lock is needed as long as there is exactly one of each.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self.write_pos = 0  # Total bytes ever written
+        self.read_pos = 0   # Total bytes ever read
+        self.high_water = 0
+        self.overflow_bytes = 0
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.capacity - (self.write_pos - self.read_pos)
+
+    def write(self, data):
+        """ Producer side: copy as much of `data` as fits, return bytes written. """
+        data = memoryview(data).cast('B')
+        n = min(len(data), self.free())
+        if n < len(data):
+            self.overflow_bytes += len(data) - n
+        if n == 0:
+            return 0
+
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._view[start:start + first] = data[:first]
+        if first < n:
+            self._view[:n - first] = data[first:n]
+
+        self.write_pos += n
+        fill = self.write_pos - self.read_pos
+        if fill > self.high_water:
+            self.high_water = fill
+        return n
+
+    def read_into(self, out):
+        """ Consumer side: copy up to len(out) bytes into the writable buffer `out`, return bytes read. """
+        n = min(len(out), self.write_pos - self.read_pos)
+        if n == 0:
+            return 0
+
+        # Through a memoryview: assigning a memoryview to a bytearray slice would copy it to a temporary first
+        out = memoryview(out).cast('B')
+        start = self.read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._view[start:start + first]
+        if first < n:
+            out[first:n] = self._view[:n - first]
+
+        self.read_pos += n
+        return n
+
+    def clear(self):
+        """ Consumer side: discard everything currently buffered. """
+        self.read_pos = self.write_pos
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import socket
+import ssl
+import time
+from urllib.parse import urlparse
+
+from AsyncRealtime import AsyncRealtime
+import Metrics
+
+log = logging.getLogger(__name__)
+
+MAX_SESSIONS = 100
+MAX_CONCURRENT_CONNECTS = 8
+WARM_SESSIONS = 2
+DNS_TTL_S = 60
+
+
+class SessionPool:
+    """
+    Opens, tracks and tears down many AsyncRealtime sessions on one event loop.
+
+    - At most `max_concurrent_connects` WebSocket handshakes run at once.
+    - One SSLContext (CA bundle parsed once) and one cached DNS lookup are shared by every connection.
+    - `warm_sessions` connections are kept open but idle, so `acquire()` normally skips the handshake.
+    """
+
+    def __init__(self, api_key, ws_url, max_sessions=MAX_SESSIONS, max_concurrent_connects=MAX_CONCURRENT_CONNECTS,
+                 warm_sessions=WARM_SESSIONS, session_factory=AsyncRealtime, dns_ttl=DNS_TTL_S, session_kwargs=None):
+        self.api_key = api_key
+        self.ws_url = ws_url
+        self.max_sessions = max_sessions
+        self.warm_sessions = warm_sessions
+        self.session_factory = session_factory
+        self.session_kwargs = session_kwargs or {}  # e.g. {'audio_backend': ...}; called per session if callable
+        self.dns_ttl = dns_ttl
+
+        self._connect_slots = asyncio.Semaphore(max_concurrent_connects)
+        self._idle = []  # Connected, not yet started
+        self._active = set()
+        self._warming = 0
+        self._opening = 0  # Cold connects in acquire(), counted against max_sessions while they run
+        self._warm_tasks = set()
+
+        url = urlparse(ws_url)
+        self._host = url.hostname
+        self._port = url.port or (443 if url.scheme == 'wss' else 80)
+        self._ssl = ssl.create_default_context() if url.scheme == 'wss' else None
+        self._addr = None
+        self._addr_expires = 0.0
+
+        # Aggregate counters
+        self.opened = 0
+        self.closed = 0
+        self.connect_failures = 0
+        self.warm_hits = 0
+        self.cold_starts = 0
+
+    async def _resolve(self):
+        """ Resolve the server address once per TTL rather than once per connection. """
+        if self._addr is None or time.monotonic() > self._addr_expires:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(self._host, self._port, type=socket.SOCK_STREAM)
+            self._addr = infos[0][4][0]
+            self._addr_expires = time.monotonic() + self.dns_ttl
+        return self._addr
+
+    async def _connect_kwargs(self):
+        kwargs = {'host': await self._resolve(), 'port': self._port}
+        if self._ssl:
+            kwargs['ssl'] = self._ssl
+            kwargs['server_hostname'] = self._host
+        return kwargs
+
+    async def _open(self):
+        """ Create and connect one session, respecting the connect concurrency cap. """
+        async with self._connect_slots:
+            kwargs = self.session_kwargs() if callable(self.session_kwargs) else dict(self.session_kwargs)
+            session = self.session_factory(self.api_key, self.ws_url, connect_kwargs=await self._connect_kwargs(), **kwargs)
+            try:
+                await session.connect()
+            except Exception:
+                self.connect_failures += 1
+                self._addr = None  # The cached address may be stale
+                raise
+        self.opened += 1
+        session.metrics.labels['session'] = self.opened
+        return session
+
+    def _total(self):
+        return len(self._active) + len(self._idle) + self._warming + self._opening
+
+    def _top_up(self):
+        """ Start background connects until the idle pool is back to `warm_sessions`. """
+        while len(self._idle) + self._warming < self.warm_sessions and self._total() < self.max_sessions:
+            self._warming += 1
+            task = asyncio.create_task(self._warm_one())
+            self._warm_tasks.add(task)
+            task.add_done_callback(self._warm_tasks.discard)
+
+    async def _warm_one(self):
+        try:
+            self._idle.append(await self._open())
+        except Exception as e:
+            log.error('Failed to pre-warm session: %s', e)
+        finally:
+            self._warming -= 1
+
+    async def warm_up(self):
+        """ Fill the idle pool and wait until those connections are open. """
+        self._top_up()
+        await asyncio.gather(*self._warm_tasks, return_exceptions=True)
+
+    async def acquire(self):
+        """ Start and return a session, using a pre-warmed connection when one is available. """
+        session = None
+        while self._idle:
+            candidate = self._idle.pop()
+            if candidate.socket.connected:
+                session = candidate
+                self.warm_hits += 1
+                break
+            await candidate.stop()  # Server dropped it while idle
+            self.closed += 1
+
+        if session is None:
+            if self._total() >= self.max_sessions:
+                raise RuntimeError(f'Session limit reached ({self.max_sessions})')
+            self._opening += 1  # Hold the slot across the handshake, or concurrent acquires overshoot the limit
+            try:
+                session = await self._open()
+            finally:
+                self._opening -= 1
+            self.cold_starts += 1
+
+        self._active.add(session)
+        self._top_up()
+        try:
+            await session.start()
+        except Exception:
+            self._active.discard(session)
+            await session.stop()
+            self.closed += 1
+            raise
+        return session
+
+    async def release(self, session):
+        """ Tear down a session obtained from `acquire()`. """
+        self._active.discard(session)
+        await session.stop()
+        self.closed += 1
+
+    async def close(self):
+        """ Tear down every active and idle session. """
+        for task in list(self._warm_tasks):
+            task.cancel()
+        await asyncio.gather(*self._warm_tasks, return_exceptions=True)
+
+        sessions = list(self._active) + self._idle
+        self._active.clear()
+        self._idle = []
+        await asyncio.gather(*(session.stop() for session in sessions), return_exceptions=True)
+        self.closed += len(sessions)
+
+    def session_stats(self, session):
+        return {
+            'connect_ms': (session.socket.connect_time or 0.0) * 1000,
+            'connected': session.socket.connected,
+            'mic_dropped': session.mic_dropped,
+            'send_latency': session.socket.latency_stats(),
+        }
+
+    def prometheus_text(self):
+        """ Metrics of every active session, labelled by session number; serve with Metrics.serve_prometheus. """
+        return Metrics.prometheus_text([session.metrics for session in self._active])
+
+    def stats(self):
+        """ Aggregate stats plus one entry per active session. """
+        connect_times = [s.socket.connect_time for s in self._active if s.socket.connect_time is not None]
+        return {
+            'active': len(self._active),
+            'idle': len(self._idle),
+            'warming': self._warming,
+            'opening': self._opening,
+            'opened': self.opened,
+            'closed': self.closed,
+            'connect_failures': self.connect_failures,
+            'warm_hits': self.warm_hits,
+            'cold_starts': self.cold_starts,
+            'connect_ms_mean': sum(connect_times) / len(connect_times) * 1000 if connect_times else 0.0,
+            'connect_ms_max': max(connect_times) * 1000 if connect_times else 0.0,
+            'sessions': [self.session_stats(s) for s in self._active],
+        }
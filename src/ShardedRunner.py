@@ -0,0 +1,392 @@
+"""
+Runs Realtime sessions across worker processes, so per-session DSP isn't held to one core by the GIL.
+
+The parent is the I/O process. It owns each session's audio endpoints (an
+AudioBackends source standing in for the mic, a sink for the speaker) and
+moves their audio through two SharedRings per session, one chunk per period,
+from a single pump thread. Each worker runs its sessions as ordinary
+threaded Realtime instances on a ClockedBackend over the other ends of the
+rings, so echo cancellation, resampling, VAD, codecs and the socket all run
+there. Audio never goes through a pickled queue: the Pipe to each worker
+only carries commands and health reports.
+
+`check_health()` (every `health_interval_s` once started) asks each worker
+for a report; a worker that has died or doesn't answer within
+`health_timeout_s` is replaced and its sessions are started again on the
+least loaded workers. `rebalance()` moves sessions from the busiest worker
+to the idlest while that evens out their CPU load (session counts, until
+there are load measurements). A session that is moved or restarted
+reconnects as a new conversation; its rings, and so its audio endpoints,
+carry on.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from AudioBackends import NullSink, NullSource, SAMPLE_WIDTH
+from AudioIO import CHUNK_SIZE, RATE
+from SharedRing import RingSink, RingSource, SharedRing
+
+log = logging.getLogger(__name__)
+
+RING_SECONDS = 2.0        # Audio each ring holds
+HEALTH_INTERVAL_S = 5.0
+HEALTH_TIMEOUT_S = 2.0    # A worker that takes longer to report is replaced
+COMMAND_TIMEOUT_S = 10.0  # Starting or stopping a session includes its connect / teardown
+START_METHOD = 'spawn'    # Workers don't inherit the parent's threads mid-operation, as they could with fork
+
+
+class ShardedSession:
+    __slots__ = ('id', 'worker', 'source', 'sink', 'mic_ring', 'speaker_ring', 'mic_sink', 'speaker_source', 'kwargs',
+                 'report')
+
+    def __init__(self, session_id, source, sink, capacity, kwargs):
+        self.id = session_id
+        self.worker = None
+        self.source = source  # The mic, as the I/O process sees it
+        self.sink = sink      # The speaker
+        self.mic_ring = SharedRing(capacity)
+        self.speaker_ring = SharedRing(capacity)
+        self.mic_sink = RingSink(self.mic_ring)
+        self.speaker_source = RingSource(self.speaker_ring)
+        self.kwargs = kwargs  # Realtime keyword arguments; pickled to the worker
+        self.report = None    # From the latest health check
+
+    def close(self):
+        self.mic_ring.close()
+        self.speaker_ring.close()
+
+
+class _Worker:
+    """ Parent-side handle on one worker process: one command at a time over its Pipe. """
+
+    def __init__(self, index, context, args):
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,) + args, name=f'realtime-shard-{index}',
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.sessions = set()  # Session ids
+        self.load = None  # CPU seconds per second between the last two health reports
+        self._cpu = None  # (cpu_s, monotonic time) of the last report
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def call(self, command, *args, timeout=COMMAND_TIMEOUT_S):
+        with self._lock:
+            self._seq += 1
+            self.conn.send((self._seq, command) + args)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.conn.poll(remaining):
+                    raise TimeoutError(f'Shard {self.index} did not answer {command} within {timeout} s')
+                seq, ok, result = self.conn.recv()
+                if seq == self._seq:
+                    break  # Earlier replies belong to calls that timed out
+        if not ok:
+            raise RuntimeError(f'Shard {self.index}: {command} failed: {result}')
+        return result
+
+    def update_load(self, cpu_s):
+        now = time.monotonic()
+        if self._cpu:
+            self.load = (cpu_s - self._cpu[0]) / (now - self._cpu[1])
+        self._cpu = (cpu_s, now)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+def _worker_main(conn, api_key, ws_url, session_factory, initializer):
+    """ Worker process: start, stop and report on sessions as the parent asks, until told to shut down. """
+    from AudioBackends import ClockedBackend
+    if initializer:
+        initializer()
+    if session_factory is None:
+        from Realtime import Realtime as session_factory
+
+    sessions = {}  # id -> (session, mic RingSource, rings)
+    seq = command = None
+
+    def stop(session_id):
+        session, _, rings = sessions.pop(session_id)
+        session.stop()
+        for ring in rings:
+            ring.close()
+
+    def report(session, source):
+        snapshot = session.metrics.snapshot()
+        streams = (session.audio_io.mic_stream, session.audio_io.spkr_stream)
+        return {
+            'connected': session.socket.connected,
+            'mic_underruns': source.underruns,  # The I/O process fell behind
+            'late_callbacks': sum(getattr(stream, 'late_callbacks', 0) for stream in streams if stream),
+            'playback_underruns': snapshot['playback_underruns_total'],
+            'mic_dropped': snapshot['mic_queue_dropped_total'] + snapshot['mic_queue_expired_total'],
+            'send_dropped': snapshot['send_dropped_total'] + snapshot['send_expired_total'],
+        }
+
+    while True:
+        try:
+            seq, command, *args = conn.recv()
+        except (EOFError, OSError):
+            break  # The parent has gone
+        try:
+            result = None
+            if command == 'start':
+                session_id, mic_name, speaker_name, kwargs = args
+                mic_ring, speaker_ring = SharedRing(name=mic_name), SharedRing(name=speaker_name)
+                mic_ring.clear()  # Skip what queued up while the session was being moved
+                source = RingSource(mic_ring)
+                backend = ClockedBackend(source, RingSink(speaker_ring))
+                session = session_factory(api_key, ws_url, audio_backend=backend, **kwargs)
+                sessions[session_id] = (session, source, (mic_ring, speaker_ring))
+                session.start()
+            elif command == 'stop':
+                stop(args[0])
+            elif command == 'health':
+                result = {'pid': os.getpid(), 'cpu_s': time.process_time(),
+                          'sessions': {session_id: report(session, source)
+                                       for session_id, (session, source, _) in sessions.items()}}
+            elif command == 'shutdown':
+                break
+            else:
+                raise ValueError(f'Unknown command {command}')
+        except Exception as e:
+            log.exception('Shard command %s failed', command)
+            conn.send((seq, False, f'{type(e).__name__}: {e}'))
+        else:
+            conn.send((seq, True, result))
+
+    for session_id in list(sessions):
+        stop(session_id)
+    if command == 'shutdown':
+        conn.send((seq, True, None))
+
+
+class ShardedRunner:
+    """
+    Spreads Realtime sessions over `workers` processes (default: one per CPU).
+
+    `add_session(source, sink, **kwargs)` starts one, with Realtime keyword
+    arguments (e.g. echo_cancel=True) that must pickle. `session_factory` is
+    a Realtime subclass importable by the workers; `initializer` runs first
+    in each worker, e.g. Telemetry.configure.
+    """
+
+    def __init__(self, api_key, ws_url, workers=None, chunk_size=CHUNK_SIZE, rate=RATE, ring_seconds=RING_SECONDS,
+                 health_interval_s=HEALTH_INTERVAL_S, health_timeout_s=HEALTH_TIMEOUT_S, auto_rebalance=False,
+                 session_factory=None, initializer=None, start_method=START_METHOD, session_kwargs=None):
+        self.api_key = api_key
+        self.ws_url = ws_url
+        self.worker_count = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.ring_bytes = int(rate * ring_seconds) * SAMPLE_WIDTH
+        self.health_interval_s = health_interval_s
+        self.health_timeout_s = health_timeout_s
+        self.auto_rebalance = auto_rebalance  # Rebalance after every health check (moved sessions reconnect)
+        self.session_kwargs = session_kwargs or {}
+        self._context = multiprocessing.get_context(start_method)
+        self._worker_args = (api_key, ws_url, session_factory, initializer)
+
+        self.workers = []
+        self.sessions = {}  # id -> ShardedSession
+        self._next_id = 0
+        self._lock = threading.RLock()  # Session placement, from the caller and the health thread
+        self._pump_lock = threading.Lock()  # Held per pump period; rings are only closed under it
+        self._stop_event = threading.Event()
+        self._pump_thread = None
+        self._health_thread = None
+
+        # Aggregate counters
+        self.restarts = 0  # Workers replaced
+        self.moved = 0     # Sessions moved by rebalance()
+        self.late_pumps = 0
+
+    def start(self):
+        """ Start the workers, the audio pump and the health checks. """
+        self.workers = [_Worker(i, self._context, self._worker_args) for i in range(self.worker_count)]
+        self._stop_event.clear()
+        self._pump_thread = threading.Thread(target=self._pump, name='shard-pump', daemon=True)
+        self._pump_thread.start()
+        self._health_thread = threading.Thread(target=self._check_periodically, name='shard-health', daemon=True)
+        self._health_thread.start()
+
+    # Sessions
+
+    def add_session(self, source=None, sink=None, **kwargs):
+        """ Start a session on the least loaded worker; returns its ShardedSession. """
+        with self._lock:
+            self._next_id += 1
+            session = ShardedSession(self._next_id, source or NullSource(), sink or NullSink(), self.ring_bytes,
+                                     dict(self.session_kwargs, **kwargs))
+            try:
+                self._place(session, self._least_loaded())
+            except Exception:
+                session.close()
+                raise
+            with self._pump_lock:
+                self.sessions[session.id] = session
+            return session
+
+    def remove_session(self, session):
+        with self._lock:
+            with self._pump_lock:
+                self.sessions.pop(session.id, None)
+            worker = session.worker
+            worker.sessions.discard(session.id)
+            try:
+                worker.call('stop', session.id)
+            except (TimeoutError, RuntimeError, EOFError, OSError) as e:
+                log.warning('Stopping session %s on shard %s: %s', session.id, worker.index, e)
+            session.close()
+
+    def _place(self, session, worker):
+        worker.call('start', session.id, session.mic_ring.name, session.speaker_ring.name, session.kwargs)
+        worker.sessions.add(session.id)
+        session.worker = worker
+
+    def _least_loaded(self, exclude=None):
+        workers = [worker for worker in self.workers if worker is not exclude]
+        return min(workers, key=lambda worker: (len(worker.sessions), worker.load or 0.0))
+
+    def _move(self, session, worker):
+        old = session.worker
+        old.sessions.discard(session.id)
+        try:
+            old.call('stop', session.id)
+        except (TimeoutError, RuntimeError, EOFError, OSError) as e:
+            log.warning('Stopping session %s on shard %s: %s', session.id, old.index, e)
+        self._place(session, worker)
+
+    # Audio
+
+    def _pump(self):
+        """ Once per chunk period: each session's mic audio into its ring, and its ring's speaker audio out. """
+        period = self.chunk_size / self.rate
+        next_at = time.monotonic()
+        while not self._stop_event.is_set():
+            with self._pump_lock:
+                for session in self.sessions.values():
+                    mic_chunk = session.source.read(self.chunk_size)
+                    if mic_chunk is not None:
+                        session.mic_sink.write(mic_chunk)
+                    session.sink.write(session.speaker_source.read(self.chunk_size))
+            next_at += period
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                self.late_pumps += 1
+
+    # Health and balance
+
+    def _check_periodically(self):
+        while not self._stop_event.wait(self.health_interval_s):
+            try:
+                self.check_health()
+                if self.auto_rebalance:
+                    self.rebalance()
+            except Exception:
+                log.exception('Shard health check failed')
+
+    def check_health(self):
+        """ Ask every worker for a report; replace those that are dead or don't answer. Returns per-worker stats. """
+        with self._lock:
+            for worker in list(self.workers):
+                report = None
+                if worker.process.is_alive():
+                    try:
+                        report = worker.call('health', timeout=self.health_timeout_s)
+                    except (TimeoutError, RuntimeError, EOFError, OSError) as e:
+                        log.warning('Shard %s failed its health check: %s', worker.index, e)
+                if report is None:
+                    self._replace(worker)
+                    continue
+                worker.update_load(report['cpu_s'])
+                for session_id, session_report in report['sessions'].items():
+                    if session_id in self.sessions:
+                        self.sessions[session_id].report = session_report
+            return self.worker_stats()
+
+    def _replace(self, worker):
+        """ Start a new worker in place of `worker`, then start its sessions again on the least loaded workers. """
+        log.warning('Replacing shard %s (pid %s) with %d sessions.', worker.index, worker.process.pid,
+                    len(worker.sessions))
+        worker.kill()
+        self.restarts += 1
+        replacement = _Worker(worker.index, self._context, self._worker_args)
+        self.workers[self.workers.index(worker)] = replacement
+        for session_id in worker.sessions:
+            session = self.sessions[session_id]
+            try:
+                self._place(session, self._least_loaded())
+            except (TimeoutError, RuntimeError, EOFError, OSError) as e:
+                log.error('Could not restart session %s: %s', session_id, e)
+
+    def rebalance(self):
+        """ Move sessions from the busiest worker to the idlest while that evens out the load; returns how many. """
+        with self._lock:
+            measured = all(worker.load is not None for worker in self.workers)
+            loads = {worker: worker.load if measured else len(worker.sessions) for worker in self.workers}
+            moved = 0
+            while True:
+                idlest = min(self.workers, key=loads.get)
+                busiest = max(self.workers, key=loads.get)
+                if not busiest.sessions:
+                    break
+                cost = loads[busiest] / len(busiest.sessions)  # Of an average session there
+                if loads[busiest] - loads[idlest] <= cost:
+                    break
+                self._move(self.sessions[next(iter(busiest.sessions))], idlest)
+                loads[busiest] -= cost
+                loads[idlest] += cost
+                moved += 1
+            self.moved += moved
+            return moved
+
+    # Stats and teardown
+
+    def worker_stats(self):
+        return [{'index': worker.index, 'pid': worker.process.pid, 'alive': worker.process.is_alive(),
+                 'sessions': len(worker.sessions), 'load': worker.load} for worker in self.workers]
+
+    def stats(self):
+        """ Aggregate stats plus one entry per worker. """
+        sessions = list(self.sessions.values())
+        return {
+            'sessions': len(sessions),
+            'restarts': self.restarts,
+            'moved': self.moved,
+            'late_pumps': self.late_pumps,
+            'mic_overflow_bytes': sum(session.mic_ring.overflow_bytes for session in sessions),
+            'speaker_underruns': sum(session.speaker_source.underruns for session in sessions),
+            'workers': self.worker_stats(),
+        }
+
+    def close(self):
+        """ Stop every session and worker, and free the rings. """
+        self._stop_event.set()
+        for thread in (self._pump_thread, self._health_thread):
+            if thread:
+                thread.join()
+        with self._lock:
+            for worker in self.workers:
+                try:
+                    worker.call('shutdown')
+                    worker.process.join(COMMAND_TIMEOUT_S)
+                except (TimeoutError, RuntimeError, EOFError, OSError) as e:
+                    log.warning('Shard %s did not shut down cleanly: %s', worker.index, e)
+                if worker.process.is_alive():
+                    worker.kill()
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            self.workers = []
@@ -0,0 +1,153 @@
+"""
+Single-producer / single-consumer byte ring in shared memory, for moving audio between processes.
+
+Same scheme as RingBuffer: the producer only advances `write_pos`, the
+consumer only advances `read_pos`, both total bytes ever moved. Here they
+live in the segment's header, on separate cache lines, as aligned 64-bit
+words, and a position is only stored after the bytes it covers are copied.
+Python has no memory barriers, so whether the other process sees those
+stores in that order is up to the CPU: x86-64 keeps them in program order,
+weakly ordered CPUs (ARM, POWER) don't promise to. There the consumer could
+occasionally copy stale bytes, or the producer overwrite bytes still being
+copied, for part of a chunk: an audio glitch. Each position is read and
+written whole, so the counts stay consistent and nothing lands outside the
+ring.
+
+Attach from another process with `SharedRing(name=ring.name)`; the creator
+unlinks it. Attach only from processes started by multiprocessing, which
+share the creator's resource tracker; an unrelated process's tracker would
+unlink the segment when that process exits.
+
+RingSource / RingSink wrap the two ends as an AudioBackends source / sink,
+so a ClockedBackend (or ShardedRunner's pump) can drive them.
+"""
+from multiprocessing import shared_memory
+
+from AudioBackends import SAMPLE_WIDTH
+
+_HEADER = 128  # write_pos and capacity at byte 0, read_pos at byte 64
+_WRITE, _CAPACITY, _READ = 0, 1, 8  # Indices in the header viewed as 64-bit words
+
+
+class SharedRing:
+    def __init__(self, capacity=None, name=None):
+        """ Create a ring of `capacity` bytes, or attach to the existing one called `name`. """
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=_HEADER + capacity)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self._pos = self.shm.buf[:_HEADER].cast('Q')
+        if self.owner:
+            self._pos[_CAPACITY] = capacity
+        self.capacity = self._pos[_CAPACITY]  # The segment itself may be rounded up to whole pages
+        self._view = self.shm.buf[_HEADER:_HEADER + self.capacity]
+        self.overflow_bytes = 0  # Producer side, this process only
+
+    @property
+    def write_pos(self):
+        return self._pos[_WRITE]
+
+    @property
+    def read_pos(self):
+        return self._pos[_READ]
+
+    def __len__(self):
+        return self._pos[_WRITE] - self._pos[_READ]
+
+    def free(self):
+        return self.capacity - len(self)
+
+    def write(self, data):
+        """ Producer side: copy as much of `data` as fits, return bytes written. """
+        data = memoryview(data).cast('B')
+        write_pos = self._pos[_WRITE]
+        n = min(len(data), self.capacity - (write_pos - self._pos[_READ]))
+        if n < len(data):
+            self.overflow_bytes += len(data) - n
+        if n == 0:
+            return 0
+
+        start = write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._view[start:start + first] = data[:first]
+        if first < n:
+            self._view[:n - first] = data[first:n]
+        self._pos[_WRITE] = write_pos + n
+        return n
+
+    def read_into(self, out):
+        """ Consumer side: copy up to len(out) bytes into the writable buffer `out`, return bytes read. """
+        read_pos = self._pos[_READ]
+        n = min(len(out), self._pos[_WRITE] - read_pos)
+        if n == 0:
+            return 0
+
+        start = read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._view[start:start + first]
+        if first < n:
+            out[first:n] = self._view[:n - first]
+        self._pos[_READ] = read_pos + n
+        return n
+
+    def clear(self):
+        """ Consumer side: discard everything currently buffered. """
+        self._pos[_READ] = self._pos[_WRITE]
+
+    def close(self):
+        """ Detach; the creator also frees the segment. """
+        self._pos.release()
+        self._view.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingSource:
+    """
+    Reads fixed-size chunks from a SharedRing, as an AudioSource.
+
+    Starts reading once `prebuffer` more chunks than the one it takes are
+    queued, so a producer running on its own clock can be a little late
+    without reads coming up short; a short read is padded with silence,
+    counts an underrun and prebuffers again.
+    """
+
+    def __init__(self, ring, prebuffer=1):
+        self.ring = ring
+        self.prebuffer = prebuffer
+        self.underruns = 0
+        self._primed = False
+        self._out = bytearray()
+
+    def read(self, frame_count):
+        n = frame_count * SAMPLE_WIDTH
+        if len(self._out) != n:
+            self._out = bytearray(n)
+        if not self._primed:
+            if len(self.ring) < n * (self.prebuffer + 1):
+                return bytes(n)
+            self._primed = True
+        got = self.ring.read_into(self._out)
+        if got < n:
+            self._out[got:] = bytes(n - got)
+            self.underruns += 1
+            self._primed = False
+        return bytes(self._out)
+
+
+class RingSink:
+    """ Writes to a SharedRing, as an AudioSink; what doesn't fit is dropped (`ring.overflow_bytes`). """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += self.ring.write(data)
+
+    def close(self):
+        pass
@@ -1,78 +1,318 @@
+import collections
 import threading
 import queue
-import json
 import logging
-import select
-from websocket import create_connection, WebSocketConnectionClosedException
+import time
+from websocket import create_connection, WebSocketException
+
+import Codec
+from Backoff import Backoff
+from BoundedQueue import BoundedQueue
+from Metrics import Registry, DEPTH_BUCKETS, RESPONSE_BUCKETS
+from Telemetry import Payload
+
+log = logging.getLogger(__name__)
+
+SEND_BATCH_MAX = 32  # Max queued messages written per writer wake-up
+SEND_QUEUE_SIZE = 256  # Queued messages before the overflow policy applies to mic audio (~20 s at default batching)
+SEND_OVERFLOW = 'drop_oldest'  # 'drop_oldest', 'drop_newest', 'block' or 'coalesce'; control messages are never dropped
+AUDIO_DEADLINE_MS = 2000  # Queued mic audio older than this is discarded instead of sent (None: no deadline)
+MAX_RETRIES = None   # Reconnect attempts per outage before giving up (None: keep trying)
+STALE_AUDIO = 'drop'  # After a reconnect, 'drop' mic audio queued more than STALE_AUDIO_S before it, or 'keep' it all
+STALE_AUDIO_S = 1.0
+
+_STOP = object()  # Sentinel that wakes the writer thread on shutdown
+
+
+def _reason(e):
+    return str(e) or type(e).__name__
+
+
+def _is_audio(item):
+    return item is not _STOP and Codec.is_audio_append(item[1])
+
+
+def _merge_audio(first, second):
+    merged = Codec.merge_audio_appends(first[1], second[1])
+    return None if merged is None else (first[0], merged)  # None: past the cap, drop_oldest instead
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
 class Socket:
-    def __init__(self, api_key, ws_url, on_msg=None):
+    def __init__(self, api_key, ws_url, on_msg=None, send_batch_max=SEND_BATCH_MAX, metrics=None, reconnect=True,
+                 max_retries=MAX_RETRIES, stale_audio=STALE_AUDIO, stale_audio_s=STALE_AUDIO_S,
+                 send_queue_size=SEND_QUEUE_SIZE, send_overflow=SEND_OVERFLOW, audio_deadline_ms=AUDIO_DEADLINE_MS):
         self.api_key = api_key
         self.ws_url = ws_url
         self.ws = None
         self.on_msg = on_msg  # Callback for when a message is received
-        self.send_queue = queue.Queue()  # Outgoing message queue
+        self.accepts = None  # Optional predicate on the event type; rejected frames aren't parsed (audio deltas are)
+        self.recorder = None  # Recording.Recorder that gets every message sent and frame received
+        # Outgoing (enqueued_at, message); bound, overflow policy and deadline only ever discard mic audio
+        self.send_queue = BoundedQueue(send_queue_size, send_overflow, droppable=_is_audio, coalesce=_merge_audio,
+                                       max_age=audio_deadline_ms / 1000 if audio_deadline_ms else None)
+        self.send_batch_max = send_batch_max
         self._stop_event = threading.Event()
-        self.loop_thread = None  # Store thread reference
+        self.recv_thread = None  # Store thread references
+        self.send_thread = None
+
+        # Reconnect: the reader thread reopens the connection with backoff while the writer holds its messages
+        self.reconnect = reconnect
+        self.max_retries = max_retries
+        self.stale_audio = stale_audio
+        self.stale_audio_s = stale_audio_s
+        self.on_disconnect = None  # Called as on_disconnect(reason) on the reader thread when the connection drops
+        self.on_reconnect = None   # Called as on_reconnect(info) once a new connection is up and replayed
+        self.replay = None         # Returns the messages to send first on a new connection (session state)
+        self._connected = threading.Event()
+        self._unsent = collections.deque()  # Taken off send_queue, but the connection dropped before they went out
+        self._replayed = {}  # id -> message sent by the last replay; the writer skips these if they are still held
+        self.replay_skipped = 0
+        self._drop_audio_before = 0.0
+        self.reconnects = 0
+        self.audio_dropped = 0
+
+        # Enqueue-to-wire latency, in seconds
+        self.sent_count = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self.send_latency_last = 0.0
+
+        self.metrics = metrics or Registry()
+        self._send_delay = self.metrics.histogram('send_delay_seconds', 'Enqueue-to-wire delay of outgoing messages')
+        self._send_depth = self.metrics.histogram('send_queue_depth', 'Messages queued when the writer wakes up',
+                                                  DEPTH_BUCKETS)
+        self._dispatch_time = self.metrics.histogram('recv_dispatch_seconds', 'Decode and handling time per message')
+        self._received = self.metrics.counter('messages_received_total', 'Messages received')
+        self._bytes_received = self.metrics.counter('bytes_received_total', 'Bytes received')
+        self._bytes_sent = self.metrics.counter('bytes_sent_total', 'Bytes sent')
+        self.metrics.counter('messages_sent_total', 'Messages sent', fn=lambda: self.sent_count)
+        self._downtime = self.metrics.histogram('reconnect_seconds', 'Connection lost to reconnected and replayed',
+                                                RESPONSE_BUCKETS)
+        self._disconnects = self.metrics.counter('disconnects_total', 'Connections lost')
+        self.metrics.counter('stale_audio_dropped_total', 'Queued mic chunks dropped as stale after a reconnect',
+                             fn=lambda: self.audio_dropped)
+        self.metrics.counter('replay_skipped_total', 'Held messages not sent because the replay already had them',
+                             fn=lambda: self.replay_skipped)
+        send_queue = self.send_queue
+        self.metrics.counter('send_dropped_total', 'Mic audio messages dropped by the send queue overflow policy',
+                             fn=lambda: send_queue.dropped)
+        self.metrics.counter('send_expired_total', 'Mic audio messages discarded for missing the audio deadline',
+                             fn=lambda: send_queue.expired)
+        self.metrics.counter('send_coalesced_total', 'Mic audio messages merged into the one queued before them',
+                             fn=lambda: send_queue.coalesced)
+
+    def _open(self):
+        return create_connection(self.ws_url, header=[f'Authorization: Bearer {self.api_key}', 'OpenAI-Beta: realtime=v1'])
 
     def connect(self):
-        """ Connect to WebSocket and start main loop. """
-        self.ws = create_connection(self.ws_url, header=[f'Authorization: Bearer {self.api_key}', 'OpenAI-Beta: realtime=v1'])
-        logging.info('Connected to WebSocket.')
+        """ Connect to WebSocket and start the reader and writer threads. """
+        self.ws = self._open()
+        self._connected.set()
+        log.info('Connected to WebSocket.')
+
+        self.recv_thread = threading.Thread(target=self._recv_loop)
+        self.send_thread = threading.Thread(target=self._send_loop)
+        self.recv_thread.start()
+        self.send_thread.start()
 
-        # Start a unified loop for sending and receiving messages
-        self.loop_thread = threading.Thread(target=self._socket_loop)
-        self.loop_thread.start()
+    @property
+    def connected(self):
+        return self._connected.is_set() and not self._stop_event.is_set()
 
-    def _socket_loop(self):
-        """ Main loop that handles both sending and receiving messages. """
+    def _recv_loop(self):
+        """ Block on the WebSocket and dispatch each incoming message; reconnect if the connection drops. """
         while not self._stop_event.is_set():
             try:
-                # Use select to check if WebSocket has data to read
-                rlist, _, _ = select.select([self.ws.sock], [], [], 0.1)
+                message = self.ws.recv()
+                if message and self.recorder:
+                    self.recorder.received(message)
+                if message and self.on_msg:
+                    log.debug('Received message: %s', Payload(message))
+                    received_at = time.perf_counter()
+                    event = Codec.decode_audio_delta(message)  # Most of the traffic: no type peek or accepts()
+                    if event is not None:
+                        self.on_msg(event)
+                    elif not self.accepts or self.accepts(Codec.event_type(message)):
+                        self.on_msg(Codec.decode_event(message))  # Call the user-provided callback
+                    self._dispatch_time.observe(time.perf_counter() - received_at)
+                    self._received.inc()
+                    self._bytes_received.inc(len(message))
+            except (WebSocketException, OSError) as e:
+                if self._stop_event.is_set():
+                    break
+                log.error('WebSocket connection closed: %s', _reason(e))
+                if not self._reconnect(_reason(e)):
+                    break
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    log.error('Error in socket receive loop: %s', e)
+                break
 
-                # If there's incoming data, receive it
-                if rlist:
-                    message = self.ws.recv()
-                    if message and self.on_msg:
-                        logging.info(f'Received message: {message}')
-                        self.on_msg(json.loads(message))  # Call the user-provided callback
+    def _reconnect(self, reason):
+        """ Runs on the reader thread: reopen with backoff, replay session state, then release the writer. """
+        lost_at = time.monotonic()
+        self._connected.clear()
+        self._disconnects.inc()
+        self._abort(self.ws)
+        if self.on_disconnect:
+            self.on_disconnect(reason)
+        if not self.reconnect:
+            self._shut_writer()
+            return False
 
-                # Check if there's a message in the queue to send
-                try:
-                    outgoing_message = self.send_queue.get_nowait()
-                    self.ws.send(json.dumps(outgoing_message))
-                    logging.info(f'Sent message: {outgoing_message}')
-                except queue.Empty:
-                    continue  # No message to send, loop back
-            except WebSocketConnectionClosedException:
-                logging.error('WebSocket connection closed.')
-                break
+        backoff = Backoff(max_retries=self.max_retries)
+        while True:
+            delay = backoff.next()
+            if delay is None:
+                log.error('Giving up after %d reconnect attempts.', backoff.attempts)
+                self._shut_writer()
+                return False
+            if self._stop_event.wait(delay):
+                return False
+            try:
+                ws = self._open()
+                replay = self.replay() if self.replay else []
+                for message in replay:
+                    ws.send(Codec.to_wire(message))
             except Exception as e:
-                logging.error(f'Error in socket loop: {e}')
-                break
+                log.warning('Reconnect attempt %d failed: %s', backoff.attempts, e)
+                continue
+            break
+
+        self.ws = ws
+        self._replayed = {id(message): message for message in replay}
+        if self.stale_audio == 'drop':
+            self._drop_audio_before = time.monotonic() - self.stale_audio_s
+        self.reconnects += 1
+        downtime = time.monotonic() - lost_at
+        self._downtime.observe(downtime)
+        self._connected.set()
+        info = {'attempts': backoff.attempts, 'downtime_s': downtime, 'replayed': len(replay)}
+        log.info('Reconnected after %.0f ms (%d attempts, %d replayed).', downtime * 1000, backoff.attempts,
+                 len(replay))
+        if self.on_reconnect:
+            self.on_reconnect(info)
+        return True
+
+    @staticmethod
+    def _abort(ws):
+        """ Close a dead connection without a closing handshake; wakes a thread blocked in recv(). """
+        if ws:
+            try:
+                ws.abort()
+                ws.shutdown()
+            except Exception:
+                pass
+
+    def _shut_writer(self):
+        self._stop_event.set()
+        self._connected.set()  # Wake the writer so it sees the stop
+        self.send_queue.put(_STOP)
+        self.send_queue.close()
+
+    def _send_loop(self):
+        """ Sleep until something is queued, then drain the queue in batches; hold messages while reconnecting. """
+        while not self._stop_event.is_set():
+            if self._unsent:
+                batch = list(self._unsent)
+                self._unsent.clear()
+            else:
+                item = self.send_queue.get()
+                self._send_depth.observe(self.send_queue.qsize() + 1)
+                batch = [item]
+                while len(batch) < self.send_batch_max:
+                    try:
+                        batch.append(self.send_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            self._connected.wait()
+            ws = self.ws
+            max_age = self.send_queue.max_age
+            for i, item in enumerate(batch):
+                if item is _STOP or self._stop_event.is_set():
+                    return
+                enqueued_at, outgoing_message = item
+                # Queued or held back while the connection was down, and already sent again by the replay
+                if self._replayed.get(id(outgoing_message)) is outgoing_message:
+                    self.replay_skipped += 1
+                    continue
+                if enqueued_at < self._drop_audio_before and Codec.is_audio_append(outgoing_message):
+                    self.audio_dropped += 1
+                    continue
+                # The batch left the queue before a stall in send(); audio that has since missed the deadline is skipped
+                if max_age and time.monotonic() - enqueued_at > max_age and Codec.is_audio_append(outgoing_message):
+                    self.send_queue.expired += 1
+                    continue
+                try:
+                    wire = Codec.to_wire(outgoing_message)
+                    ws.send(wire)
+                except (WebSocketException, OSError) as e:
+                    if self._stop_event.is_set():
+                        return
+                    # Keep this message and the rest of the batch for the next connection
+                    self._unsent.extend(batch[i:])
+                    if ws is self.ws:  # Unless the reader has already reconnected
+                        self._connected.clear()
+                        self._abort(ws)  # The reader notices and reconnects
+                    log.error('WebSocket connection closed while sending: %s', _reason(e))
+                    break
+                except Exception as e:
+                    if not self._stop_event.is_set():
+                        log.error('Error in socket send loop: %s', e)
+                    return
+                self._record_send_latency(time.monotonic() - enqueued_at)
+                self._bytes_sent.inc(len(wire))
+                log.debug('Sent message: %s', Payload(wire))
+
+    def _record_send_latency(self, latency):
+        self.sent_count += 1
+        self.send_latency_total += latency
+        self.send_latency_last = latency
+        self._send_delay.observe(latency)
+        if latency > self.send_latency_max:
+            self.send_latency_max = latency
+
+    def latency_stats(self):
+        """ Enqueue-to-wire latency summary, in milliseconds. """
+        mean = self.send_latency_total / self.sent_count if self.sent_count else 0.0
+        return {
+            'sent': self.sent_count,
+            'mean_ms': mean * 1000,
+            'max_ms': self.send_latency_max * 1000,
+            'last_ms': self.send_latency_last * 1000,
+        }
 
     def send(self, data):
-        """ Enqueue the message to be sent. """
-        self.send_queue.put(data)
+        """ Enqueue the message to be sent; mic audio is subject to the send queue's bound and deadline. """
+        if self.recorder:
+            self.recorder.sent(data)
+        self.send_queue.put((time.monotonic(), data))
+
+    def queue_stats(self):
+        return self.send_queue.stats()
 
     def kill(self):
-        """ Cleanly shut down the WebSocket and stop the loop. """
-        logging.info('Shutting down WebSocket.')
+        """ Cleanly shut down the WebSocket and stop both threads. """
+        log.info('Shutting down WebSocket.')
         self._stop_event.set()
+        self._connected.set()
+        self.send_queue.put(_STOP)
+        self.send_queue.close()  # Release any producer blocked by the 'block' policy
 
-        # Close WebSocket
+        # Close WebSocket, which also unblocks the reader
         if self.ws:
             try:
+                # send_close() marks the connection closed, after which close() is a no-op; shutdown() drops the socket
                 self.ws.send_close()
-                self.ws.close()
-                logging.info('WebSocket connection closed.')
+                self.ws.shutdown()
+                log.info('WebSocket connection closed.')
             except Exception as e:
-                logging.error(f'Error closing WebSocket: {e}')
+                log.error('Error closing WebSocket: %s', e)
 
-        # Ensure the loop thread is joined
-        if self.loop_thread:
-            self.loop_thread.join()
-            logging.info('WebSocket loop thread terminated.')
\ No newline at end of file
+        # Ensure both threads are joined
+        for thread in (self.recv_thread, self.send_thread):
+            if thread and thread is not threading.current_thread():
+                thread.join()
+        log.info('WebSocket threads terminated.')
+        log.info('Send latency: %s', self.latency_stats())
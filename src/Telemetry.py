@@ -0,0 +1,193 @@
+"""
+Logging setup and helpers for the hot paths.
+
+Library modules only create loggers (`logging.getLogger(__name__)`); the
+application calls `configure()` once. Per-message and per-chunk logging is
+kept cheap three ways:
+
+- Formatting is lazy: hot paths log with %-style args, and payloads are
+  wrapped in `Payload`, which only redacts/truncates/serialises a message if
+  a handler actually emits the record.
+- Per-chunk logs go through a `Sampler`, so only every Nth chunk is logged.
+- Audio events (mic on/off, chunk samples, playback) share one logger,
+  `realtime.audio`, whose `RateLimitFilter` caps how many records per second
+  get through and reports how many were dropped.
+"""
+import json
+import logging
+import sys
+import time
+
+PAYLOADS = 'redact'     # 'redact': base64 audio replaced by its length; 'full': as sent
+MAX_PAYLOAD = 512       # Logged payloads are truncated to this many characters (0 = no limit)
+SAMPLE_EVERY = 50       # Per-chunk logs: one in this many (~2 s of 1024-frame chunks at 24 kHz)
+AUDIO_PER_SECOND = 5.0  # Sustained rate of records let through on the audio channel...
+AUDIO_BURST = 10        # ...with bursts of up to this many
+
+AUDIO_LOGGER = 'realtime.audio'
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+STRUCTURED_FIELDS = ('event_type', 'bytes', 'chunks', 'suppressed')  # `extra` keys copied into JSON records
+
+_AUDIO_KEYS = ('audio', 'delta')
+_AUDIO_FIELDS = tuple(f'"{key}":"' for key in _AUDIO_KEYS)  # As written by compact JSON (Codec, the server)
+_AUDIO_FIELD_BYTES = tuple(field.encode() for field in _AUDIO_FIELDS)
+_FIELD_WINDOW = 512  # Audio events put the audio field after a few short ids, well inside this
+
+_settings = {'payloads': PAYLOADS, 'max_payload': MAX_PAYLOAD}
+
+
+class Payload:
+    """ Lazily rendered message for log args: nothing is formatted unless the record is emitted. """
+
+    __slots__ = ('message',)
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return render_payload(self.message)
+
+
+def render_payload(message, payloads=None, max_payload=None):
+    """ Text of a wire message (dict, str or bytes) for logging, with audio redacted and length capped. """
+    payloads = payloads or _settings['payloads']
+    max_payload = _settings['max_payload'] if max_payload is None else max_payload
+
+    if isinstance(message, dict):
+        if payloads == 'redact':
+            message = {k: _redacted(v) if k in _AUDIO_KEYS else v for k, v in message.items()}
+        text = json.dumps(message, default=repr)
+    elif payloads == 'redact':
+        text = _redact_text(message)
+    else:
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            message = bytes(message).decode('utf-8', 'replace')
+        text = message
+
+    if max_payload and len(text) > max_payload:
+        text = f'{text[:max_payload]}... ({len(text)} chars)'
+    return text
+
+
+def _redact_text(raw):
+    """
+    Text of an encoded frame (str or bytes) with its audio field replaced by the field's length.
+
+    The audio is only scanned for its closing quote: just the text around it is decoded and copied.
+    """
+    text = isinstance(raw, str)
+    if not text and isinstance(raw, memoryview):
+        raw = raw.obj if isinstance(raw.obj, bytes) and raw.nbytes == len(raw.obj) else bytes(raw)
+    for field in _AUDIO_FIELDS if text else _AUDIO_FIELD_BYTES:
+        start = raw.find(field, 0, _FIELD_WINDOW)
+        if start != -1:
+            start += len(field)
+            end = raw.find('"' if text else b'"', start)
+            if end != -1:
+                head, tail = raw[:start], raw[end:]
+                if not text:
+                    head, tail = head.decode('utf-8', 'replace'), tail.decode('utf-8', 'replace')
+                return f'{head}<{end - start} b64 chars>{tail}'
+    return raw if text else bytes(raw).decode('utf-8', 'replace')
+
+
+def _redacted(value):
+    if isinstance(value, (bytes, bytearray)):
+        return f'<{len(value)} bytes>'
+    return f'<{len(value)} b64 chars>'
+
+
+class Sampler:
+    """ Counts calls and answers True once every `every` calls (the first call included). """
+
+    __slots__ = ('every', 'count')
+
+    def __init__(self, every=None):
+        self.every = every
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        every = self.every or SAMPLE_EVERY
+        return every <= 1 or self.count % every == 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket over log records: `per_second` sustained, `burst` at once.
+    The first record let through after a drop notes how many were suppressed.
+    """
+
+    def __init__(self, per_second=AUDIO_PER_SECOND, burst=AUDIO_BURST):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.suppressed = 0        # Since the last record let through
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if not self.per_second:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.per_second)
+        self.updated_at = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            self.suppressed_total += 1
+            return False
+        self.tokens -= 1
+        if self.suppressed:
+            record.msg = f'{record.getMessage()} [{self.suppressed} audio log records suppressed]'
+            record.args = None
+            record.suppressed = self.suppressed
+            self.suppressed = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, with any STRUCTURED_FIELDS passed via `extra`. """
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr)
+
+
+audio_log = logging.getLogger(AUDIO_LOGGER)
+audio_filter = RateLimitFilter()
+audio_log.addFilter(audio_filter)
+
+
+def configure(level=logging.INFO, structured=False, payloads=PAYLOADS, max_payload=MAX_PAYLOAD,
+              sample_every=SAMPLE_EVERY, audio_per_second=AUDIO_PER_SECOND, audio_burst=AUDIO_BURST,
+              audio_level=None, stream=None):
+    """
+    Configure the root handler and the telemetry settings. Call once, from the application.
+
+    `level` DEBUG turns on per-message wire logs. `audio_level` sets the audio
+    channel separately (e.g. WARNING to silence it); `audio_per_second=0`
+    disables its rate limit and `sample_every=1` logs every chunk.
+    """
+    global SAMPLE_EVERY
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if structured else logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+    _settings.update(payloads=payloads, max_payload=max_payload)
+    SAMPLE_EVERY = sample_every
+    audio_filter.per_second = audio_per_second
+    audio_filter.burst = audio_burst
+    audio_filter.tokens = float(audio_burst)
+    audio_log.setLevel(logging.NOTSET if audio_level is None else audio_level)
@@ -0,0 +1,281 @@
+"""
+Function calling: a registry of tools the model may call, run off the socket's reader.
+
+Arguments stream in as `response.function_call_arguments.delta` events and
+are assembled per call; at `.done` the call is handed to a worker pool (a
+ThreadPoolExecutor by default, any concurrent.futures Executor such as a
+ProcessPoolExecutor, or asyncio tasks once `loop` is set), so a slow tool
+never holds up audio deltas behind it. Each result goes back as a
+`function_call_output` item, and once every call of a response has
+finished, one `response.create` asks the model to carry on.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import json
+import logging
+import threading
+import time
+
+from Metrics import Registry, RESPONSE_BUCKETS
+
+log = logging.getLogger(__name__)
+
+TOOL_WORKERS = 4       # Worker threads shared by all tools
+TOOL_TIMEOUT_S = 10.0  # A call still running after this is answered with an error (the thread can't be stopped)
+
+
+class Tool:
+    __slots__ = ('name', 'fn', 'description', 'parameters', 'timeout', 'max_concurrency', 'running', 'waiting',
+                 'latency')
+
+    def __init__(self, name, fn, description, parameters, timeout, max_concurrency):
+        self.name = name
+        self.fn = fn
+        self.description = description
+        self.parameters = parameters
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency  # None: only the pool size limits it
+        self.running = 0
+        self.waiting = []  # Calls held back by max_concurrency, oldest first
+        self.latency = None
+
+    def definition(self):
+        return {'type': 'function', 'name': self.name, 'description': self.description,
+                'parameters': self.parameters}
+
+
+class ToolCall:
+    __slots__ = ('name', 'tool', 'call_id', 'response_id', 'arguments', 'generation', 'started_at', 'timer',
+                 'finished')
+
+    def __init__(self, name, tool, call_id, response_id, arguments, generation):
+        self.name = name
+        self.tool = tool  # None if the model called a tool that isn't registered
+        self.call_id = call_id
+        self.response_id = response_id
+        self.arguments = arguments  # JSON text as streamed by the model
+        self.generation = generation
+        self.started_at = None
+        self.timer = None
+        self.finished = False
+
+
+class ToolRegistry:
+    def __init__(self, send, respond=None, metrics=None, workers=TOOL_WORKERS, executor=None, auto_respond=True):
+        self.send = send  # Thread-safe send for function_call_output items
+        self.respond = respond  # Called (thread-safe) to send the follow-up response.create
+        self.auto_respond = auto_respond
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='tool')
+        self.loop = None  # Set to run tools as tasks on this event loop instead (AsyncRealtime)
+        self.tools = {}
+
+        self._lock = threading.Lock()  # Guards the call bookkeeping below; tools finish on any worker
+        self._names = {}      # call_id -> tool name, from response.output_item.added
+        self._arguments = {}  # call_id -> argument deltas so far
+        self._open = {}       # response_id -> [calls still running, response.done seen]
+        self._tasks = set()
+        self._generation = 0  # Bumped on disconnect: results of calls from an older connection are discarded
+
+        self.metrics = metrics or Registry()
+        self._calls = self.metrics.counter('tool_calls_total', 'Tool calls started')
+        self._errors = self.metrics.counter('tool_errors_total', 'Tool calls that raised or had bad arguments')
+        self._timeouts = self.metrics.counter('tool_timeouts_total', 'Tool calls answered with a timeout error')
+        self._latency = self.metrics.histogram('tool_seconds', 'Arguments complete to result sent, all tools',
+                                               RESPONSE_BUCKETS)
+        self.metrics.gauge('tools_running', 'Tool calls in progress',
+                           fn=lambda: sum(tool.running for tool in self.tools.values()))
+
+    def __len__(self):
+        return len(self.tools)
+
+    def register(self, fn=None, name=None, description=None, parameters=None, timeout=TOOL_TIMEOUT_S,
+                 max_concurrency=None):
+        """
+        Make `fn` callable by the model; usable as a decorator, with or without arguments.
+
+        `fn` is called with the model's arguments as keyword arguments and may be a coroutine function.
+        It returns a str or anything JSON-serialisable. `parameters` is the JSON schema of its arguments.
+        """
+        if fn is None:
+            return functools.partial(self.register, name=name, description=description, parameters=parameters,
+                                     timeout=timeout, max_concurrency=max_concurrency)
+        name = name or fn.__name__
+        tool = Tool(name, fn, description or (fn.__doc__ or '').strip(),
+                    parameters or {'type': 'object', 'properties': {}}, timeout, max_concurrency)
+        tool.latency = self.metrics.histogram(f"tool_{name.replace('-', '_')}_seconds",
+                                              f'Arguments complete to result sent, {name}', RESPONSE_BUCKETS)
+        self.tools[name] = tool
+        return fn
+
+    def definitions(self):
+        """ The `tools` list for session.update. """
+        return [tool.definition() for tool in self.tools.values()]
+
+    # Server events, on the socket's reader
+
+    def on_output_item_added(self, message):
+        item = message.get('item', {})
+        if item.get('type') == 'function_call':
+            self._names[item.get('call_id')] = item.get('name')
+
+    def on_arguments_delta(self, message):
+        self._arguments.setdefault(message.get('call_id'), []).append(message.get('delta', ''))
+
+    def on_arguments_done(self, message):
+        call_id = message.get('call_id')
+        parts = self._arguments.pop(call_id, [])
+        arguments = message.get('arguments') or ''.join(parts)
+        name = self._names.pop(call_id, None) or message.get('name')
+        response_id = message.get('response_id')
+
+        tool = self.tools.get(name)
+        call = ToolCall(name, tool, call_id, response_id, arguments, self._generation)
+        call.started_at = time.monotonic()
+        self._calls.inc()
+        with self._lock:
+            self._open.setdefault(response_id, [0, False])[0] += 1
+            if tool and tool.max_concurrency and tool.running >= tool.max_concurrency:
+                tool.waiting.append(call)
+                return
+            if tool:
+                tool.running += 1
+        if tool is None:
+            self._finish(call, error=f'Unknown tool: {name}')
+        else:
+            self._launch(call)
+
+    def on_response_done(self, message):
+        response_id = message.get('response', {}).get('id')
+        with self._lock:
+            state = self._open.get(response_id)
+            if state is None:
+                return
+            state[1] = True
+            ready = state[0] == 0
+            if ready:
+                del self._open[response_id]
+        if ready:
+            self._respond()
+
+    def reset(self):
+        """ The connection dropped: calls in flight belong to a conversation the server no longer has. """
+        with self._lock:
+            self._generation += 1
+            self._names.clear()
+            self._arguments.clear()
+            self._open.clear()
+
+    # Running calls
+
+    def _launch(self, call):
+        try:
+            kwargs = json.loads(call.arguments) if call.arguments else {}
+            if not isinstance(kwargs, dict):
+                raise ValueError('arguments must be a JSON object')
+        except ValueError as e:
+            self._finish(call, error=f'Bad arguments: {e}')
+            return
+
+        fn = call.tool.fn
+        if self.loop:
+            task = self.loop.create_task(self._run_task(call, fn, kwargs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+
+        if asyncio.iscoroutinefunction(fn):
+            future = self.executor.submit(asyncio.run, fn(**kwargs))
+        else:
+            future = self.executor.submit(fn, **kwargs)
+        call.timer = threading.Timer(call.tool.timeout, self._finish, (call,), {'timed_out': True})
+        call.timer.daemon = True
+        call.timer.start()
+        future.add_done_callback(functools.partial(self._future_done, call))
+
+    def _future_done(self, call, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self._finish(call, error=error)
+        else:
+            self._finish(call, result=future.result())
+
+    async def _run_task(self, call, fn, kwargs):
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                pending = fn(**kwargs)
+            else:
+                pending = self.loop.run_in_executor(self.executor, functools.partial(fn, **kwargs))
+            result = await asyncio.wait_for(pending, call.tool.timeout)
+        except asyncio.TimeoutError:
+            self._finish(call, timed_out=True)
+        except Exception as e:
+            self._finish(call, error=e)
+        else:
+            self._finish(call, result=result)
+
+    def _finish(self, call, result=None, error=None, timed_out=False):
+        """ Send the call's output, start the next call held back for its tool, and respond if it was the last. """
+        tool = call.tool
+        with self._lock:
+            if call.finished:
+                return  # Already answered, e.g. the result came after the timeout
+            call.finished = True
+            current = call.generation == self._generation
+            waiting = None
+            if tool:
+                tool.running -= 1
+                if tool.waiting:
+                    waiting = tool.waiting.pop(0)
+                    tool.running += 1
+            ready = False
+            state = self._open.get(call.response_id) if current else None
+            if state is not None:
+                state[0] -= 1
+                ready = state[0] == 0 and state[1]
+                if ready:
+                    del self._open[call.response_id]
+
+            elapsed = time.monotonic() - call.started_at
+            self._latency.observe(elapsed)
+            if tool:
+                tool.latency.observe(elapsed)
+            if timed_out:
+                self._timeouts.inc()
+            elif error is not None:
+                self._errors.inc()
+
+        if call.timer:
+            call.timer.cancel()
+        name = call.name
+        if timed_out:
+            output = json.dumps({'error': f'{name} timed out after {tool.timeout} s'})
+            log.warning('Tool %s timed out after %s s.', name, tool.timeout)
+        elif error is not None:
+            output = json.dumps({'error': str(error) if isinstance(error, str) else f'{type(error).__name__}: {error}'})
+            log.error('Tool %s failed: %s', name, error)
+        else:
+            output = result if isinstance(result, str) else json.dumps(result, default=str)
+            log.info('Tool %s returned in %.0f ms.', name, elapsed * 1000)
+
+        if current:
+            self.send({'type': 'conversation.item.create',
+                       'item': {'type': 'function_call_output', 'call_id': call.call_id, 'output': output}})
+        if waiting:
+            self._launch(waiting)
+        if ready:
+            self._respond()
+
+    def _respond(self):
+        if self.auto_respond and self.respond:
+            self.respond()
+
+    def shutdown(self):
+        """ Stop taking calls; calls still running are abandoned. """
+        with self._lock:
+            self._generation += 1
+        for task in list(self._tasks):
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
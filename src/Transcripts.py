@@ -0,0 +1,196 @@
+"""
+Streaming transcripts: the model's text and speech transcript, and the user's input transcription.
+
+Deltas are appended to a per-item list and only joined when the text is
+read, so a long answer costs one append per delta rather than a copy of
+everything so far. Consumers can take updates as callbacks (`on_delta`,
+`on_done`), from a blocking iterator (`updates()`), or from an async one
+(`aupdates()`). Only the last `history` finished items are kept.
+"""
+import asyncio
+import collections
+import threading
+
+HISTORY = 32        # Finished transcripts kept
+OPEN_ITEMS = 16     # Unfinished transcripts kept, in case their .done never comes
+LISTENER_BACKLOG = 1024  # Updates buffered per iterator before the oldest are dropped
+
+TEXT, SPEECH, INPUT = 'text', 'speech', 'input'  # response.text, response.audio_transcript, input transcription
+
+
+class Transcript:
+    __slots__ = ('item_id', 'content_index', 'kind', 'response_id', 'parts', 'done', 'error')
+
+    def __init__(self, item_id, content_index, kind, response_id=None):
+        self.item_id = item_id
+        self.content_index = content_index
+        self.kind = kind
+        self.response_id = response_id
+        self.parts = []
+        self.done = False
+        self.error = None  # Set if input transcription failed
+
+    @property
+    def role(self):
+        return 'user' if self.kind == INPUT else 'assistant'
+
+    @property
+    def text(self):
+        """ The text so far. Read-only, so safe from any thread while the socket's reader appends. """
+        return ''.join(self.parts)
+
+    def __repr__(self):
+        return f'Transcript({self.role} {self.kind} {self.item_id!r} done={self.done} {self.text!r})'
+
+
+class Transcripts:
+    """
+    Accumulates transcript events, keyed by (item_id, content_index).
+
+    Fed from the socket's reader via the on_* handlers. `on_delta(transcript,
+    delta)` and `on_done(transcript)` run on that thread, so should be quick.
+    """
+
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.on_delta = None
+        self.on_done = None
+        self._open = collections.OrderedDict()      # key -> Transcript, oldest first
+        self._finished = collections.OrderedDict()  # key -> Transcript, oldest first
+        self._lock = threading.Condition()
+        self._listeners = []  # Blocking iterators' deques of (transcript, delta)
+        self._async_listeners = []  # (loop, asyncio.Queue)
+        self.closed = False
+
+    def get(self, item_id, content_index=0):
+        key = (item_id, content_index)
+        return self._open.get(key) or self._finished.get(key)
+
+    def all(self):
+        """ Kept transcripts, finished ones first, each group oldest first. """
+        return list(self._finished.values()) + list(self._open.values())
+
+    # Server events, on the socket's reader
+
+    def on_text_delta(self, message):
+        self._delta(message, TEXT)
+
+    def on_text_done(self, message):
+        self._done(message, TEXT, message.get('text'))
+
+    def on_speech_delta(self, message):
+        self._delta(message, SPEECH)
+
+    def on_speech_done(self, message):
+        self._done(message, SPEECH, message.get('transcript'))
+
+    def on_input_done(self, message):
+        self._done(message, INPUT, message.get('transcript'))
+
+    def on_input_failed(self, message):
+        transcript = self._transcript(message, INPUT)
+        transcript.error = message.get('error', {}).get('message') or 'transcription failed'
+        self._finish(transcript)
+
+    def on_response_done(self, message):
+        """ A cancelled or failed response may never send its .done events: finish what it left open. """
+        response_id = message.get('response', {}).get('id')
+        for transcript in [t for t in self._open.values() if t.response_id == response_id]:
+            self._finish(transcript)
+
+    def _transcript(self, message, kind):
+        key = (message.get('item_id'), message.get('content_index', 0))
+        transcript = self._open.get(key)
+        if transcript is None:
+            transcript = self._open[key] = Transcript(key[0], key[1], kind, message.get('response_id'))
+            if len(self._open) > OPEN_ITEMS:
+                self._open.popitem(last=False)
+        return transcript
+
+    def _delta(self, message, kind):
+        delta = message.get('delta', '')
+        transcript = self._transcript(message, kind)
+        transcript.parts.append(delta)
+        if self.on_delta:
+            self.on_delta(transcript, delta)
+        self._publish(transcript, delta)
+
+    def _done(self, message, kind, text):
+        transcript = self._transcript(message, kind)
+        if text is not None:
+            transcript.parts[:] = [text]  # The final text is authoritative
+        self._finish(transcript)
+
+    def _finish(self, transcript):
+        key = (transcript.item_id, transcript.content_index)
+        self._open.pop(key, None)
+        transcript.done = True
+        self._finished[key] = transcript
+        while len(self._finished) > self.history:
+            self._finished.popitem(last=False)
+        if self.on_done:
+            self.on_done(transcript)
+        self._publish(transcript, '')
+
+    # Iterators
+
+    def _publish(self, transcript, delta):
+        update = (transcript, delta)
+        if self._listeners:
+            with self._lock:
+                for listener in self._listeners:
+                    listener.append(update)
+                self._lock.notify_all()
+        for loop, updates in self._async_listeners:
+            loop.call_soon_threadsafe(_put_dropping_oldest, updates, update)
+
+    def updates(self, timeout=None):
+        """
+        Yield (transcript, delta) from now on until close(): delta is '' when the transcript is done.
+
+        `transcript.text` is the text so far. Stops early if nothing arrives for `timeout` seconds.
+        """
+        listener = collections.deque(maxlen=LISTENER_BACKLOG)
+        with self._lock:
+            self._listeners.append(listener)
+        try:
+            while True:
+                with self._lock:
+                    while not listener and not self.closed:
+                        if not self._lock.wait(timeout):
+                            break
+                    if not listener:
+                        return
+                    update = listener.popleft()
+                yield update
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+
+    async def aupdates(self):
+        """ Async counterpart of updates(), for use on an event loop. """
+        loop = asyncio.get_running_loop()
+        entry = (loop, asyncio.Queue(LISTENER_BACKLOG))
+        self._async_listeners = self._async_listeners + [entry]
+        try:
+            while True:
+                update = await entry[1].get()
+                if update is None:
+                    return
+                yield update
+        finally:
+            self._async_listeners = [e for e in self._async_listeners if e is not entry]
+
+    def close(self):
+        """ End every iterator. """
+        with self._lock:
+            self.closed = True
+            self._lock.notify_all()
+        for loop, updates in self._async_listeners:
+            loop.call_soon_threadsafe(_put_dropping_oldest, updates, None)
+
+
+def _put_dropping_oldest(updates, update):
+    if updates.full():
+        updates.get_nowait()
+    updates.put_nowait(update)
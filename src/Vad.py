@@ -0,0 +1,116 @@
+import collections
+
+import numpy as np
+
+FRAME_MS = 20
+THRESHOLD_DB = 12       # Speech must be this far above the noise floor...
+MIN_LEVEL_DBFS = -50    # ...and at least this loud
+ZCR_MAX = 0.35          # Zero-crossing rate above this is treated as noise unless clearly loud
+LOUD_MARGIN_DB = 10     # Frames this far above threshold count as speech regardless of ZCR (fricatives)
+HANGOVER_MS = 300       # Keep sending this long after the last speech frame
+PREROLL_MS = 300        # Audio sent ahead of the first speech frame, so onsets aren't clipped
+NOISE_ADAPT = 0.05
+
+
+class VoiceActivityDetector:
+    """
+    Energy / zero-crossing VAD over PCM16 mono.
+
+    `process(pcm)` returns the bytes that should be uploaded: nothing while
+    silent, speech plus `hangover_ms` afterwards, and `preroll_ms` of lookback
+    when speech starts. Features are computed for all frames of a chunk at
+    once; `started` / `ended` report transitions seen in the last call.
+    """
+
+    def __init__(self, rate, frame_ms=FRAME_MS, threshold_db=THRESHOLD_DB, min_level_dbfs=MIN_LEVEL_DBFS,
+                 zcr_max=ZCR_MAX, hangover_ms=HANGOVER_MS, preroll_ms=PREROLL_MS,
+                 on_speech_start=None, on_speech_end=None):
+        self.frame_bytes = int(rate * frame_ms / 1000) * 2
+        self.threshold_db = threshold_db
+        self.min_level_dbfs = min_level_dbfs
+        self.zcr_max = zcr_max
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.preroll = collections.deque(maxlen=max(0, preroll_ms // frame_ms))
+        self.on_speech_start = on_speech_start
+        self.on_speech_end = on_speech_end
+
+        self.noise_floor_db = None
+        self.speaking = False
+        self.started = False
+        self.ended = False
+        self._hang = 0
+        self._pending = b''  # Partial frame carried into the next call
+
+        self.bytes_in = 0
+        self.bytes_sent = 0
+        self.utterances = 0
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_sent
+
+    def _classify(self, frames):
+        """ Per-frame speech decision for an (n, frame) int16 array. """
+        samples = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(samples * samples, axis=1)) + 1e-9
+        level_db = (20 * np.log10(rms / 32768)).tolist()
+        zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1).tolist()
+
+        if self.noise_floor_db is None:
+            self.noise_floor_db = level_db[0]
+        voiced = np.empty(len(frames), dtype=bool)
+        for i, level in enumerate(level_db):
+            threshold = max(self.noise_floor_db + self.threshold_db, self.min_level_dbfs)
+            voiced[i] = level > threshold and (zcr[i] < self.zcr_max or level > threshold + LOUD_MARGIN_DB)
+            if not voiced[i]:
+                self.noise_floor_db += NOISE_ADAPT * (level - self.noise_floor_db)
+        return voiced
+
+    def process(self, pcm):
+        """ Feed one mic chunk; returns the bytes to upload (possibly empty). """
+        self.started = self.ended = False
+        self.bytes_in += len(pcm)
+        data = self._pending + pcm if self._pending else pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        if not usable:
+            return b''
+
+        frames = np.frombuffer(data, dtype='<i2', count=usable // 2).reshape(-1, self.frame_bytes // 2)
+        out = []
+        for i, voiced in enumerate(self._classify(frames)):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if voiced:
+                if not self.speaking:
+                    self.speaking = True
+                    self.started = True
+                    self.utterances += 1
+                    out.extend(self.preroll)
+                    self.preroll.clear()
+                    if self.on_speech_start:
+                        self.on_speech_start()
+                self._hang = self.hangover_frames
+                out.append(frame)
+            elif self.speaking:
+                out.append(frame)
+                self._hang -= 1
+                if self._hang <= 0:
+                    self.speaking = False
+                    self.ended = True
+                    if self.on_speech_end:
+                        self.on_speech_end()
+            else:
+                self.preroll.append(frame)
+
+        speech = b''.join(out)
+        self.bytes_sent += len(speech)
+        return speech
+
+    def stats(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_sent': self.bytes_sent,
+            'bytes_saved': self.bytes_saved,
+            'utterances': self.utterances,
+            'noise_floor_db': self.noise_floor_db,
+        }
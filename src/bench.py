@@ -0,0 +1,910 @@
+""" Microbenchmarks for the src/ pipeline. Run from src/: `python bench.py <name>` (or `python bench.py --list`). """
+import argparse
+import base64
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import timeit
+
+import Codec
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__[len('bench_'):]] = fn
+    return fn
+
+
+def report(label, seconds, n):
+    print(f'{label:<40} {seconds / n * 1e6:9.2f} us/frame')
+
+
+def percentiles(values):
+    """ (p50, p95, max) of a list, or zeros if empty. """
+    if not values:
+        return 0.0, 0.0, 0.0
+    values = sorted(values)
+    return values[len(values) // 2], values[int(len(values) * 0.95)], values[-1]
+
+
+def session_counts(n):
+    """ 1, 2, 4, ... up to and including n. """
+    counts = []
+    c = 1
+    while c < n:
+        counts.append(c)
+        c *= 2
+    return counts + [n]
+
+
+@benchmark
+def bench_codec(args):
+    """ Per-frame cost of encoding mic audio and decoding audio deltas, before and after the fast path. """
+    mic_chunk = os.urandom(args.chunk_bytes)
+    delta_raw = json.dumps({
+        'type': 'response.audio.delta', 'event_id': 'event_123', 'response_id': 'resp_123',
+        'item_id': 'item_123', 'output_index': 0, 'content_index': 0,
+        'delta': base64.b64encode(os.urandom(args.delta_bytes)).decode('utf-8'),
+    }, separators=(',', ':'))  # The server sends compact JSON
+
+    def encode_before():
+        json.dumps({'type': 'input_audio_buffer.append', 'audio': base64.b64encode(mic_chunk).decode('utf-8')})
+
+    def encode_after():
+        Codec.encode_audio_append(mic_chunk)
+
+    def decode_before():
+        base64.b64decode(json.loads(delta_raw)['delta'])
+
+    def decode_after():
+        Codec.audio_of(Codec.decode_event(delta_raw))
+
+    print(f'JSON backend: {Codec.JSON_BACKEND}; mic chunk {args.chunk_bytes} B, delta {args.delta_bytes} B')
+    for label, fn in (('encode append (json + b64encode)', encode_before),
+                      ('encode append (template)', encode_after),
+                      ('decode delta (json + b64decode)', decode_before),
+                      ('decode delta (fast path)', decode_after)):
+        report(label, timeit.timeit(fn, number=args.n), args.n)
+
+
+@benchmark
+def bench_dispatch(args):
+    """ Per-message cost of routing server events: if/elif chain vs dispatch table, typed events, skipped frames. """
+    from Events import Dispatcher
+
+    def frame(event_type, **fields):
+        return json.dumps({'type': event_type, 'event_id': 'event_123', **fields}, separators=(',', ':'))
+
+    part = {'response_id': 'resp_123', 'item_id': 'item_123', 'output_index': 0, 'content_index': 0}
+    transcript_delta = frame('response.audio_transcript.delta', delta='Hello there, ', **part)
+    # One second of a spoken response: ~4 audio deltas, a transcript delta per word or two, and the bookkeeping
+    mix = ([frame('response.audio.delta', delta=base64.b64encode(os.urandom(args.delta_bytes)).decode(), **part)] * 4
+           + [transcript_delta] * 6
+           + [frame('response.output_item.added', response_id='resp_123', output_index=0, item={'id': 'item_123'}),
+              frame('response.content_part.added', part={'type': 'audio'}, **part),
+              frame('rate_limits.updated', rate_limits=[{'name': 'tokens', 'remaining': 1000}]),
+              frame('response.done', response={'id': 'resp_123', 'output': []})])
+
+    def noop(message):
+        pass
+
+    def before(raw):
+        message = Codec.decode_event(raw)
+        event_type = message.get('type')
+        if event_type == 'response.audio.delta':
+            noop(message)
+        elif event_type == 'response.audio.done':
+            noop(message)
+        elif event_type == 'input_audio_buffer.speech_started':
+            noop(message)
+        elif event_type == 'response.created':
+            noop(message)
+        elif event_type == 'response.done':
+            noop(message)
+
+    internal = Dispatcher()
+    for event_type in ('response.audio.delta', 'response.audio.done', 'input_audio_buffer.speech_started',
+                       'response.created', 'response.done', 'rate_limits.updated', 'error'):
+        internal.on(event_type, noop, typed=False)
+
+    def after(raw):
+        if internal.handles(Codec.event_type(raw)):
+            internal.dispatch(Codec.decode_event(raw))
+
+    def fast(raw):
+        message = Codec.decode_audio_delta(raw)  # Realtime.handle_message: audio deltas skip the table
+        if message is not None:
+            noop(message)
+        elif internal.handles(Codec.event_type(raw)):
+            internal.dispatch(Codec.decode_event(raw))
+
+    subscribed = Dispatcher()
+    subscribed.on('response.audio_transcript.delta', noop)
+    decoded = Codec.decode_event(transcript_delta)
+
+    n = max(args.n // len(mix), 1)
+    print(f'{len(mix)}-frame mix ({args.delta_bytes} B audio deltas), per frame:')
+    for label, route in (('decode all + if/elif (before)', before), ('peek + dispatch table', after),
+                         ('audio fast path + dispatch table', fast)):
+        # Best of five: the audio deltas' base64 decode dominates and is noisy, the routing differences are small
+        report(label, min(timeit.repeat(lambda: [route(raw) for raw in mix], number=n, repeat=5)), n * len(mix))
+    small_delta = frame('response.audio.delta', delta=base64.b64encode(bytes(48)).decode(), **part)
+    print('48 B audio delta, so the routing shows, per frame:')
+    for label, route in (('decode + if/elif (before)', before), ('peek + dispatch table', after),
+                         ('audio fast path', fast)):
+        report(label, min(timeit.repeat(lambda: route(small_delta), number=args.n, repeat=5)), args.n)
+    print('transcript delta, per frame:')
+    report('decode (before)', timeit.timeit(lambda: Codec.decode_event(transcript_delta), number=args.n), args.n)
+    report('peek, nobody subscribed', timeit.timeit(lambda: internal.handles(Codec.event_type(transcript_delta)),
+                                                    number=args.n), args.n)
+    report('dispatch, dict handler', timeit.timeit(lambda: internal.dispatch(decoded), number=args.n), args.n)
+    report('dispatch, typed handler', timeit.timeit(lambda: subscribed.dispatch(decoded), number=args.n), args.n)
+
+
+@benchmark
+def bench_transcripts(args):
+    """ Per-delta cost of accumulating a long transcript: string concatenation vs the Transcripts part lists. """
+    from Transcripts import Transcripts
+
+    delta = {'type': 'response.audio_transcript.delta', 'response_id': 'resp_1', 'item_id': 'item_1',
+             'output_index': 0, 'content_index': 0, 'delta': ' word'}
+
+    def before():
+        texts = {}
+        for _ in range(args.n):
+            key = (delta['item_id'], delta['content_index'])
+            texts[key] = texts.get(key, '') + delta['delta']  # A copy of everything so far, per delta
+
+    def after():
+        transcripts = Transcripts()
+        for _ in range(args.n):
+            transcripts.on_speech_delta(delta)
+        return transcripts.get('item_1').text
+
+    print(f'{args.n} deltas into one transcript:')
+    report('concatenate (before)', timeit.timeit(before, number=1), args.n)
+    report('Transcripts, joined once at the end', timeit.timeit(after, number=1), args.n)
+
+
+@benchmark
+def bench_conversation(args):
+    """ Conversation size over a long call with and without a token budget, and the per-event cost of tracking it. """
+    from Conversation import Conversation
+
+    mic_chunk = bytes(args.chunk_bytes)
+    delta = {'type': 'response.audio.delta', 'item_id': None, 'audio': bytes(args.delta_bytes)}
+    turns = 100
+
+    def call(conversation):
+        """ `turns` exchanges of ~3 s user audio and ~2 s model audio; returns events handled. """
+        events = 0
+        for turn in range(turns):
+            user_id, assistant_id = f'item_user_{turn}', f'item_assistant_{turn}'
+            for _ in range(3 * 48000 // args.chunk_bytes):
+                conversation.on_input_audio(mic_chunk)
+            conversation.on_committed({'item_id': user_id})
+            conversation.on_item_created({'item': {'id': user_id, 'type': 'message', 'role': 'user'}})
+            conversation.on_input_transcript({'item_id': user_id, 'transcript': 'What is the weather like today?'})
+            conversation.on_item_created({'item': {'id': assistant_id, 'type': 'message', 'role': 'assistant'}})
+            delta['item_id'] = assistant_id
+            for _ in range(2 * 48000 // args.delta_bytes):
+                conversation.on_audio_delta(delta)
+            conversation.on_item_done({'item': {'id': assistant_id, 'type': 'message', 'role': 'assistant',
+                                                'content': [{'type': 'audio', 'transcript': 'Sunny. ' * 20}]}})
+            conversation.on_response_done({'response': {}})
+            events += 3 * 48000 // args.chunk_bytes + 2 * 48000 // args.delta_bytes + 6
+        return events
+
+    print(f'{turns} turns:')
+    print(f'{"":<28} {"items":>6} {"tokens":>7} {"evicted":>7} {"us/event":>9}')
+    for label, options in (('no budget', {}), ('max_tokens=2000', {'max_tokens': 2000}),
+                           ('max_tokens=2000, spill', {'max_tokens': 2000, 'spill': True})):
+        deletes = []
+        conversation = Conversation(send=deletes.append, **options)
+        started_at = time.perf_counter()
+        events = call(conversation)
+        elapsed = time.perf_counter() - started_at
+        for message in deletes:  # The server's acknowledgements
+            conversation.on_item_deleted(message)
+        print(f'{label:<28} {len(conversation.items):>6} {conversation.tokens:>7} {conversation.evicted:>7} '
+              f'{elapsed / events * 1e6:>9.2f}')
+        conversation.close()
+
+
+@benchmark
+def bench_timeline(args):
+    """ Cost of finding the item at a playback position: linear scan of tagged items vs PlaybackTimeline. """
+    from PlaybackTimeline import PlaybackTimeline, SEGMENTS
+
+    chunk_bytes = 2048
+    dac_time, current_time = 1.02, 1.0
+    for segments in (16, SEGMENTS):
+        timeline = PlaybackTimeline(24000)
+        tagged = []
+        for i in range(segments):
+            timeline.tag(i * 96000, f'item_{i}')  # 2 s of audio per item
+            tagged.append((i * 96000, f'item_{i}', 0))
+        pos = (segments - 1) * 96000 + 1000
+
+        def scan():
+            playing = None
+            for start_pos, item_id, content_index in tagged:
+                if start_pos <= pos:
+                    playing = (start_pos, item_id, content_index)
+            return playing
+
+        print(f'{segments} tagged items:')
+        report('linear scan (before)', timeit.timeit(scan, number=args.n), args.n)
+        report('PlaybackTimeline.locate', timeit.timeit(lambda: timeline.locate(pos), number=args.n), args.n)
+
+    for i in range(64):
+        timeline.on_callback(i * chunk_bytes, chunk_bytes, dac_time, current_time)
+    report('PlaybackTimeline.on_callback', timeit.timeit(
+        lambda: timeline.on_callback(0, chunk_bytes, dac_time, current_time), number=args.n), args.n)
+    report('PlaybackTimeline.audible', timeit.timeit(timeline.audible, number=args.n), args.n)
+
+
+@benchmark
+def bench_aec(args):
+    """ EchoCanceller CPU per 1024-frame block at 24 kHz against its real-time budget, plus echo suppression (ERLE). """
+    import numpy as np
+    from EchoCanceller import EchoCanceller
+
+    block, rate, blocks = 1024, 24000, args.blocks
+    rng = np.random.default_rng(0)
+    impulse = np.zeros(rate // 10)  # 100 ms room: 10 ms direct-path delay, then a decaying tail
+    impulse[240:] = rng.standard_normal(len(impulse) - 240) * np.exp(-np.arange(len(impulse) - 240) / 400) * 0.1
+    far = rng.standard_normal(block * blocks) * 3000
+    mic = np.clip(np.convolve(far, impulse)[:len(far)] + rng.standard_normal(len(far)) * 10, -32768, 32767)
+
+    for filter_ms in (85, 170, 340):
+        aec = EchoCanceller(block, rate, filter_ms=filter_ms)
+        out = np.empty_like(mic)
+        for i in range(blocks):
+            span = slice(i * block, (i + 1) * block)
+            processed = aec.process(mic[span].astype('<i2').tobytes(), far[span].astype('<i2').tobytes())
+            out[span] = np.frombuffer(processed, dtype='<i2')
+        settled = slice(blocks // 2 * block, None)
+        erle = 10 * np.log10(np.mean(mic[settled] ** 2) / np.mean(out[settled] ** 2))
+        stats = aec.stats()
+        print(f'filter {filter_ms:>3} ms ({stats["partitions"]} partitions): {stats["mean_us"]:8.1f} us/block mean, '
+              f'{stats["max_us"]:8.1f} max, {stats["load"] * 100:5.2f}% of {stats["budget_us"]:.0f} us budget, '
+              f'ERLE {erle:5.1f} dB')
+
+
+@benchmark
+def bench_formats(args):
+    """ CPU per second of audio and bytes on the wire for pcm16 vs G.711, including resampling 24 kHz <-> 8 kHz. """
+    import numpy as np
+    import G711
+    from Resampler import Resampler
+
+    rate, chunk = 24000, 1024
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(rate * args.seconds_of_audio) * 3000).astype('<i2').tobytes()
+    chunks = [pcm[i:i + chunk * 2] for i in range(0, len(pcm), chunk * 2)]
+
+    print(f'{"format":<10} {"up CPU ms/s":>12} {"down CPU ms/s":>14} {"bytes/s on wire":>16}')
+    for fmt in ('pcm16', 'g711_ulaw', 'g711_alaw'):
+        mic_resampler = Resampler(rate, G711.RATE) if fmt != 'pcm16' else None
+        spkr_resampler = Resampler(G711.RATE, rate) if fmt != 'pcm16' else None
+
+        started_at, frames = time.process_time(), []
+        for c in chunks:
+            if mic_resampler:
+                c = G711.encode(mic_resampler.process(c), fmt)
+            frames.append(Codec.encode_audio_append(c))
+        up = time.process_time() - started_at
+
+        deltas = [b'{"type":"response.audio.delta","item_id":"item_1","delta":"' + f[len(Codec.AUDIO_APPEND_PREFIX):-2] + b'"}' for f in frames]
+        started_at = time.process_time()
+        for d in deltas:
+            audio = Codec.audio_of(Codec.decode_event(d))
+            if spkr_resampler:
+                audio = spkr_resampler.process(G711.decode(audio, fmt))
+        down = time.process_time() - started_at
+
+        wire = sum(len(f) for f in frames) / args.seconds_of_audio
+        print(f'{fmt:<10} {up / args.seconds_of_audio * 1000:>12.2f} {down / args.seconds_of_audio * 1000:>14.2f} '
+              f'{wire:>16.0f}')
+
+
+@benchmark
+def bench_resample(args):
+    """ Device <-> 24 kHz mono PCM16 conversion throughput, as real-time streams per core. """
+    import numpy as np
+    from Resampler import StreamConverter
+
+    session_rate, seconds = 24000, args.seconds_of_audio
+    cases = [
+        (8000, 1, 'int16'), (16000, 1, 'int16'), (44100, 1, 'int16'),
+        (48000, 1, 'int16'), (48000, 2, 'float32'), (44100, 2, 'float32'),
+    ]
+    print(f'{"device":<22} {"capture us/chunk":>17} {"playback us/chunk":>18} {"streams/core":>13}')
+    for rate, channels, fmt in cases:
+        chunk = round(1024 * rate / session_rate)
+        rng = np.random.default_rng(0)
+        device = rng.standard_normal(chunk * channels) * 0.1
+        device = (device * 32767).astype('<i2') if fmt == 'int16' else device.astype('<f4')
+        device = device.tobytes()
+        session = (rng.standard_normal(1024) * 3000).astype('<i2').tobytes()
+        capture = StreamConverter(rate, session_rate, in_channels=channels, in_format=fmt)
+        playback = StreamConverter(session_rate, rate, out_channels=channels, out_format=fmt)
+
+        chunks = int(seconds * session_rate / 1024)
+        started_at = time.process_time()
+        for _ in range(chunks):
+            capture.process(device)
+        capture_s = time.process_time() - started_at
+        started_at = time.process_time()
+        for _ in range(chunks):
+            playback.process(session)
+        playback_s = time.process_time() - started_at
+
+        audio_s = chunks * 1024 / session_rate
+        print(f'{f"{rate} Hz x{channels} {fmt}":<22} {capture_s / chunks * 1e6:>17.1f} {playback_s / chunks * 1e6:>18.1f} '
+              f'{audio_s / (capture_s + playback_s):>13.0f}')
+
+
+class StampedSource:
+    """
+    Mic source whose chunks start with (session, sequence) so the server can time each one's arrival.
+
+    Each bit of the stamp is a whole sample at +/-STAMP_LEVEL, so the small changes the echo
+    canceller makes to the mic signal cannot turn one chunk's stamp into another's.
+    """
+
+    STAMP_LEVEL = 8192
+    STAMP_BYTES = 64 * 2
+
+    def __init__(self, session, captured):
+        self.session = session
+        self.captured = captured  # (session, seq) -> capture time
+        self.seq = 0
+
+    def read(self, frame_count):
+        self.seq += 1
+        self.captured[(self.session, self.seq)] = time.monotonic()
+        bits = [(value >> i) & 1 for value in (self.session, self.seq) for i in range(32)]
+        stamp = struct.pack('<64h', *(self.STAMP_LEVEL if bit else -self.STAMP_LEVEL for bit in bits))
+        return stamp + bytes(frame_count * 2 - self.STAMP_BYTES)
+
+    @classmethod
+    def stamps(cls, pcm, chunk_bytes):
+        """ The (session, seq) of each chunk in a batch of `chunk_bytes`-long chunks. """
+        for offset in range(0, len(pcm) - cls.STAMP_BYTES + 1, chunk_bytes):
+            samples = struct.unpack_from('<64h', pcm, offset)
+            yield tuple(sum(1 << i for i, sample in enumerate(samples[word * 32:word * 32 + 32]) if sample > 0)
+                        for word in (0, 1))
+
+
+@benchmark
+def bench_logging(args):
+    """ Logging cost per audio frame (one delta received + one mic chunk sent): old per-chunk f-string logs vs Telemetry. """
+    import Telemetry
+
+    mic_frame = Codec.encode_audio_append(os.urandom(args.chunk_bytes))
+    delta_raw = json.dumps({
+        'type': 'response.audio.delta', 'event_id': 'event_123', 'response_id': 'resp_123',
+        'item_id': 'item_123', 'output_index': 0, 'content_index': 0,
+        'delta': base64.b64encode(os.urandom(args.delta_bytes)).decode('utf-8'),
+    }, separators=(',', ':'))
+    socket_log, realtime_log, audio_io_log = (logging.getLogger(name) for name in ('Socket', 'Realtime', 'AudioIO'))
+    audio_log = Telemetry.audio_log
+    samplers = [Telemetry.Sampler() for _ in range(3)]
+
+    def before():
+        # What Socket / Realtime / AudioIO logged per frame before Telemetry, all at INFO
+        logging.info(f'Received message: {delta_raw}')
+        logging.info('Received message type: response.audio.delta')
+        logging.info(f'Received {args.delta_bytes} bytes of audio data.')
+        logging.info(f'🎤 Processing {args.chunk_bytes} bytes of audio data.')
+        logging.info(f'🎤 Sending {args.chunk_bytes} bytes of audio data to socket.')
+        logging.info(f'Sent message: {mic_frame}')
+
+    def after():
+        socket_log.debug('Received message: %s', Telemetry.Payload(delta_raw))
+        realtime_log.debug('Received message type: %s', 'response.audio.delta')
+        if samplers[0]():
+            audio_log.info('Received %d bytes of audio data.', args.delta_bytes, extra={'bytes': args.delta_bytes})
+        if samplers[1]():
+            audio_io_log.info('🎤 Processing %d bytes of audio data.', args.chunk_bytes, extra={'bytes': args.chunk_bytes})
+        if samplers[2]():
+            audio_log.info('🎤 Sending %d bytes of audio data to socket.', args.chunk_bytes, extra={'bytes': args.chunk_bytes})
+        socket_log.debug('Sent message: %s', Telemetry.Payload(mic_frame))
+
+    print(f'mic chunk {args.chunk_bytes} B, delta {args.delta_bytes} B; records written to {os.devnull}')
+    with open(os.devnull, 'w') as devnull:
+        for label, fn, settings in (
+                ('before: INFO, full messages', before, {}),
+                ('after: INFO (sampled audio channel)', after, {}),
+                ('after: INFO, audio channel off', after, {'audio_level': logging.WARNING}),
+                ('after: DEBUG, redacted wire logs', after, {'level': logging.DEBUG}),
+                ('after: DEBUG, structured (JSON)', after, {'level': logging.DEBUG, 'structured': True}),
+                ('after: DEBUG, full payloads', after, {'level': logging.DEBUG, 'payloads': 'full', 'max_payload': 0})):
+            Telemetry.configure(stream=devnull, **settings)
+            report(label, min(timeit.repeat(fn, number=args.n, repeat=5)), args.n)  # Best of five: shared machines
+        print(f'audio records suppressed by the rate limit: {Telemetry.audio_filter.suppressed_total}')
+    Telemetry.configure(level=logging.WARNING)
+
+
+@benchmark
+def bench_metrics(args):
+    """ Metrics overhead: metric updates made by one Realtime session against its measured CPU, plus export cost. """
+    from AudioBackends import ClockedBackend, NullSink
+    from AudioIO import CHUNK_SIZE, RATE
+    from Metrics import Counter, Histogram, LATENCY_BUCKETS
+    from MockServer import MockServer
+    from Realtime import Realtime
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = MockServer(jitter_ms=args.jitter_ms, response_ms=args.response_ms)
+    url = server.start()
+    try:
+        session = Realtime('test-key', url, audio_backend=ClockedBackend(sink=NullSink()))
+        cpu_at, wall_at = time.process_time(), time.monotonic()
+        session.start()
+        deadline = wall_at + args.seconds
+        while time.monotonic() < deadline:
+            time.sleep(min(args.turn_s, max(0.0, deadline - time.monotonic())))
+            session.create_response({'modalities': ['audio', 'text']})
+        cpu = time.process_time() - cpu_at
+        wall = time.monotonic() - wall_at
+        session.stop()
+    finally:
+        server.stop()
+
+    metrics = session.metrics
+    mic_callbacks = wall * RATE / CHUNK_SIZE
+    updates = sum(m.count for m in metrics.metrics.values() if isinstance(m, Histogram))
+    updates += 2 * metrics.counter('messages_received_total').value + session.socket.sent_count + mic_callbacks
+
+    histogram, counter = Histogram('h', buckets=LATENCY_BUCKETS), Counter('c')
+    observe = timeit.timeit(lambda: histogram.observe(0.003), number=args.n) / args.n
+    inc = timeit.timeit(lambda: counter.inc(1), number=args.n) / args.n
+    export = timeit.timeit(metrics.prometheus_text, number=100) / 100
+
+    print(f'{wall:.1f} s session, {cpu / wall * 100:.2f}% CPU (including the in-process mock server)')
+    print(f'metric updates: {updates:.0f} ({updates / wall:.0f}/s); observe {observe * 1e6:.2f} us, inc {inc * 1e6:.2f} us')
+    print(f'instrumentation overhead: {updates * max(observe, inc) / cpu * 100:.3f}% of session CPU')
+    print(f'prometheus_text: {export * 1e3:.2f} ms for {len(metrics.prometheus_text().splitlines())} lines')
+    snapshot = metrics.snapshot()
+    for name in ('first_delta_seconds', 'response_seconds', 'send_delay_seconds', 'recv_dispatch_seconds',
+                 'playback_buffer_seconds'):
+        summary = snapshot[name]
+        print(f'{name:<28} n={summary["count"]:<6} p50 {summary["p50"] * 1000:8.2f} ms  p95 {summary["p95"] * 1000:8.2f} ms')
+    for name in ('playback_underruns_total', 'mic_suppressed_seconds_total', 'send_queue_depth', 'mic_queue_depth'):
+        print(f'{name:<28} {snapshot[name]}')
+
+
+@benchmark
+def bench_reconnect(args):
+    """ Realtime against a MockServer that aborts every connection periodically: downtime, replay and mic delivery. """
+    from AudioBackends import ClockedBackend, NullSink
+    from AudioIO import CHUNK_SIZE
+    from MockServer import MockServer
+    from Realtime import Realtime
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    chunk_bytes = CHUNK_SIZE * 2
+    captured = {}
+    delivered = {}
+
+    def on_append(pcm, arrived_at):
+        for stamp in StampedSource.stamps(pcm, chunk_bytes):
+            delivered[stamp] = delivered.get(stamp, 0) + 1
+
+    print(f'connections aborted every {args.drop_every_s} s for {args.seconds} s')
+    print(f'{"stale audio":>11} {"drops":>5} {"downtime p50/max ms":>20} {"replayed":>8} {"mic delivered":>13} '
+          f'{"dropped stale":>13} {"duplicates":>10}')
+    for policy in ('drop', 'keep'):
+        captured.clear()
+        delivered.clear()
+        server = MockServer(on_append=on_append, response_ms=args.response_ms, drop_every_s=args.drop_every_s)
+        url = server.start()
+        reconnects = []
+        try:
+            # Echo cancellation keeps the mic open during playback, so every captured chunk is meant to be sent
+            session = Realtime('test-key', url, echo_cancel=True, socket_options={'stale_audio': policy},
+                               audio_backend=ClockedBackend(StampedSource(0, captured), NullSink()))
+            session.on_reconnect = reconnects.append
+            session.start()
+            session.add_item({'type': 'message', 'role': 'user', 'content': [{'type': 'input_text', 'text': 'Hi'}]})
+            time.sleep(args.seconds)
+            session.stop()
+            time.sleep(0.2)  # Let the server read what was sent last
+        finally:
+            server.stop()
+
+        downtime = [r['downtime_s'] * 1000 for r in reconnects]
+        d50, _, dmax = percentiles(downtime)
+        replayed = sum(r['replayed'] for r in reconnects)
+        expected = len(captured) - 2  # The last chunk or two may still be queued at stop()
+        received = sum(1 for stamp in captured if stamp in delivered)
+        duplicates = sum(n - 1 for n in delivered.values())
+        print(f'{policy:>11} {server.dropped:>5} {d50:>10.1f} /{dmax:>7.1f} {replayed:>8} '
+              f'{received / expected * 100:>12.1f}% {session.socket.audio_dropped:>13} {duplicates:>10}')
+    print('Mic chunks written into a connection just before it was aborted are lost with it.')
+
+
+@benchmark
+def bench_stall(args):
+    """ Realtime whose socket stops writing for --stall-s: queue growth, what each overflow policy discards, recovery. """
+    from AudioBackends import ClockedBackend, NullSink
+    from AudioIO import CHUNK_SIZE
+    from MockServer import MockServer
+    from Realtime import Realtime
+    from Socket import Socket
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    chunk_bytes = CHUNK_SIZE * 2
+    captured = {}
+    arrivals = {}  # (session, seq) -> mic-to-wire seconds
+
+    def on_append(pcm, arrived_at):
+        for stamp in StampedSource.stamps(pcm, chunk_bytes):
+            if stamp in captured:
+                arrivals[stamp] = arrived_at - captured[stamp]
+
+    stalled = threading.Event()
+
+    class StallingSocket(Socket):
+        def _open(self):
+            ws = super()._open()
+            send = ws.send
+
+            def stalling_send(*a, **kw):
+                while stalled.is_set():  # A peer that stops reading: the writer blocks in send()
+                    time.sleep(0.01)
+                return send(*a, **kw)
+            ws.send = stalling_send
+            return ws
+
+    class StallingRealtime(Realtime):
+        def _make_socket(self, api_key, ws_url):
+            return StallingSocket(api_key, ws_url, on_msg=self.handle_message, metrics=self.metrics,
+                                  **self.socket_options)
+
+    cases = [
+        ('unbounded', {'send_queue_size': 1 << 30, 'audio_deadline_ms': None}, {'mic_deadline_ms': None}),
+        ('drop_oldest', {'send_overflow': 'drop_oldest'}, {}),
+        ('drop_newest', {'send_overflow': 'drop_newest'}, {}),
+        ('coalesce', {'send_overflow': 'coalesce'}, {}),
+        ('block', {'send_overflow': 'block'}, {}),
+    ]
+    print(f'writer stalled for {args.stall_s} s of {args.seconds} s, send queue bound {args.send_queue_size}')
+    print(f'{"send policy":>11} {"high water":>10} {"dropped":>7} {"expired":>7} {"coalesced":>9} {"mic lost":>8} '
+          f'{"delivered":>9} {"after stall p50/p95 ms":>23}')
+    for label, socket_options, audio_options in cases:
+        captured.clear()
+        arrivals.clear()
+        socket_options.setdefault('send_queue_size', args.send_queue_size)
+        server = MockServer(on_append=on_append, response_ms=args.response_ms)
+        url = server.start()
+        try:
+            session = StallingRealtime('test-key', url, echo_cancel=True, socket_options=socket_options,
+                                       audio_options=audio_options,
+                                       audio_backend=ClockedBackend(StampedSource(0, captured), NullSink()))
+            session.start()
+            time.sleep((args.seconds - args.stall_s) / 2)
+            stalled.set()
+            time.sleep(args.stall_s)
+            stalled.clear()
+            resumed_at = time.monotonic()
+            time.sleep((args.seconds - args.stall_s) / 2)
+            session.stop()
+            time.sleep(0.2)  # Let the server read what was sent last
+        finally:
+            stalled.clear()
+            server.stop()
+
+        send, mic = session.socket.queue_stats(), session.audio_io.mic_queue.stats()
+        after = [arrivals[stamp] * 1000 for stamp in arrivals if captured[stamp] + arrivals[stamp] >= resumed_at]
+        a50, a95, _ = percentiles(after)
+        expected = len(captured) - 2  # The last chunk or two may still be queued at stop()
+        print(f'{label:>11} {send["high_water"]:>10} {send["dropped"]:>7} {send["expired"]:>7} {send["coalesced"]:>9} '
+              f'{mic["dropped"] + mic["expired"]:>8} {len(arrivals) / expected * 100:>8.1f}% '
+              f'{a50:>11.1f} /{a95:>9.1f}')
+    print('"after stall" is mic-to-wire delay of audio arriving once the writer resumes: how stale the backlog is.')
+
+
+@benchmark
+def bench_tools(args):
+    """ A slow tool called while response audio streams: run inline on the reader vs on the worker pool. """
+    import concurrent.futures
+    from AudioBackends import ClockedBackend, NullSink
+    from MockServer import MockServer
+    from Realtime import Realtime
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    class InlineExecutor(concurrent.futures.Executor):
+        """ Runs the tool in submit(), i.e. on the socket's reader, as handling it in handle_message would. """
+
+        def submit(self, fn, *a, **kw):
+            future = concurrent.futures.Future()
+            future.set_result(fn(*a, **kw))
+            return future
+
+    def lookup(city):
+        time.sleep(args.tool_ms / 1000)  # A slow HTTP call, say
+        return {'city': city, 'temperature_c': 21}
+
+    print(f'tool takes {args.tool_ms} ms; an audio response streams at the same time')
+    print(f'{"runner":>8} {"tool round trip ms":>18} {"first audio ms":>14} {"reader blocked max ms":>21} '
+          f'{"outputs":>7} {"responses":>9}')
+    for label, executor in (('inline', InlineExecutor()), ('pool', None)):
+        server = MockServer(response_ms=args.response_ms, tool_call={'name': 'lookup', 'arguments': {'city': 'Oslo'}})
+        url = server.start()
+        arrivals = []
+        try:
+            session = Realtime('test-key', url, audio_backend=ClockedBackend(sink=NullSink()),
+                               tool_options={'executor': executor})
+            session.tools.register(lookup, parameters={'type': 'object', 'properties': {'city': {'type': 'string'}}})
+            session.on('response.audio.delta', lambda event: arrivals.append(time.monotonic()), typed=False)
+            session.start()  # The first response.create is answered with the function call...
+            requested_at = time.monotonic()
+            session.create_response()  # ...and this one with audio, streaming while the tool runs
+            time.sleep(args.response_ms / 1000 * 2 + args.tool_ms / 1000 + 0.5)
+            session.stop()
+        finally:
+            server.stop()
+
+        snapshot = session.metrics.snapshot()
+        round_trip = snapshot['tool_seconds']['mean'] * 1000
+        first_audio = (arrivals[0] - requested_at) * 1000 if arrivals else float('nan')
+        blocked = snapshot['recv_dispatch_seconds']['max'] * 1000
+        print(f'{label:>8} {round_trip:>18.0f} {first_audio:>14.0f} {blocked:>21.1f} '
+              f'{len(server.tool_outputs):>7} {server.responses:>9}')
+    print('First audio is for the response requested alongside the tool call; the server starts it within ~50 ms.')
+
+
+@benchmark
+def bench_pool(args):
+    """ SessionPool.acquire() latency from pre-warmed connections vs cold connects, against a slow-handshake mock. """
+    import asyncio
+    from AudioBackends import ClockedBackend, NullSink
+    from MockServer import MockServer
+    from SessionPool import SessionPool
+
+    logging.getLogger().setLevel(logging.WARNING)
+    server = MockServer(handshake_ms=args.handshake_ms)
+    url = server.start()
+
+    async def acquire_times(warm_sessions):
+        pool = SessionPool('test-key', url, warm_sessions=warm_sessions,
+                           session_kwargs=lambda: {'audio_backend': ClockedBackend(sink=NullSink())})
+        times = []
+        for _ in range(args.sessions):
+            await pool.warm_up()
+            started_at = time.monotonic()
+            await pool.acquire()
+            times.append(time.monotonic() - started_at)
+        stats = pool.stats()
+        await pool.close()
+        return times, stats
+
+    print(f'{args.handshake_ms} ms handshakes, {args.sessions} sessions acquired one after another:')
+    print(f'{"":<10} {"acquire p50/p95 ms":>20} {"warm hits":>9} {"cold starts":>11}')
+    try:
+        for label, warm_sessions in (('cold', 0), ('warm', 2)):
+            times, stats = asyncio.run(acquire_times(warm_sessions))
+            p50, p95, _ = percentiles(times)
+            print(f'{label:<10} {p50 * 1000:>10.1f} /{p95 * 1000:>7.1f} {stats["warm_hits"]:>9} {stats["cold_starts"]:>11}')
+    finally:
+        server.stop()
+
+@benchmark
+def bench_replay(args):
+    """ Record a session against the MockServer, then replay the recording at 1x and faster. """
+    import tempfile
+    import Recording
+    from AudioBackends import ClockedBackend, NullSink
+    from MockServer import MockServer
+    from Realtime import Realtime
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    path = os.path.join(tempfile.mkdtemp(), 'session.rec')
+    server = MockServer(jitter_ms=args.jitter_ms, response_ms=args.response_ms)
+    url = server.start()
+    try:
+        session = Realtime('test-key', url, echo_cancel=True, audio_backend=ClockedBackend(sink=NullSink()),
+                           record=path)
+        session.start()
+        time.sleep(args.seconds)
+        session.stop()
+    finally:
+        server.stop()
+
+    info = Recording.summary(path)
+    pcm = sum(info['bytes'].get(kind, 0) for kind in ('sent_audio', 'received_audio'))
+    print(f'recorded {info["duration_s"]:.1f} s: {sum(info["records"].values())} records, '
+          f'{os.path.getsize(path) / 1024:.0f} KiB ({pcm / 1024:.0f} KiB of it wire audio, '
+          f'~{pcm * 4 / 3 / 1024:.0f} KiB as base64)')
+    recorder = Recording.Recorder(os.path.join(os.path.dirname(path), 'scratch.rec'))
+    chunk = bytes(args.chunk_bytes)
+    report('Recorder.mic() on the audio callback', timeit.timeit(lambda: recorder.mic(chunk), number=args.n), args.n)
+    recorder.close()
+
+    print(f'{"speed":>5} {"wall s":>7} {"frames":>6} {"appends":>7} {"underruns":>9} {"reader max ms":>13}')
+    for speed in (1, 4):
+        started_at = time.monotonic()
+        replayed, server = Recording.replay(path, speed=speed, echo_cancel=True)
+        snapshot = replayed.metrics.snapshot()
+        print(f'{speed:>5} {time.monotonic() - started_at:>7.1f} {server.replayed:>6} {server.appends:>7} '
+              f'{snapshot["playback_underruns_total"]:>9} {snapshot["recv_dispatch_seconds"]["max"] * 1000:>13.2f}')
+
+
+@benchmark
+def bench_e2e(args):
+    """ Realtime against the local MockServer: mic-to-wire, first-audio-byte, underruns and CPU for 1..N sessions. """
+    from AudioBackends import ClockedBackend, NullSink
+    from AudioIO import CHUNK_SIZE
+    from MockServer import MockServer
+    from Realtime import Realtime
+
+    logging.getLogger().setLevel(logging.WARNING)
+    chunk_bytes = CHUNK_SIZE * 2
+    captured = {}
+    mic_to_wire = []
+
+    def on_append(pcm, arrived_at):
+        for stamp in StampedSource.stamps(pcm, chunk_bytes):
+            captured_at = captured.pop(stamp, None)
+            if captured_at is not None:
+                mic_to_wire.append(arrived_at - captured_at)
+
+    class BenchRealtime(Realtime):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.requested_at = None
+            self.first_audio = []
+
+        def request_response(self):
+            self.requested_at = time.monotonic()
+            self.create_response({'modalities': ['audio', 'text']})
+
+        def _send_initial_request(self):
+            self.request_response()
+
+        def handle_message(self, message):
+            if message.get('type') == 'response.audio.delta' and self.requested_at is not None:
+                self.first_audio.append(time.monotonic() - self.requested_at)
+                self.requested_at = None
+            super().handle_message(message)
+
+    server = MockServer(on_append=on_append, jitter_ms=args.jitter_ms, response_ms=args.response_ms)
+    url = server.start()
+    print(f'{"sessions":>8} {"mic->wire p50/p95/max ms":>26} {"first audio p50/p95 ms":>24} '
+          f'{"underruns":>9} {"CPU %/session":>13}')
+    try:
+        for count in session_counts(args.sessions):
+            captured.clear()
+            mic_to_wire.clear()
+            sessions = [BenchRealtime('test-key', url, audio_backend=ClockedBackend(StampedSource(i, captured), NullSink()))
+                        for i in range(count)]
+
+            cpu_at, wall_at = time.process_time(), time.monotonic()
+            for session in sessions:
+                session.start()
+            deadline = wall_at + args.seconds
+            while time.monotonic() < deadline:
+                time.sleep(min(args.turn_s, max(0.0, deadline - time.monotonic())))
+                for session in sessions:
+                    session.request_response()
+            cpu = time.process_time() - cpu_at
+            wall = time.monotonic() - wall_at
+            for session in sessions:
+                session.stop()
+
+            first_audio = [t for s in sessions for t in s.first_audio]
+            m50, m95, mmax = percentiles(mic_to_wire)
+            f50, f95, _ = percentiles(first_audio)
+            underruns = sum(s.audio_io.underruns for s in sessions)
+            print(f'{count:>8} {m50 * 1000:>10.2f} /{m95 * 1000:>6.2f} /{mmax * 1000:>6.2f} '
+                  f'{f50 * 1000:>13.2f} /{f95 * 1000:>8.2f} {underruns:>9} {cpu / wall / count * 100:>13.2f}')
+    finally:
+        server.stop()
+    print('CPU includes the in-process mock server.')
+
+
+@benchmark
+def bench_sharding(args):
+    """ Sessions with echo cancellation and VAD: all in one process vs spread over worker processes. """
+    from AudioBackends import ClockedBackend, NullSink, PcmSource
+    from MockServer import MockServer
+    from Realtime import Realtime
+    from ShardedRunner import ShardedRunner
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    noise = os.urandom(24000 * 2)  # Loud enough that VAD passes it and the echo canceller has work to do
+    options = {'echo_cancel': True, 'vad': True}
+    workers = args.workers or os.cpu_count()
+    server = MockServer(response_ms=args.response_ms)
+    url = server.start()
+    print(f'{os.cpu_count()} CPUs, {workers} workers; CPU includes the in-process mock server')
+    print(f'{"mode":>8} {"sessions":>8} {"CPU cores":>9} {"late callbacks":>14} {"mic dropped":>11} {"underruns":>9}')
+    sustained = {'single': 0, 'sharded': 0}  # Most sessions run with no late callback and no mic audio dropped
+    try:
+        for count in session_counts(args.sessions):
+            # Single process: every session's DSP, socket and callbacks share one GIL
+            sessions = [Realtime('test-key', url, audio_backend=ClockedBackend(PcmSource(noise, loop=True), NullSink()),
+                                 **options) for _ in range(count)]
+            cpu_at, wall_at = time.process_time(), time.monotonic()
+            for session in sessions:
+                session.start()
+            time.sleep(args.seconds)
+            cores = (time.process_time() - cpu_at) / (time.monotonic() - wall_at)
+            late = sum(stream.late_callbacks for session in sessions
+                       for stream in (session.audio_io.mic_stream, session.audio_io.spkr_stream))
+            dropped = sum(session.metrics.snapshot()['mic_queue_dropped_total']
+                          + session.metrics.snapshot()['mic_queue_expired_total'] for session in sessions)
+            underruns = sum(session.audio_io.underruns for session in sessions)
+            for session in sessions:
+                session.stop()
+            print(f'{"single":>8} {count:>8} {cores:>9.2f} {late:>14} {dropped:>11} {underruns:>9}')
+            if not late and not dropped:
+                sustained['single'] = count
+
+            # Sharded: the same sessions in worker processes, audio through shared-memory rings
+            runner = ShardedRunner('test-key', url, workers=workers, health_interval_s=3600)
+            runner.start()
+            try:
+                for _ in range(count):
+                    runner.add_session(PcmSource(noise, loop=True), NullSink(), **options)
+                runner.check_health()  # Starts each worker's CPU measurement
+                cpu_at, wall_at = time.process_time(), time.monotonic()
+                time.sleep(args.seconds)
+                runner.check_health()
+                cores = (time.process_time() - cpu_at) / (time.monotonic() - wall_at)
+                cores += sum(worker.load or 0.0 for worker in runner.workers)
+                reports = [session.report for session in runner.sessions.values()]
+                late = sum(report['late_callbacks'] for report in reports)
+                dropped = sum(report['mic_dropped'] for report in reports)
+                underruns = sum(report['playback_underruns'] for report in reports)
+            finally:
+                runner.close()
+            print(f'{"sharded":>8} {count:>8} {cores:>9.2f} {late:>14} {dropped:>11} {underruns:>9}')
+            if not late and not dropped:
+                sustained['sharded'] = count
+    finally:
+        server.stop()
+    print('Sessions sustained with no late callbacks and no mic drops: '
+          + ', '.join(f'{mode} {count}' for mode, count in sustained.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('name', nargs='?', choices=sorted(BENCHMARKS))
+    parser.add_argument('--list', action='store_true', help='List benchmarks and exit')
+    parser.add_argument('--n', type=int, default=20000, help='Iterations per measurement')
+    parser.add_argument('--chunk-bytes', type=int, default=2048, help='Mic chunk size (1024 frames of PCM16)')
+    parser.add_argument('--delta-bytes', type=int, default=9600, help='Decoded size of one audio delta')
+    parser.add_argument('--blocks', type=int, default=300, help='Audio blocks per DSP measurement')
+    parser.add_argument('--seconds-of-audio', type=int, default=60, help='Audio processed per format measurement')
+    parser.add_argument('--sessions', type=int, default=8, help='Max concurrent sessions for end-to-end runs')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each end-to-end run')
+    parser.add_argument('--turn-s', type=float, default=3, help='Seconds between response.create requests')
+    parser.add_argument('--response-ms', type=int, default=2000, help='Audio per mock response')
+    parser.add_argument('--jitter-ms', type=int, default=0, help='Max random delay per mock delta')
+    parser.add_argument('--drop-every-s', type=float, default=2, help='Mock server aborts all connections this often')
+    parser.add_argument('--tool-ms', type=int, default=800, help='How long the benchmark tool runs')
+    parser.add_argument('--stall-s', type=float, default=3, help='How long the socket writer stalls')
+    parser.add_argument('--send-queue-size', type=int, default=32, help='Send queue bound for stall runs')
+    parser.add_argument('--handshake-ms', type=int, default=50, help='Mock server handshake time for pool runs')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for sharding runs (default: CPUs)')
+    args = parser.parse_args()
+
+    if args.list or not args.name:
+        for name, fn in sorted(BENCHMARKS.items()):
+            print(f'{name:<16} {fn.__doc__.strip()}')
+        return
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == '__main__':
+    main()
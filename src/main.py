@@ -5,12 +5,16 @@ import logging
 from dotenv import load_dotenv
 
 from Realtime import Realtime
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+import Telemetry
 
 # Load environment variables from a .env file
 load_dotenv()
 
+# LOG_LEVEL=DEBUG adds per-message wire logs; LOG_FORMAT=json emits one JSON object per line;
+# LOG_PAYLOADS=full logs base64 audio as sent (redacted to its length by default)
+Telemetry.configure(level=os.getenv('LOG_LEVEL', 'INFO').upper(), structured=os.getenv('LOG_FORMAT') == 'json',
+                    payloads=os.getenv('LOG_PAYLOADS', Telemetry.PAYLOADS))
+
 quitFlag = False
 
 def signal_handler(sig, frame, realtime_instance):
@@ -38,7 +42,7 @@ def main():
             time.sleep(0.1)
 
     except Exception as e:
-        logging.error(f'Error in main loop: {e}')
+        logging.error('Error in main loop: %s', e)
         realtime.stop()
 
     finally:
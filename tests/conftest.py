@@ -0,0 +1,5 @@
+""" The modules live flat in src/ and import each other by name, as when run from there. """
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
@@ -0,0 +1,40 @@
+""" ClockedBackend refuses streams its mono PCM16 sources and sinks can't feed, and WAVs at the wrong rate. """
+import wave
+
+import pytest
+
+from AudioBackends import ClockedBackend, FileSource, FORMAT_FLOAT32, NullSink
+from AudioIO import AudioIO
+
+
+def write_wav(path, rate):
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(rate // 10 * 2))
+    return str(path)
+
+
+def test_a_wav_source_must_match_the_stream_rate(tmp_path):
+    source = FileSource(write_wav(tmp_path / 'in.wav', 16000))
+    assert source.rate == 16000
+    backend = ClockedBackend(source, NullSink())
+    with pytest.raises(ValueError, match='16000 Hz'):
+        backend.open_input(lambda *args: (None, 0), 24000, 1024)
+    assert backend.open_input(lambda *args: (None, 0), 16000, 1024).rate == 16000
+
+
+def test_a_raw_source_is_taken_at_the_stream_rate(tmp_path):
+    path = tmp_path / 'in.pcm'
+    path.write_bytes(bytes(4800))
+    source = FileSource(str(path))
+    assert source.rate is None
+    assert ClockedBackend(source).open_input(lambda *args: (None, 0), 24000, 1024).rate == 24000
+
+
+@pytest.mark.parametrize('options', [{'device_channels': 2}, {'format': FORMAT_FLOAT32}])
+def test_device_conversion_is_refused_rather_than_fed_mono_pcm16(options):
+    audio_io = AudioIO(backend=ClockedBackend(sink=NullSink()), **options)
+    with pytest.raises(ValueError, match='mono PCM16'):
+        audio_io.start_streams()
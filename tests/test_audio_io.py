@@ -0,0 +1,123 @@
+""" AudioIO's PortAudio callbacks, called directly: what the echo canceller is given, and what they allocate. """
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from AudioBackends import ClockedBackend, NullSink, FORMAT_FLOAT32
+from AudioIO import AudioIO, CHUNK_SIZE, ECHO_REFERENCE_CHUNKS
+
+
+def make_audio_io(chunk_size=CHUNK_SIZE, **kwargs):
+    return AudioIO(chunk_size=chunk_size, backend=ClockedBackend(sink=NullSink()), jitter_buffer=False, **kwargs)
+
+
+def speaker(audio_io):
+    out, _ = audio_io._spkr_callback(None, audio_io.chunk_size, None, None)
+    return bytes(out)
+
+
+def mic(audio_io):
+    audio_io._mic_callback(bytes(audio_io.chunk_size * 2), audio_io.chunk_size, None, None)
+
+
+def test_echo_reference_is_the_audio_played_over_the_same_period():
+    audio_io = make_audio_io(echo_cancel=True)
+    references = []
+    audio_io.echo_canceller.process = lambda block, reference: references.append(
+        None if reference is None else bytes(reference)) or block
+
+    mic(audio_io)  # Nothing played yet
+    played = []
+    for i in range(3):
+        audio_io.receive_audio(bytes([i + 1]) * (audio_io.chunk_size * 2))
+        played.append(speaker(audio_io))
+    for _ in range(3):
+        mic(audio_io)
+    assert references == [None] + played
+
+
+def test_echo_reference_keeps_the_newest_chunks_when_the_mic_falls_behind():
+    audio_io = make_audio_io(echo_cancel=True)
+    references = []
+    audio_io.echo_canceller.process = lambda block, reference: references.append(bytes(reference)) or block
+
+    played = []
+    for i in range(ECHO_REFERENCE_CHUNKS + 4):
+        audio_io.receive_audio(bytes([i + 1]) * (audio_io.chunk_size * 2))
+        played.append(speaker(audio_io))
+    for _ in range(ECHO_REFERENCE_CHUNKS - 1):
+        mic(audio_io)
+    assert references == played[-(ECHO_REFERENCE_CHUNKS - 1):]
+
+
+@pytest.mark.parametrize('playing', [True, False])
+def test_speaker_callback_does_not_copy_the_chunk(playing):
+    chunk_size = 8192  # Large enough that one copy per callback would dominate everything else
+    audio_io = make_audio_io(chunk_size, echo_cancel=True)
+    for _ in range(300):  # Let the timeline's history and the metrics reach their steady size
+        audio_io.receive_audio(bytes(chunk_size * 2))
+        speaker(audio_io)
+        mic(audio_io)
+
+    if playing:
+        audio_io.receive_audio(bytes(chunk_size * 2 * 20))
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(20):
+            audio_io._spkr_callback(None, chunk_size, None, None)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak - baseline < chunk_size * 2
+
+
+def make_device_audio_io(chunk_size=CHUNK_SIZE, **kwargs):
+    """ Session audio is mono PCM16; the device is stereo float32, so both callbacks go through the converters. """
+    return make_audio_io(chunk_size, format=FORMAT_FLOAT32, device_channels=2, **kwargs)
+
+
+def test_device_float_audio_round_trips_to_the_same_pcm():
+    mic_chunks = []
+    audio_io = make_device_audio_io(mic_sink=mic_chunks.append)
+    pcm = np.arange(-32768, 32768, 32, dtype='<i2')[:audio_io.chunk_size].tobytes()
+    audio_io.receive_audio(pcm)
+    device, _ = audio_io._device_spkr_callback(None, audio_io.chunk_size, None, None)
+    assert np.frombuffer(device, '<f4').min() == -1.0
+
+    audio_io.mic_on_at = 0  # Not muted by the playback
+    audio_io._device_mic_callback(bytes(device), audio_io.chunk_size, None, None)
+    assert mic_chunks == [pcm]
+
+
+def test_device_float_audio_past_full_scale_is_clipped():
+    mic_chunks = []
+    audio_io = make_device_audio_io(mic_sink=mic_chunks.append)
+    device = np.tile(np.array([[1.5, 1.5], [-1.5, -1.5]], dtype='<f4'), (audio_io.chunk_size // 2, 1))
+    audio_io._device_mic_callback(device.tobytes(), audio_io.chunk_size, None, None)
+    assert set(np.frombuffer(mic_chunks[0], '<i2')) == {32767, -32768}
+
+
+def test_device_callbacks_only_copy_the_mic_chunk_they_hand_on():
+    chunk_size = 8192
+    audio_io = make_device_audio_io(chunk_size, device_rate=48000, mic_sink=lambda chunk: None)
+    device_chunk = audio_io.device_chunk
+    device_mic = bytes(device_chunk * audio_io._device_frame_bytes)
+    time_info = {'current_time': 1.0, 'output_buffer_dac_time': 1.02}
+    for _ in range(50):
+        audio_io.receive_audio(bytes(chunk_size * 2))
+        audio_io._device_spkr_callback(None, device_chunk, time_info, None)
+        audio_io._device_mic_callback(device_mic, device_chunk, time_info, None)
+
+    audio_io.receive_audio(bytes(chunk_size * 2 * 20))
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(20):
+            audio_io._device_spkr_callback(None, device_chunk, time_info, None)
+            audio_io._device_mic_callback(device_mic, device_chunk, time_info, None)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak - baseline < chunk_size * 2 * 1.5
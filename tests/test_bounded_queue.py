@@ -0,0 +1,356 @@
+""" BoundedQueue overflow policies and deadline, alone and as the send queue of a stalled Socket or AsyncSocket. """
+import asyncio
+import base64
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+import Codec
+from AsyncSocket import AsyncSocket
+from BoundedQueue import AsyncBoundedQueue, BoundedQueue
+from Socket import Socket
+
+
+def is_audio(item):
+    return item.startswith('a')
+
+
+def drain(q):
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def fill(q, audio=8):
+    """ Two control items, then `audio` audio items, with nobody reading. """
+    q.put('c1')
+    q.put('c2')
+    for i in range(1, audio + 1):
+        q.put(f'a{i}')
+
+
+def test_drop_oldest_keeps_the_newest_audio():
+    q = BoundedQueue(4, 'drop_oldest', droppable=is_audio)
+    fill(q)
+    assert q.dropped == 6
+    assert drain(q) == ['c1', 'c2', 'a7', 'a8']
+
+
+def test_drop_newest_keeps_the_oldest_audio():
+    q = BoundedQueue(4, 'drop_newest', droppable=is_audio)
+    fill(q)
+    assert q.dropped == 6
+    assert drain(q) == ['c1', 'c2', 'a1', 'a2']
+
+
+def test_coalesce_merges_into_the_newest_audio():
+    q = BoundedQueue(4, 'coalesce', droppable=is_audio, coalesce=lambda a, b: a + '+' + b)
+    fill(q)
+    assert (q.coalesced, q.dropped) == (6, 0)
+    assert drain(q) == ['c1', 'c2', 'a1', 'a2+a3+a4+a5+a6+a7+a8']
+
+
+def test_coalesce_falls_back_to_drop_oldest():
+    q = BoundedQueue(4, 'coalesce', droppable=is_audio, coalesce=lambda a, b: None)
+    fill(q)
+    assert (q.coalesced, q.dropped) == (0, 6)
+    assert drain(q) == ['c1', 'c2', 'a7', 'a8']
+
+
+def test_control_items_go_over_the_bound():
+    for policy in ('drop_oldest', 'drop_newest', 'coalesce', 'block'):
+        q = BoundedQueue(2, policy, droppable=is_audio, coalesce=lambda a, b: a + b)
+        for i in range(5):
+            assert q.put(f'c{i}')
+        assert q.qsize() == 5
+        assert q.dropped == 0
+
+
+def test_block_waits_for_room():
+    q = BoundedQueue(2, 'block', droppable=is_audio)
+    q.put('a1')
+    q.put('a2')
+    assert q.put('a3', timeout=0.05) is False
+    assert q.dropped == 1
+
+    reader = threading.Timer(0.1, q.get)
+    reader.start()
+    assert q.put('a4', timeout=2)
+    reader.join()
+    assert q.blocked_s >= 0.05
+    assert drain(q) == ['a2', 'a4']
+
+
+def test_close_releases_a_blocked_producer():
+    q = BoundedQueue(1, 'block', droppable=is_audio)
+    q.put('a1')
+    threading.Timer(0.05, q.close).start()
+    assert q.put('a2')
+    assert q.qsize() == 2
+
+
+def test_max_age_expires_audio_but_not_control():
+    q = BoundedQueue(10, 'drop_oldest', max_age=0.05, droppable=is_audio)
+    q.put('a1')
+    q.put('c1')
+    q.put('a2')
+    time.sleep(0.1)
+    q.put('a3')
+    # Only stale audio at the head is expired: a1 goes, c1 is returned, then a2 goes once it reaches the head
+    assert q.get() == 'c1'
+    assert q.expired == 1
+    assert drain(q) == ['a3']
+    assert q.expired == 2
+
+
+def test_expiry_makes_room_before_the_policy_drops():
+    q = BoundedQueue(2, 'drop_newest', max_age=0.05, droppable=is_audio)
+    q.put('a1')
+    q.put('a2')
+    time.sleep(0.1)
+    assert q.put('a3')
+    assert (q.expired, q.dropped) == (2, 0)
+    assert drain(q) == ['a3']
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        BoundedQueue(1, 'drop_everything')
+
+
+class StalledConnection:
+    """ Stands in for a websocket-client connection; send() blocks until `released` is set. """
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.closed = threading.Event()
+        self.sent = []
+
+    def send(self, data):
+        self.released.wait()
+        self.sent.append(data)
+
+    def recv(self):
+        self.closed.wait()
+        raise OSError('closed')
+
+    def send_close(self):
+        self.closed.set()
+
+    def shutdown(self):
+        self.closed.set()
+
+    abort = shutdown
+
+
+class StalledSocket(Socket):
+    def __init__(self, **kwargs):
+        super().__init__('test-key', 'ws://unused', reconnect=False, **kwargs)
+        self.connection = StalledConnection()
+
+    def _open(self):
+        return self.connection
+
+
+def stall(socket, audio=20):
+    """ Send one control message the writer gets stuck on, then a control message and `audio` mic chunks behind it. """
+    socket.connect()
+    socket.send({'type': 'session.update', 'session': {}})
+    assert wait_for(lambda: socket.send_queue.qsize() == 0)  # The writer holds it and blocks in send()
+    socket.send({'type': 'response.create', 'response': {}})
+    for i in range(audio):
+        socket.send(Codec.encode_audio_append(bytes([i]) * 4))
+
+
+def release(socket, expected):
+    socket.connection.released.set()
+    assert wait_for(lambda: len(socket.connection.sent) == expected)
+    socket.kill()
+    return [json.loads(data) for data in socket.connection.sent]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def audio_of(event):
+    return base64.b64decode(event['audio'])
+
+
+@pytest.mark.parametrize('policy, kept, dropped', [
+    ('drop_oldest', range(16, 20), 16),
+    ('drop_newest', range(0, 4), 16),
+])
+def test_stalled_writer_drops_audio_by_policy(policy, kept, dropped):
+    socket = StalledSocket(send_queue_size=5, send_overflow=policy)
+    stall(socket)
+    assert socket.send_queue.dropped == dropped
+    events = release(socket, 2 + len(kept))
+    assert [event['type'] for event in events[:2]] == ['session.update', 'response.create']
+    assert [audio_of(event)[0] for event in events[2:]] == list(kept)
+    assert socket.metrics.snapshot()['send_dropped_total'] == dropped
+
+
+def test_stalled_writer_coalesces_audio():
+    socket = StalledSocket(send_queue_size=5, send_overflow='coalesce')
+    stall(socket)
+    assert (socket.send_queue.coalesced, socket.send_queue.dropped) == (16, 0)
+    events = release(socket, 6)
+    audio = b''.join(audio_of(event) for event in events[2:])
+    assert audio == b''.join(bytes([i]) * 4 for i in range(20))  # Every chunk, in order, in fewer frames
+    assert len(audio_of(events[-1])) == 17 * 4
+    assert socket.metrics.snapshot()['send_coalesced_total'] == 16
+
+
+def test_coalescing_decodes_each_chunk_once_and_stops_at_the_cap():
+    frames = [Codec.encode_audio_append(bytes([i]) * 4) for i in range(4)]
+    merged = Codec.merge_audio_appends(frames[0], frames[1])
+    assert Codec.merge_audio_appends(merged, frames[2]) is merged  # Extended in place
+    assert Codec.to_wire(merged) == Codec.encode_audio_append(b''.join(bytes([i]) * 4 for i in range(3)))
+    assert Codec.is_audio_append(merged)
+    assert Codec.merge_audio_appends(merged, frames[3], max_bytes=14) is None
+    assert len(merged.audio) == 12
+
+
+def test_stalled_writer_stops_coalescing_at_the_cap(monkeypatch):
+    monkeypatch.setattr(Codec, 'MERGED_AUDIO_MAX', 8)
+    socket = StalledSocket(send_queue_size=5, send_overflow='coalesce')
+    stall(socket)
+    assert socket.send_queue.coalesced > 0 and socket.send_queue.dropped > 0  # Full merges give way to drop_oldest
+    events = release(socket, 1 + socket.send_queue.qsize())  # The stuck message, then everything queued
+    assert all(len(audio_of(event)) <= 8 for event in events[2:])
+
+
+def test_stalled_writer_skips_audio_past_the_deadline():
+    socket = StalledSocket(send_queue_size=100, audio_deadline_ms=50)
+    stall(socket, audio=5)
+    time.sleep(0.1)
+    events = release(socket, 2)
+    assert [event['type'] for event in events] == ['session.update', 'response.create']
+    assert socket.send_queue.expired == 5
+    assert socket.metrics.snapshot()['send_expired_total'] == 5
+
+
+def test_async_queue_block_waits_for_room_without_stalling_put():
+    async def run():
+        q = AsyncBoundedQueue(2, 'block', droppable=is_audio)
+        fill(q, audio=2)
+        assert q.qsize() == 4  # put() never waits on the loop: past the bound, nothing dropped
+        waiter = asyncio.create_task(q.wait_for_room())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert [await q.get() for _ in range(3)] == ['c1', 'c2', 'a1']
+        await asyncio.wait_for(waiter, 1)
+
+        getter = asyncio.create_task(q.get())
+        q.get_nowait()
+        await asyncio.sleep(0.01)
+        assert not getter.done()
+        q.put('a3')
+        assert await asyncio.wait_for(getter, 1) == 'a3'
+
+    asyncio.run(run())
+
+
+class StalledAsyncConnection:
+    """ Blocks every send() until released; receives nothing, or fails with `recv_error`. """
+
+    def __init__(self, recv_error=None):
+        self.sent = []
+        self.released = asyncio.Event()
+        self.recv_error = recv_error
+
+    async def send(self, data, text=True):
+        await self.released.wait()
+        self.sent.append(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.recv_error:
+            raise self.recv_error
+        await asyncio.Event().wait()
+
+    async def close(self):
+        pass
+
+
+class StalledAsyncSocket(AsyncSocket):
+    def __init__(self, connection=None, **kwargs):
+        super().__init__('test-key', 'ws://unused', reconnect=False, **kwargs)
+        self.connection = connection or StalledAsyncConnection()
+
+    async def _open(self):
+        return self.connection
+
+
+@pytest.mark.parametrize('policy, kept, dropped', [
+    ('drop_oldest', range(16, 20), 16),
+    ('drop_newest', range(0, 4), 16),
+])
+def test_stalled_async_writer_drops_audio_by_policy(policy, kept, dropped):
+    async def run():
+        socket = StalledAsyncSocket(send_queue_size=5, send_overflow=policy, send_batch_max=1)
+        await socket.connect()
+        socket.send({'type': 'session.update', 'session': {}})
+        await asyncio.sleep(0.01)  # The writer takes it and blocks in send()
+        socket.send({'type': 'response.create', 'response': {}})
+        for i in range(20):
+            socket.send(Codec.encode_audio_append(bytes([i]) * 4))
+        assert socket.send_queue.qsize() == 5
+        assert socket.metrics.snapshot()['send_dropped_total'] == dropped
+
+        socket.connection.released.set()
+        for _ in range(100):
+            if len(socket.connection.sent) == 2 + len(kept):
+                break
+            await asyncio.sleep(0.01)
+        await socket.kill()
+        events = [json.loads(data) for data in socket.connection.sent]
+        assert [audio_of(event)[0] for event in events[2:]] == list(kept)
+
+    asyncio.run(run())
+
+
+def test_async_drain_waits_for_room_under_block():
+    async def run():
+        socket = StalledAsyncSocket(send_queue_size=3, send_overflow='block', send_batch_max=1)
+        await socket.connect()
+        for i in range(4):
+            socket.send(Codec.encode_audio_append(bytes([i]) * 4))
+        await asyncio.sleep(0.01)
+        drained = asyncio.create_task(socket.drain())
+        await asyncio.sleep(0.01)
+        assert not drained.done()  # Writer stuck on chunk 0, chunks 1-3 fill the queue
+        socket.connection.released.set()
+        await asyncio.wait_for(drained, 1)
+        await socket.kill()
+        assert socket.send_queue.dropped == 0
+
+    asyncio.run(run())
+
+
+def test_async_reader_error_reports_the_disconnect():
+    async def run():
+        socket = StalledAsyncSocket(StalledAsyncConnection(recv_error=ValueError('bad frame')))
+        reasons = []
+        socket.on_disconnect = reasons.append
+        await socket.connect()
+        await asyncio.sleep(0.01)
+        assert reasons == ['bad frame']
+        assert not socket.connected
+        await socket.kill()
+
+    asyncio.run(run())
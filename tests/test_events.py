@@ -0,0 +1,49 @@
+""" Routing of server frames: audio deltas ahead of the dispatch table, everything else through it. """
+import base64
+import json
+
+import pytest
+
+import Codec
+from AudioBackends import ClockedBackend, NullSink
+from Realtime import Realtime
+
+
+@pytest.fixture
+def session():
+    return Realtime('test-key', 'ws://unused', audio_backend=ClockedBackend(sink=NullSink()))
+
+
+def frame(event_type, **fields):
+    return json.dumps({'type': event_type, 'event_id': 'event_1', **fields}, separators=(',', ':'))
+
+
+def test_decode_audio_delta_only_takes_audio_deltas():
+    pcm = bytes(range(48))
+    delta = frame('response.audio.delta', response_id='resp_1', item_id='item_1', delta=base64.b64encode(pcm).decode())
+    assert Codec.decode_audio_delta(delta) == Codec.decode_event(delta)
+    assert Codec.decode_audio_delta(delta.encode())['audio'] == pcm
+    assert Codec.decode_audio_delta(frame('response.audio_transcript.delta', delta='Hi')) is None
+
+
+def test_audio_deltas_reach_playback_and_subscribers(session):
+    typed, raw, every = [], [], []
+    session.on('response.audio.delta', typed.append)
+    session.on('response.audio.delta', raw.append, typed=False)
+    session.on('*', every.append, typed=False)
+    message = {'type': 'response.audio.delta', 'response_id': 'resp_1', 'item_id': 'item_1', 'audio': bytes(960)}
+    session.handle_message(message)
+    session.handle_message({'type': 'response.audio.done', 'response_id': 'resp_1', 'item_id': 'item_1'})
+
+    assert len(session.audio_io.audio_buffer) == 960
+    assert [event.audio for event in typed] == [bytes(960)]
+    assert raw == [message]
+    assert [m['type'] for m in every] == ['response.audio.delta', 'response.audio.done']
+
+
+def test_a_failing_audio_handler_does_not_stop_the_others(session):
+    session.on('response.audio.delta', lambda event: 1 / 0)
+    session._audio_delta_handlers = (lambda message: 1 / 0,) + session._audio_delta_handlers
+    session.handle_message({'type': 'response.audio.delta', 'response_id': 'resp_1', 'item_id': 'item_1',
+                            'audio': bytes(960)})
+    assert len(session.audio_io.audio_buffer) == 960
@@ -0,0 +1,129 @@
+""" Realtime.interrupt() and the cancelled-item bookkeeping, driven with server events and no connection. """
+import pytest
+
+import Realtime as realtime_module
+from AudioBackends import ClockedBackend, NullSink
+from Realtime import Realtime
+
+
+@pytest.fixture
+def session():
+    session = Realtime('test-key', 'ws://unused', audio_backend=ClockedBackend(sink=NullSink()))
+    session.sent = []
+    session.socket.send = session.sent.append
+    return session
+
+
+def interrupt(session):
+    """ interrupt(), then the flush the speaker thread would do on its next callback. """
+    interrupted = session.interrupt()
+    if session.audio_io._flush_requested_at is not None:
+        session.audio_io._flush_playback_now()
+    return interrupted
+
+
+def delta(item_id, response_id='resp_1', n=4800):
+    return {'type': 'response.audio.delta', 'response_id': response_id, 'item_id': item_id, 'content_index': 0,
+            'audio': bytes(n)}
+
+
+def test_late_deltas_for_interrupted_items_are_dropped(session):
+    session.handle_message({'type': 'response.created', 'response': {'id': 'resp_1'}})
+    session.handle_message(delta('item_1'))
+    assert interrupt(session)
+    assert list(session._cancelled_items) == ['item_1']
+
+    buffered = len(session.audio_io.audio_buffer)
+    session.handle_message(delta('item_1'))
+    assert len(session.audio_io.audio_buffer) == buffered
+
+
+def test_cancelled_items_are_pruned(session):
+    session.handle_message(delta('item_1'))
+    interrupt(session)
+    session.handle_message({'type': 'response.done', 'response': {'id': 'resp_1', 'status': 'cancelled',
+                                                                  'output': [{'id': 'item_1', 'type': 'message'}]}})
+    assert session._cancelled_items == {}
+
+    session.handle_message(delta('item_2', 'resp_2'))
+    interrupt(session)
+    session.handle_message({'type': 'conversation.item.deleted', 'item_id': 'item_2'})
+    assert session._cancelled_items == {}
+
+
+def test_cancelled_items_are_bounded(session):
+    total = realtime_module.CANCELLED_ITEMS + 10
+    for i in range(total):
+        session.handle_message(delta(f'item_{i}', f'resp_{i}'))
+        interrupt(session)
+    assert len(session._cancelled_items) == realtime_module.CANCELLED_ITEMS
+    assert next(iter(session._cancelled_items)) == 'item_10'  # The oldest went first
+
+
+def play(session, callbacks=1):
+    """ Run the speaker callback as the device would. """
+    for _ in range(callbacks):
+        session.audio_io._spkr_callback(None, session.audio_io.chunk_size, None, None)
+
+
+def types(session):
+    return [message['type'] for message in session.sent]
+
+
+def test_nothing_to_interrupt(session):
+    assert not interrupt(session)
+    assert session.sent == []
+    assert session.interruptions == 0
+
+
+def test_interrupt_before_any_audio_cancels_without_truncating(session):
+    reports = []
+    session.on_interrupt = reports.append
+    session.handle_message({'type': 'response.created', 'response': {'id': 'resp_1'}})
+    assert interrupt(session)
+    assert types(session) == ['response.cancel']
+    assert reports and 'item_id' not in reports[0]
+
+    session.handle_message(delta('item_1'))  # Already in flight when the cancel went out
+    assert len(session.audio_io.audio_buffer) == 0
+    assert not interrupt(session)  # That response is already cancelled
+
+    session.handle_message({'type': 'response.done', 'response': {'id': 'resp_1', 'status': 'cancelled'}})
+    assert session._responses == {}
+
+
+def test_interrupt_while_prebuffering_flushes_without_truncating(session):
+    session.handle_message({'type': 'response.created', 'response': {'id': 'resp_1'}})
+    session.handle_message(delta('item_1', n=480))  # Below the jitter buffer's target, so nothing has played
+    play(session)
+    assert len(session.audio_io.audio_buffer) == 480
+    assert interrupt(session)
+    assert types(session) == ['response.cancel']
+    assert len(session.audio_io.audio_buffer) == 0
+
+
+def test_interrupt_mid_playback_truncates_to_what_was_played(session):
+    reports = []
+    session.on_interrupt = reports.append
+    session.handle_message({'type': 'response.created', 'response': {'id': 'resp_1'}})
+    for _ in range(3):
+        session.handle_message(delta('item_1'))
+    play(session, 2)
+    assert interrupt(session)
+    assert types(session) == ['response.cancel', 'conversation.item.truncate']
+    truncate = session.sent[1]
+    played_ms = 2 * session.audio_io.chunk_size * 1000 // session.audio_io.rate
+    assert (truncate['item_id'], truncate['audio_end_ms']) == ('item_1', played_ms)
+    assert reports[0]['audio_end_ms'] == played_ms
+
+
+def test_interrupt_during_playout_after_response_done_only_truncates(session):
+    session.handle_message({'type': 'response.created', 'response': {'id': 'resp_1'}})
+    for _ in range(3):
+        session.handle_message(delta('item_1'))
+    session.handle_message({'type': 'response.done', 'response': {'id': 'resp_1', 'status': 'completed',
+                                                                  'output': [{'id': 'item_1', 'type': 'message'}]}})
+    play(session, 2)
+    assert interrupt(session)
+    assert types(session) == ['conversation.item.truncate']  # No response.cancel for a finished response
+    assert len(session.audio_io.audio_buffer) == 0
@@ -0,0 +1,147 @@
+""" JitterBuffer on a controlled clock: target adaptation, underrun growth, shrinking when stable, and gap fades. """
+import struct
+
+import pytest
+
+import JitterBuffer as jitter_buffer_module
+from JitterBuffer import GROW_MS, INITIAL_MS, JitterBuffer, MAX_MS, MIN_MS, SHRINK_AFTER, SHRINK_MS
+
+RATE = 24000
+CHUNK_MS = 20
+CHUNK_BYTES = RATE * CHUNK_MS // 1000 * 2
+
+
+class Clock:
+    """ Stands in for the time module: monotonic() returns `now`, moved on by the test. """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jitter_buffer_module, 'time', clock)
+    return clock
+
+
+def make_buffer(**kwargs):
+    return JitterBuffer(RATE * 10 * 2, RATE, **kwargs)
+
+
+def pcm(ms, value=1000):
+    return struct.pack('<h', value) * (RATE * ms // 1000)
+
+
+def read(buffer, ms=CHUNK_MS):
+    out = bytearray(RATE * ms // 1000 * 2)
+    n = buffer.read_into(out)
+    return n, list(struct.unpack(f'<{len(out) // 2}h', out))
+
+
+def test_steady_arrivals_keep_the_initial_target(clock):
+    buffer = make_buffer()
+    for _ in range(50):
+        buffer.write(pcm(CHUNK_MS))
+        clock.now += CHUNK_MS / 1000
+    assert buffer.jitter_ms == pytest.approx(0.0, abs=1e-6)
+    assert buffer.target_ms == INITIAL_MS
+
+
+def test_jittery_arrivals_raise_the_target_to_cover_the_jitter(clock):
+    buffer = make_buffer()
+    buffer.write(pcm(40))
+    for i in range(40):  # 40 ms chunks arriving 0 ms and 80 ms apart: each one 40 ms off
+        clock.now += 0.08 if i % 2 else 0.0
+        buffer.write(pcm(40))
+    expected = 40 * (1 - (15 / 16) ** 40)
+    assert buffer.jitter_ms == pytest.approx(expected)
+    assert buffer.target_ms == pytest.approx(3 * expected)
+    assert buffer.target_ms > INITIAL_MS
+
+
+def test_the_target_is_capped_and_a_long_gap_starts_a_new_stream(clock):
+    buffer = make_buffer()
+    buffer.write(pcm(20))
+    for _ in range(3):
+        clock.now += 0.9  # 880 ms late, but still the same stream
+        buffer.write(pcm(20))
+    assert buffer.target_ms == MAX_MS
+    jitter = buffer.jitter_ms
+    clock.now += 5.0  # A new stream, not jitter
+    buffer.write(pcm(20))
+    assert buffer.jitter_ms == jitter
+
+
+def test_playback_waits_for_the_target_and_reports_the_wait(clock):
+    buffer = make_buffer()
+    for _ in range(2):
+        buffer.write(pcm(CHUNK_MS))
+        clock.now += CHUNK_MS / 1000
+        assert read(buffer)[0] == 0  # Less than INITIAL_MS
+    buffer.write(pcm(CHUNK_MS))
+    assert read(buffer)[0] == CHUNK_BYTES
+    assert buffer.stats()['added_latency_ms_max'] == pytest.approx(2 * CHUNK_MS)
+
+
+def test_each_underrun_grows_the_target_up_to_the_cap(clock):
+    buffer = make_buffer()
+    targets = []
+    while buffer.target_ms < MAX_MS:
+        buffer.write(pcm(buffer.target_ms))  # Exactly the target, then read until it runs dry
+        clock.now += buffer.target_ms / 1000  # On time: no jitter
+        while read(buffer)[0] == CHUNK_BYTES:
+            pass
+        targets.append(buffer.target_ms)
+    assert targets == list(range(INITIAL_MS + GROW_MS, MAX_MS, GROW_MS)) + [MAX_MS]
+    assert buffer.underruns == len(targets)
+
+
+def test_the_end_of_a_response_plays_out_without_an_underrun(clock):
+    buffer = make_buffer()
+    buffer.write(pcm(30))
+    buffer.mark_end()
+    assert read(buffer)[0] == CHUNK_BYTES  # Below the target, played anyway
+    n, samples = read(buffer)
+    assert n == CHUNK_BYTES // 2
+    assert samples[n // 2 - 1] == 1000  # Not faded
+    assert (buffer.underruns, buffer.target_ms) == (0, INITIAL_MS)
+
+
+def test_a_stable_stretch_shrinks_the_target_down_to_the_floor(clock):
+    buffer = make_buffer(initial_ms=MIN_MS + 2 * SHRINK_MS)
+    buffer.write(pcm(9000))
+    targets = []
+    for _ in range(3):
+        before = buffer.target_ms
+        for _ in range(SHRINK_AFTER - 1):
+            read(buffer, 10)
+        assert buffer.target_ms == before
+        read(buffer, 10)
+        targets.append(buffer.target_ms)
+    assert targets == [MIN_MS + SHRINK_MS, MIN_MS, MIN_MS]
+
+
+def test_a_gap_is_faded_out_and_the_next_audio_faded_in(clock):
+    buffer = make_buffer()
+    buffer.write(pcm(70))
+    for _ in range(3):
+        read(buffer)
+    n, samples = read(buffer)  # 10 ms left for a 20 ms read
+    played = n // 2
+    fade = buffer.fade_samples
+    assert played == RATE * 10 // 1000 and buffer.underruns == 1
+    assert samples[:played - fade] == [1000] * (played - fade)
+    assert samples[played - fade:played] == [int(1000 * (i / fade)) for i in reversed(range(fade))]
+    assert samples[played:] == [0] * (len(samples) - played)
+
+    buffer.write(pcm(buffer.target_ms))
+    n, samples = read(buffer)
+    assert n == CHUNK_BYTES
+    assert samples[:fade] == [int(1000 * (i / fade)) for i in range(fade)]
+    assert samples[fade:] == [1000] * (len(samples) - fade)
+    n, samples = read(buffer)
+    assert samples == [1000] * len(samples)  # Only the first chunk after the gap
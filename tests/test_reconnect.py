@@ -0,0 +1,95 @@
+""" Realtime against a MockServer that aborts its connections: replay, held messages and mic audio across reconnects. """
+import collections
+import struct
+import time
+
+import pytest
+
+from AudioBackends import ClockedBackend, NullSink
+from AudioIO import CHUNK_SIZE
+from MockServer import MockServer
+from Realtime import Realtime
+
+CHUNK_BYTES = CHUNK_SIZE * 2
+
+
+class SequencedSource:
+    """ Mic source whose chunks start with their sequence number. """
+
+    def __init__(self):
+        self.seq = 0
+
+    def read(self, frame_count):
+        self.seq += 1
+        return struct.pack('<I', self.seq) + bytes(frame_count * 2 - 4)
+
+
+@pytest.fixture
+def delivered():
+    return collections.Counter()  # Mic chunk sequence number -> times the server received it
+
+
+@pytest.fixture
+def server(delivered):
+    def on_append(pcm, arrived_at):
+        for offset in range(0, len(pcm) - 3, CHUNK_BYTES):
+            delivered[struct.unpack_from('<I', pcm, offset)[0]] += 1
+
+    server = MockServer(on_append=on_append, response_ms=200)
+    server.start()
+    yield server
+    server.stop()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.mark.parametrize('stale_audio', ['drop', 'keep'])
+def test_reconnect_replays_state_without_duplicates(server, delivered, stale_audio):
+    source = SequencedSource()
+    session = Realtime('test-key', server.url, socket_options={'stale_audio': stale_audio},
+                       audio_backend=ClockedBackend(source, NullSink()))
+    disconnects, reconnects = [], []
+    note = {'type': 'message', 'role': 'user', 'content': [{'type': 'input_text', 'text': 'While you were away'}]}
+
+    def on_disconnect(reason):
+        disconnects.append(reason)
+        if len(disconnects) == 1:
+            session.add_item(note)  # Queued while the connection is down, so the replay already carries it
+
+    session.on_disconnect = on_disconnect
+    session.on_reconnect = reconnects.append
+    session.start()
+    try:
+        session.update_session({'instructions': 'Be brief.'})
+        session.add_item({'type': 'message', 'role': 'user', 'content': [{'type': 'input_text', 'text': 'Hi'}]})
+        assert wait_for(lambda: server.received['conversation.item.create'] == 1)
+        assert wait_for(lambda: len(session._items) == 2)  # The reply to the initial response.create is remembered
+        assert wait_for(lambda: len(delivered) >= 5)
+
+        for expected in (1, 2):
+            server.drop_connections()
+            assert wait_for(lambda: len(reconnects) == expected)
+            seen = len(delivered)
+            assert wait_for(lambda: len(delivered) >= seen + 5)  # Mic audio flows again on the new connection
+    finally:
+        session.stop()
+
+    assert len(disconnects) == 2
+    assert all(isinstance(reason, str) for reason in disconnects)
+    # Each replay: the merged session settings, then 'Hi', the reply and the note; the queued note is not sent again
+    assert [info['replayed'] for info in reconnects] == [4, 4]
+    assert server.connections == 3
+    assert server.received['session.update'] == 3
+    assert server.received['conversation.item.create'] == 1 + 3 + 3
+    assert session.socket.replay_skipped == 1
+    assert session.metrics.snapshot()['replay_skipped_total'] == 1
+
+    duplicates = {seq: n for seq, n in delivered.items() if n > 1}
+    assert duplicates == {}
@@ -0,0 +1,60 @@
+""" Recorder: what a recording holds, and what recording costs the speaker callback. """
+import tracemalloc
+
+from AudioBackends import ClockedBackend, NullSink
+from AudioIO import AudioIO
+from Recording import MIC, SPEAKER, Recorder, read_records
+
+
+def make_audio_io(tmp_path, chunk_size=1024):
+    audio_io = AudioIO(chunk_size=chunk_size, backend=ClockedBackend(sink=NullSink()), jitter_buffer=False)
+    audio_io.recorder = Recorder(str(tmp_path / 'session.rec'))
+    return audio_io
+
+
+def test_speaker_audio_is_recorded_as_played(tmp_path):
+    audio_io = make_audio_io(tmp_path)
+    played = []
+    for i in range(5):  # Each callback reuses the same output buffer
+        audio_io.receive_audio(bytes([i + 1]) * (audio_io.chunk_size * 2))
+        out, _ = audio_io._spkr_callback(None, audio_io.chunk_size, None, None)
+        played.append(bytes(out))
+    audio_io._mic_callback(b'\x07' * 16, 8, None, None)
+    audio_io.recorder.close()
+
+    records = list(read_records(audio_io.recorder.path))
+    assert [data for kind, _, data in records if kind == SPEAKER] == played
+    assert [data for kind, _, data in records if kind == MIC] == [b'\x07' * 16]
+    assert audio_io.recorder.speaker_dropped_bytes == 0
+
+
+def test_speaker_audio_past_the_ring_is_cut(tmp_path):
+    recorder = Recorder(str(tmp_path / 'session.rec'), flush_ms=60_000, speaker_ring_bytes=10)
+    recorder.speaker(b'\x01' * 6)
+    recorder.speaker(b'\x02' * 6)
+    recorder.close()
+    assert [data for kind, _, data in read_records(recorder.path)] == [b'\x01' * 6, b'\x02' * 4]
+    assert recorder.speaker_dropped_bytes == 2
+
+
+def test_recording_does_not_copy_the_chunk_on_the_speaker_thread(tmp_path):
+    chunk_size = 8192
+    audio_io = make_audio_io(tmp_path, chunk_size)
+    audio_io.recorder._stop_event.set()  # Hold the writer thread so only the callback allocates
+    audio_io.recorder._thread.join()
+    for _ in range(300):
+        audio_io.receive_audio(bytes(chunk_size * 2))
+        audio_io._spkr_callback(None, chunk_size, None, None)
+        audio_io.recorder._drain()
+
+    audio_io.receive_audio(bytes(chunk_size * 2 * 20))
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(20):
+            audio_io._spkr_callback(None, chunk_size, None, None)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    audio_io.recorder.close()
+    assert peak - baseline < chunk_size * 2
@@ -0,0 +1,53 @@
+""" RingBuffer positions and copies across wraparound, overflow and clear. """
+import pytest
+
+from RingBuffer import RingBuffer
+
+
+@pytest.fixture
+def ring():
+    return RingBuffer(10)
+
+
+def read(ring, n):
+    out = bytearray(n)
+    return bytes(out[:ring.read_into(out)])
+
+
+def test_writes_and_reads_wrap_around_the_end(ring):
+    assert ring.write(b'abcdefg') == 7
+    assert read(ring, 7) == b'abcdefg'
+    assert ring.write(b'hijklm') == 6  # 3 bytes at the end, 3 at the start
+    assert (ring.write_pos, ring.read_pos, len(ring), ring.free()) == (13, 7, 6, 4)
+    assert read(ring, 4) == b'hijk'
+    assert read(ring, 10) == b'lm'
+    assert len(ring) == 0
+
+
+def test_a_full_ring_takes_what_fits_and_counts_the_rest(ring):
+    assert ring.write(b'0123456') == 7
+    assert ring.write(memoryview(b'789ab')) == 3
+    assert (ring.overflow_bytes, ring.high_water, ring.free()) == (2, 10, 0)
+    assert ring.write(b'x') == 0
+    assert ring.overflow_bytes == 3
+    assert read(ring, 20) == b'0123456789'
+    assert ring.high_water == 10
+
+
+def test_an_empty_ring_reads_nothing_and_leaves_the_buffer_alone(ring):
+    out = bytearray(b'untouched')
+    assert ring.read_into(out) == 0
+    assert out == b'untouched'
+    ring.write(b'abc')
+    ring.clear()
+    assert ring.read_into(out) == 0
+    assert (len(ring), ring.free()) == (0, 10)
+
+
+def test_reads_into_any_writable_buffer_and_writes_from_int16_views(ring):
+    samples = memoryview(bytearray(4)).cast('h')
+    samples[0], samples[1] = 1, -2
+    ring.write(samples)
+    out = memoryview(bytearray(6))
+    assert ring.read_into(out[2:]) == 4
+    assert bytes(out) == b'\x00\x00' + bytes(samples.cast('B'))
@@ -0,0 +1,127 @@
+""" SessionPool against the local MockServer: pre-warming, the connect cap, reuse and teardown. """
+import asyncio
+import time
+
+import pytest
+
+from AsyncRealtime import AsyncRealtime
+from AudioBackends import ClockedBackend, NullSink
+from MockServer import MockServer
+from SessionPool import SessionPool
+
+
+@pytest.fixture
+def server():
+    server = MockServer(handshake_ms=100)
+    server.start()
+    yield server
+    server.stop()
+
+
+def make_pool(server, **kwargs):
+    return SessionPool('test-key', server.url, session_kwargs=lambda: {'audio_backend': ClockedBackend(sink=NullSink())},
+                       **kwargs)
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+def test_warm_sessions_skip_the_handshake(server):
+    async def run():
+        pool = make_pool(server, warm_sessions=2)
+        await pool.warm_up()
+        assert pool.stats()['idle'] == 2
+        assert await wait_for(lambda: server.connections == 2)
+
+        sessions = await asyncio.gather(*(pool.acquire() for _ in range(3)))
+        stats = pool.stats()
+        assert (stats['warm_hits'], stats['cold_starts']) == (2, 1)
+        assert stats['active'] == 3
+        assert len(stats['sessions']) == 3
+        assert all(entry['connected'] for entry in stats['sessions'])
+
+        await pool.release(sessions[0])
+        assert pool.stats()['active'] == 2
+        assert pool.closed == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_connect_cap_holds_under_parallel_acquires(server):
+    async def run():
+        pool = make_pool(server, warm_sessions=0, max_concurrent_connects=2)
+        started_at = time.monotonic()
+        await asyncio.gather(*(pool.acquire() for _ in range(6)))
+        elapsed = time.monotonic() - started_at
+        assert pool.cold_starts == 6
+        assert server.max_handshakes_in_flight == 2
+        assert elapsed >= 0.3  # Three rounds of two 100 ms handshakes
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_session_limit(server):
+    async def run():
+        pool = make_pool(server, warm_sessions=0, max_sessions=2)
+        await pool.acquire()
+        await pool.acquire()
+        with pytest.raises(RuntimeError):
+            await pool.acquire()
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_acquires_stop_at_the_session_limit(server):
+    async def run():
+        pool = make_pool(server, warm_sessions=0, max_sessions=3)
+        results = await asyncio.gather(*(pool.acquire() for _ in range(8)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        assert len(errors) == 5
+        assert all(isinstance(error, RuntimeError) for error in errors)
+        assert (pool.opened, pool.stats()['active'], pool.stats()['opening']) == (3, 3, 0)
+        assert server.connections == 3
+        await pool.close()
+
+    asyncio.run(run())
+
+
+class FailingStart(AsyncRealtime):
+    async def start(self):
+        raise ConnectionError('start failed')
+
+
+def test_a_session_that_fails_to_start_gives_its_slot_back(server):
+    async def run():
+        pool = SessionPool('test-key', server.url, warm_sessions=0, max_sessions=1, session_factory=FailingStart,
+                           session_kwargs=lambda: {'audio_backend': ClockedBackend(sink=NullSink())})
+        for _ in range(2):  # The second acquire would hit the limit if the first leaked its slot
+            with pytest.raises(ConnectionError):
+                await pool.acquire()
+        assert (pool.stats()['active'], pool.opened, pool.closed) == (0, 2, 2)
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_close_tears_down_idle_and_active_sessions(server):
+    async def run():
+        pool = make_pool(server, warm_sessions=2)
+        await pool.warm_up()
+        session = await pool.acquire()
+        await pool.close()
+        stats = pool.stats()
+        assert (stats['active'], stats['idle']) == (0, 0)
+        assert pool.closed == pool.opened
+        assert not session.socket.connected
+        assert await wait_for(lambda: not server._live), 'the server still has open connections'
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+""" SharedRing across wraparound, full and empty, and ShardedRunner moving audio through it from spawned workers. """
+import time
+
+import pytest
+
+from AudioBackends import NullSink, PcmSource
+from MockServer import MockServer
+from SharedRing import RingSource, SharedRing
+from ShardedRunner import ShardedRunner
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(10)
+    yield ring
+    ring.close()
+
+
+def read(ring, n):
+    out = bytearray(n)
+    return bytes(out[:ring.read_into(out)])
+
+
+def wait_for(condition, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_writes_and_reads_wrap_around_the_end(ring):
+    assert ring.write(b'abcdefg') == 7
+    assert read(ring, 7) == b'abcdefg'
+    assert ring.write(b'hijklm') == 6  # 3 bytes at the end, 3 at the start
+    assert (ring.write_pos, ring.read_pos, len(ring)) == (13, 7, 6)
+    assert read(ring, 4) == b'hijk'
+    assert read(ring, 10) == b'lm'
+    assert len(ring) == 0
+
+
+def test_a_full_ring_takes_what_fits_and_counts_the_rest(ring):
+    assert ring.write(b'0123456') == 7
+    assert ring.write(b'789ab') == 3
+    assert ring.overflow_bytes == 2
+    assert ring.free() == 0
+    assert ring.write(b'x') == 0
+    assert ring.overflow_bytes == 3
+    assert read(ring, 20) == b'0123456789'
+
+
+def test_an_empty_ring_reads_nothing(ring):
+    out = bytearray(b'untouched')
+    assert ring.read_into(out) == 0
+    assert out == b'untouched'
+    ring.write(b'abc')
+    ring.clear()
+    assert ring.read_into(out) == 0
+    assert ring.free() == ring.capacity
+
+
+def test_an_attached_ring_shares_data_and_positions(ring):
+    other = SharedRing(name=ring.name)
+    try:
+        assert other.capacity == ring.capacity
+        ring.write(b'abcdefgh')
+        assert read(other, 5) == b'abcde'
+        assert (ring.read_pos, ring.free()) == (5, 7)
+        other.write(b'ij')  # Either end sees the same ring
+        assert read(ring, 10) == b'fghij'
+    finally:
+        other.close()
+
+
+def test_ring_source_prebuffers_and_pads_underruns(ring):
+    source = RingSource(ring, prebuffer=1)
+    ring.write(b'\x01\x01\x02\x02')
+    assert source.read(2) == bytes(4)  # Waiting for a chunk more than it takes
+    ring.write(b'\x03\x03\x04\x04')
+    assert source.read(2) == b'\x01\x01\x02\x02'
+    assert source.read(2) == b'\x03\x03\x04\x04'
+    ring.write(b'\x05\x05')
+    assert source.read(2) == b'\x05\x05\x00\x00'
+    assert source.underruns == 1
+    ring.write(b'\x06\x06\x07\x07')
+    assert source.read(2) == bytes(4)  # Prebuffering again
+
+
+def test_sharded_session_sends_mic_audio_from_a_spawned_worker():
+    received = []
+    server = MockServer(on_append=lambda pcm, arrived_at: received.append(pcm))
+    server.start()
+    runner = ShardedRunner('test-key', server.url, workers=1, health_interval_s=3600)
+    runner.start()
+    try:
+        session = runner.add_session(PcmSource(b'\x01\x02' * 1024, loop=True), NullSink())
+        # Read from the ring by the worker and sent over its socket; silence until the ring has prebuffered
+        assert wait_for(lambda: b'\x01\x02' in b''.join(received))
+        assert session.speaker_ring.write_pos > 0
+
+        worker = session.worker
+        assert runner.check_health()[0]['alive']
+        worker.process.kill()
+        worker.process.join(5)
+        runner.check_health()  # Replaces the dead worker and starts the session on the new one
+        assert runner.restarts == 1
+        assert session.worker is runner.workers[0] and session.worker is not worker
+        received.clear()
+        assert wait_for(lambda: b'\x01\x02' in b''.join(received))
+    finally:
+        runner.close()
+        server.stop()
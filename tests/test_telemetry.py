@@ -0,0 +1,20 @@
+""" Payload rendering for wire logs: audio redacted to its length, whatever form the frame is in. """
+import Codec
+from Telemetry import render_payload
+
+
+def test_encoded_frames_are_redacted_alike():
+    frame = Codec.encode_audio_append(bytes(3000))
+    expected = '{"type":"input_audio_buffer.append","audio":"<4000 b64 chars>"}'
+    for raw in (frame, bytearray(frame), memoryview(frame), memoryview(bytearray(frame)), frame.decode()):
+        assert render_payload(raw, 'redact', 512) == expected
+    assert render_payload(frame, 'full', 0) == frame.decode()
+
+
+def test_server_deltas_and_dicts_are_redacted():
+    delta = '{"type":"response.audio.delta","item_id":"item_1","delta":"AAAA","content_index":0}'
+    assert render_payload(delta, 'redact', 512) == \
+        '{"type":"response.audio.delta","item_id":"item_1","delta":"<4 b64 chars>","content_index":0}'
+    assert render_payload({'type': 'response.audio.delta', 'audio': bytes(6)}, 'redact', 512) == \
+        '{"type": "response.audio.delta", "audio": "<6 bytes>"}'
+    assert render_payload('{"type":"session.created"}', 'redact', 512) == '{"type":"session.created"}'
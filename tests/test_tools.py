@@ -0,0 +1,168 @@
+""" ToolRegistry: argument assembly, timeouts, per-tool concurrency, and the round trip against MockServer. """
+import json
+import threading
+import time
+
+import pytest
+
+from AudioBackends import ClockedBackend, NullSink
+from MockServer import MockServer
+from Realtime import Realtime
+from Tools import ToolRegistry
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Calls:
+    """ A registry wired to lists instead of a socket. """
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        self.responses = 0
+        self.registry = ToolRegistry(send=self.sent.append, respond=self.respond, **kwargs)
+
+    def respond(self):
+        self.responses += 1
+
+    def outputs(self):
+        return {message['item']['call_id']: json.loads(message['item']['output']) for message in self.sent}
+
+    def call(self, name, arguments, call_id, response_id='resp_1', chunk=3):
+        """ Stream one call the way the server does: item added, argument deltas, then done without the arguments. """
+        registry = self.registry
+        registry.on_output_item_added({'item': {'type': 'function_call', 'call_id': call_id, 'name': name}})
+        text = json.dumps(arguments)
+        for i in range(0, len(text), chunk):
+            registry.on_arguments_delta({'call_id': call_id, 'delta': text[i:i + chunk]})
+        registry.on_arguments_done({'call_id': call_id, 'response_id': response_id})
+
+    def done(self, response_id='resp_1'):
+        self.registry.on_response_done({'response': {'id': response_id}})
+
+
+@pytest.fixture
+def calls():
+    calls = Calls()
+    yield calls
+    calls.registry.shutdown()
+
+
+def test_arguments_are_assembled_from_deltas(calls):
+    @calls.registry.register
+    def lookup(city, units='metric'):
+        return {'city': city, 'units': units}
+
+    calls.call('lookup', {'city': 'Oslo', 'units': 'imperial'}, 'call_1')
+    calls.done()
+    assert wait_for(lambda: calls.responses == 1)
+    assert calls.outputs() == {'call_1': {'city': 'Oslo', 'units': 'imperial'}}
+    assert calls.sent[0]['type'] == 'conversation.item.create'
+    assert calls.sent[0]['item']['type'] == 'function_call_output'
+
+
+def test_bad_arguments_and_unknown_tools_are_answered_with_errors(calls):
+    calls.registry.register(lambda: 'ok', name='noop')
+    calls.registry.on_arguments_done({'call_id': 'call_1', 'response_id': 'resp_1', 'name': 'noop',
+                                      'arguments': '[1, 2]'})
+    calls.call('missing', {}, 'call_2')
+    calls.done()
+    assert wait_for(lambda: calls.responses == 1)
+    outputs = calls.outputs()
+    assert outputs['call_1']['error'].startswith('Bad arguments')
+    assert outputs['call_2'] == {'error': 'Unknown tool: missing'}
+    assert calls.registry.metrics.snapshot()['tool_errors_total'] == 2
+
+
+def test_a_slow_tool_is_answered_with_a_timeout_once(calls):
+    release = threading.Event()
+
+    @calls.registry.register(timeout=0.05)
+    def slow():
+        release.wait(2)
+        return 'too late'
+
+    calls.call('slow', {}, 'call_1')
+    calls.done()
+    assert wait_for(lambda: calls.responses == 1)
+    assert calls.outputs() == {'call_1': {'error': 'slow timed out after 0.05 s'}}
+    release.set()
+    time.sleep(0.1)
+    assert len(calls.sent) == 1  # The late result is dropped
+    assert calls.registry.metrics.snapshot()['tool_timeouts_total'] == 1
+
+
+def test_max_concurrency_holds_calls_back():
+    calls = Calls(workers=4)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    @calls.registry.register(max_concurrency=2)
+    def work(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(n)
+        return n
+
+    for n in range(6):
+        calls.call('work', {'n': n}, f'call_{n}')
+    calls.done()
+    try:
+        assert wait_for(lambda: calls.responses == 1)
+        assert max(peak) == 2
+        assert calls.outputs() == {f'call_{n}': n for n in range(6)}
+        assert calls.responses == 1  # One response.create once every call of the response has finished
+    finally:
+        calls.registry.shutdown()
+
+
+def test_results_from_before_a_reconnect_are_discarded(calls):
+    release = threading.Event()
+    calls.registry.register(lambda: release.wait(2) and 'stale', name='wait')
+    calls.call('wait', {}, 'call_1')
+    calls.registry.reset()
+    release.set()
+    time.sleep(0.1)
+    calls.done()
+    assert calls.sent == []
+    assert calls.responses == 0
+
+
+def test_tool_call_round_trip_against_mock_server():
+    server = MockServer(response_ms=100, tool_call={'name': 'lookup', 'arguments': {'city': 'Oslo'}})
+    server.start()
+    try:
+        session = Realtime('test-key', server.url, audio_backend=ClockedBackend(sink=NullSink()))
+
+        @session.tools.register(parameters={'type': 'object', 'properties': {'city': {'type': 'string'}}})
+        def lookup(city):
+            """ Current weather for a city. """
+            return {'city': city, 'temperature_c': 21}
+
+        session.start()  # session.update declares the tool; the first response.create is answered with the call
+        try:
+            assert wait_for(lambda: server.responses == 2)  # The follow-up response.create after the output
+        finally:
+            session.stop()
+    finally:
+        server.stop()
+
+    assert len(server.tool_outputs) == 1
+    output = server.tool_outputs[0]
+    assert output['call_id'] == 'call_resp_1'
+    assert json.loads(output['output']) == {'city': 'Oslo', 'temperature_c': 21}
+    assert server.received['conversation.item.create'] == 1
+    assert server.received['response.create'] == 2
+    snapshot = session.metrics.snapshot()
+    assert snapshot['tool_calls_total'] == 1
+    assert snapshot['tool_errors_total'] == 0
@@ -0,0 +1,58 @@
+""" Transcripts fed the way the socket's reader feeds them, read from other threads. """
+import sys
+import threading
+import time
+
+from Transcripts import Transcripts
+
+
+def delta(text, item_id='item_1'):
+    return {'type': 'response.text.delta', 'response_id': 'resp_1', 'item_id': item_id, 'content_index': 0,
+            'delta': text}
+
+
+def test_deltas_are_joined_in_order():
+    transcripts = Transcripts()
+    for word in ('Hello', ' there', ','):
+        transcripts.on_text_delta(delta(word))
+    transcript = transcripts.get('item_1')
+    assert transcript.text == 'Hello there,'
+    transcripts.on_text_done({'item_id': 'item_1', 'content_index': 0, 'text': 'Hello there, friend.'})
+    assert transcript.done and transcript.text == 'Hello there, friend.'
+
+
+class SwitchingList(list):
+    """ Gives up the GIL on every store, so the threads interleave at the points that matter. """
+
+    def __setitem__(self, index, value):
+        time.sleep(0)
+        super().__setitem__(index, value)
+
+
+def test_reading_text_while_deltas_arrive_loses_nothing():
+    transcripts = Transcripts()
+    transcripts.on_text_delta(delta('0,'))
+    transcript = transcripts.get('item_1')
+    transcript.parts = SwitchingList(transcript.parts)
+    n = 20000
+    stop = threading.Event()
+    reads = []
+
+    def reader():
+        while not stop.is_set():
+            reads.append(len(transcript.text))
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Switch threads as often as possible, between the reader's steps
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(1, n):
+            transcripts.on_text_delta(delta(f'{i},'))
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+
+    assert transcript.text == ''.join(f'{i},' for i in range(n))
+    assert reads == sorted(reads)  # Every read saw a prefix of the final text